@@ -8,28 +8,41 @@ import concurrent.futures
 import csv
 import datetime
 import decimal
+import functools
 import hashlib
+import inspect
 import io
+import json
 import logging
 import operator
 import os
 import pathlib
+import queue
 import re
+import sqlite3
+import struct
 import sys
+import tempfile
+import threading
+import time
 import typing
 import urllib.parse
-from contextlib import contextmanager
+import weakref
+import zlib
+from contextlib import ExitStack, closing, contextmanager, suppress
 from dataclasses import dataclass
-from itertools import chain
+from itertools import chain, groupby, islice
 
 import dateutil.parser
 import httpx
 import lxml.etree
-from bs4 import BeautifulSoup
 from stream_unzip import stream_unzip
 
 if typing.TYPE_CHECKING:
     import mypy_boto3_s3
+    import pandas as pd
+    import pyarrow as pa
+    import zstandard
     from lxml.etree import _Element as Element
 
 _COLUMNS = (
@@ -74,15 +87,66 @@ _COLUMNS = (
     "zip_url",
 )
 
+# The type of the non-None values in each of the _COLUMNS, used when writing to formats with typed columns
+_COLUMN_TYPES: tuple[type, ...] = (
+    str,  # run_code
+    str,  # company_id
+    datetime.date,  # date
+    str,  # file_type
+    str,  # taxonomy
+    datetime.date,  # balance_sheet_date
+    str,  # companies_house_registered_number
+    str,  # entity_current_legal_name
+    bool,  # company_dormant
+    decimal.Decimal,  # average_number_employees_during_period
+    datetime.date,  # period_start
+    datetime.date,  # period_end
+    *(decimal.Decimal,) * 25,  # tangible_fixed_assets to profit_loss_for_period
+    str,  # error
+    str,  # zip_url
+)
+
 logger = logging.getLogger(__name__)
 
 XBRLData = typing.Union[str, bool, decimal.Decimal, datetime.date, None]
 XBRLRow = tuple[XBRLData, ...]
+XBRLRowFilter = typing.Sequence[tuple[str, str, XBRLData]]
+
+_T = typing.TypeVar("_T")
+
+
+# Only the start of a member file with bad XML is logged, since some are several megabytes
+_BAD_XML_LOG_BYTES = 200
+
+
+def _log_bad_xml(name: str, xbrl_xml_str: bytes, bad_xml_folder: str | None) -> None:
+    # Runs in the workers. The member file is saved to bad_xml_folder, named by the hash of its contents so
+    # each is only saved once, however many times it's seen
+    sha256 = hashlib.sha256(xbrl_xml_str).hexdigest()
+    logger.warning(
+        "Bad XML. Name: %s Size: %s SHA-256: %s Start: %r",
+        name,
+        len(xbrl_xml_str),
+        sha256,
+        xbrl_xml_str[:_BAD_XML_LOG_BYTES],
+    )
+    if bad_xml_folder is None:
+        return
+    path = pathlib.Path(bad_xml_folder, f"{sha256}{pathlib.Path(name).suffix}")
+    if path.exists():
+        return
+    # Not being able to save the member file should not stop parsing, and it is only visible once complete
+    with suppress(OSError):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _write_file_atomically(path, xbrl_xml_str)
 
 
 def _xbrl_to_rows(
     name_xbrl_xml_str_orig: tuple[str, bytes],
-) -> tuple[XBRLRow, ...]:
+    bad_xml_folder: str | None = None,
+) -> tuple[tuple[XBRLRow, ...], bool]:
+    # Returns the rows of a member, along with whether its XML was too malformed to parse, which leaves the error
+    # column of its row as None, as for a member with no data
     name, xbrl_xml_str_orig = name_xbrl_xml_str_orig
 
     # Slightly hacky way to remove BOM, which is present in some older data
@@ -463,6 +527,7 @@ def _xbrl_to_rows(
             else (start_date_text_nodes[0].strip(), end_date_text_nodes[0].strip())
         )
 
+    bad_xml = False
     try:
         document = lxml.etree.parse(xbrl_xml_str, lxml.etree.XMLParser(ns_clean=True, recover=True))
         root = document.getroot()
@@ -470,8 +535,9 @@ def _xbrl_to_rows(
     except (lxml.etree.Error, AssertionError):
         # In at least one case - Prod224_9956_04944372_20100331.xml, the XML seems very badly formed.
         # Suspect this is before Companies House had better validation. The best we can do is log and
-        # carry on. We can at least still get a row in the data
-        logger.warning("Bad XML. Name: %s XML: %s", name, xbrl_xml_str_orig)
+        # carry on. We can at least still get a row in the data, with an error
+        bad_xml = True
+        _log_bad_xml(name, xbrl_xml_str_orig, bad_xml_folder)
         document = lxml.etree.parse(
             io.BytesIO(b'<?xml version="1.0" encoding="UTF-8"?><root></root>'),
             lxml.etree.XMLParser(ns_clean=True, recover=True),
@@ -489,7 +555,7 @@ def _xbrl_to_rows(
     mo = re.match(r"^(Prod\d+_\d+)_([^_]+)_(\d\d\d\d\d\d\d\d)\.(html|xml|zip)", fn)
     if not mo:
         logger.warning("Invalid file. Skipping: %s", fn)
-        return ()
+        return (), bad_xml
     run_code, company_id, date, filetype = map(str, mo.groups())
     allowed_taxonomies = [
         "http://www.xbrl.org/uk/fr/gaap/pt/2004-12-01",
@@ -606,19 +672,25 @@ def _xbrl_to_rows(
         error = str(e)
         return (
             (core_attributes + (None,) * (2 + len(GENERAL_XPATH_MAPPINGS) + len(PERIODICAL_XPATH_MAPPINGS)) + (error,)),
-        )
+        ), bad_xml
 
     return (
         tuple((core_attributes + general_attributes + period + (None,)) for period in sorted_periods)
         if sorted_periods
-        else ((core_attributes + general_attributes + (None,) * (3 + len(PERIODICAL_XPATH_MAPPINGS))),)
-    )
+        else ((core_attributes + general_attributes + (None,) * (2 + len(PERIODICAL_XPATH_MAPPINGS)) + (None,)),)
+    ), bad_xml
 
 
 @contextmanager
 def stream_read_xbrl_zip(
     zip_bytes_iter: typing.Iterable[bytes],
     zip_url: str | None = None,
+    member_filter: collections.abc.Callable[[str], bool] | None = None,
+    row_filter: XBRLRowFilter | None = None,
+    parse_cache_folder: str | None = None,
+    member_timeout: float | None = None,
+    max_member_memory: int | None = None,
+    bad_xml_folder: str | None = None,
 ) -> typing.Generator[
     tuple[tuple[str, ...], typing.Generator[XBRLRow, None, None]],
     None,
@@ -626,283 +698,3488 @@ def stream_read_xbrl_zip(
 ]:
     """Streams and parses XBRL files from a ZIP byte-stream.
 
+    If member_filter is passed, it is called with the name of each member file, and members it returns False for
+    are skipped without being parsed. filter_members makes a member_filter for company IDs and dates.
+
+    If row_filter is passed, only rows that match all of its (column, operator, value) conditions are yielded,
+    for example (("company_dormant", "==", False), ("turnover_gross_operating_revenue", "is not", None)). The
+    operators are ==, !=, <, <=, >, >=, and is and is not with None. Rows are filtered in the worker processes,
+    and NULLs never match <, <=, > or >=. A ValueError is raised if row_filter has an unknown column or
+    operator, or a value of the wrong type.
+
+    If parse_cache_folder is passed, the rows parsed from each member file are saved to it, keyed on a hash of
+    the name and contents of the member file and a hash of the code that parses it. Member files already in the
+    cache are not parsed again, and the hit rate and the time saved are logged for each ZIP.
+
+    A member file that takes longer than member_timeout seconds to parse, or that stops the process parsing it,
+    results in a single row with the run_code, company_id, date and file_type from its name, and the reason in
+    the error column. Worker processes are then replaced, and other member files being parsed are parsed again.
+    If max_member_memory is passed, each worker process is limited to this many bytes of address space, and a
+    member file that needs more results in an error row.
+
+    A member file with XML too malformed to parse results in a row with None in the error column. A warning with
+    its name, size, SHA-256 hash and first bytes is logged, along with a count of such member files once per ZIP.
+    If bad_xml_folder is passed, each is also saved to it, named by its SHA-256 hash.
+
     Yields:
     A tuple of (_COLUMNS, row_generator).
     The row_generator yields XBRLRow tuples with the zip_url appended to each row.
     """
-    queue: collections.deque[concurrent.futures.Future[tuple[XBRLRow, ...]]] = collections.deque()
+    _row_filter_conditions(row_filter)
+    include_member = _include_member(member_filter)
+    with _stream_read_xbrl_zip(
+        zip_bytes_iter,
+        zip_url,
+        include_member=include_member,
+        row_filter=row_filter,
+        parse_cache_folder=parse_cache_folder,
+        member_timeout=member_timeout,
+        max_member_memory=max_member_memory,
+        bad_xml_folder=bad_xml_folder,
+    ) as (
+        columns,
+        rows,
+    ):
+        yield columns, rows
+
+
+def filter_members(
+    company_ids: collections.abc.Container[str] | None = None,
+    start_date: datetime.date | None = None,
+    end_date: datetime.date | None = None,
+    sample_rate: float | None = None,
+) -> collections.abc.Callable[[str], bool]:
+    """Makes a member_filter that only includes member files of the given companies between the given dates.
+
+    The company ID and date of each member file are taken from its name, for example
+    Prod223_3383_00001346_20220930.html, so members are skipped before they are parsed. Members with names not
+    in this form are skipped.
+
+    With a sample_rate, companies are sampled by a hash of their company ID, so the same companies are included
+    each time, and in every ZIP.
+
+    Args:
+        company_ids: The company IDs to include, or None to include all companies.
+        start_date: The earliest date of member files to include, or None for no earliest date.
+        end_date: The latest date of member files to include, or None for no latest date.
+        sample_rate: The fraction of companies to include, between 0 and 1, or None to not sample.
+
+    Returns:
+        A function that takes the name of a member file, and returns whether it should be included.
+
+    Raises:
+        ValueError: If sample_rate is not between 0 and 1.
+    """
+    if sample_rate is not None and not 0 <= sample_rate <= 1:
+        error_msg = "sample_rate must be between 0 and 1"
+        raise ValueError(error_msg)
+
+    # Dates in member names are compared as ISO 8601 strings, which sort in the same order as the dates
+    start = start_date.isoformat() if start_date is not None else None
+    end = end_date.isoformat() if end_date is not None else None
+
+    # A company is in the sample if the first 8 bytes of the SHA-256 of its ID, as an integer, are below the
+    # threshold. Unlike hash(), this is the same in every process and every run
+    sample_threshold = round(sample_rate * 2**64) if sample_rate is not None else None
+
+    def member_filter(name: str) -> bool:
+        key = _member_key(name)
+        if key is None:
+            return False
+        _, company_id, date = key
+        return (
+            (company_ids is None or company_id in company_ids)
+            and (start is None or date >= start)
+            and (end is None or date <= end)
+            and (
+                sample_threshold is None
+                or int.from_bytes(hashlib.sha256(company_id.encode()).digest()[:8], "big") < sample_threshold
+            )
+        )
+
+    return member_filter
+
+
+def _include_member(
+    member_filter: collections.abc.Callable[[str], bool] | None,
+) -> collections.abc.Callable[[int, str], bool]:
+    if member_filter is None:
+        return lambda _index, _name: True
+    return lambda _index, name: member_filter(name)
+
+
+_ROW_FILTER_OPERATORS: dict[str, collections.abc.Callable[[typing.Any, typing.Any], bool]] = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "is": operator.is_,
+    "is not": operator.is_not,
+}
+
+
+def _row_filter_conditions(
+    row_filter: XBRLRowFilter | None,
+) -> tuple[tuple[int, collections.abc.Callable[[typing.Any, typing.Any], bool], XBRLData, bool], ...]:
+    # Each (column, operator, value) condition is converted to the index of the column in the rows from the
+    # workers, the operator function, the value, and whether the condition is false for NULLs, so the conditions
+    # can be pickled and sent to the workers
+    column_types = dict(zip(_COLUMNS, _COLUMN_TYPES))
+    conditions = []
+    for column, operator_str, value in row_filter or ():
+        if column not in _COLUMNS[:-1]:
+            error_msg = f"Unknown column {column!r} filtering rows"
+            raise ValueError(error_msg)
+        if operator_str not in _ROW_FILTER_OPERATORS:
+            error_msg = f"Unknown operator {operator_str!r} filtering rows on column {column!r}"
+            raise ValueError(error_msg)
+        if operator_str in {"is", "is not"} and value is not None:
+            error_msg = f"Operator {operator_str!r} filtering rows on column {column!r} can only be used with None"
+            raise ValueError(error_msg)
+        column_type = column_types[column]
+        if value is not None and not (
+            isinstance(value, column_type) or (column_type is decimal.Decimal and isinstance(value, int))
+        ):
+            error_msg = f"Value {value!r} filtering rows on column {column!r} is not a {column_type.__name__}"
+            raise ValueError(error_msg)
+        conditions.append((
+            _COLUMNS.index(column),
+            _ROW_FILTER_OPERATORS[operator_str],
+            value,
+            operator_str not in {"==", "!=", "is", "is not"},
+        ))
+    return tuple(conditions)
+
+
+def _filter_rows(
+    rows: tuple[XBRLRow, ...],
+    conditions: tuple[tuple[int, collections.abc.Callable[[typing.Any, typing.Any], bool], XBRLData, bool], ...],
+) -> tuple[XBRLRow, ...]:
+    return tuple(
+        row
+        for row in rows
+        if all(
+            not (false_for_null and row[index] is None) and compare(row[index], value)
+            for index, compare, value, false_for_null in conditions
+        )
+    )
+
+
+def _error_rows(name: str, error: str) -> tuple[XBRLRow, ...]:
+    # The row for a member that could not be parsed at all, with only what is in its name
+    mo = re.match(r"^(Prod\d+_\d+)_([^_]+)_(\d\d\d\d)(\d\d)(\d\d)\.(html|xml|zip)", pathlib.Path(name).name)
+    if not mo:
+        return ()
+    run_code, company_id, year, month, day, filetype = mo.groups()
+    core_attributes = (run_code, company_id, datetime.date(int(year), int(month), int(day)), filetype, None)
+    return ((*core_attributes, *(None,) * (len(_COLUMNS) - len(core_attributes) - 2), error),)
+
+
+def _xbrl_to_filtered_rows(
+    name_xbrl_xml_str_orig: tuple[str, bytes],
+    conditions: tuple[tuple[int, collections.abc.Callable[[typing.Any, typing.Any], bool], XBRLData, bool], ...],
+    bad_xml_folder: str | None = None,
+) -> tuple[tuple[XBRLRow, ...], bool]:
+    # Runs in the workers, so only rows that match all the conditions are sent back to the parent, along with
+    # whether the member had bad XML, which is counted even if none of its rows match
+    rows, bad_xml = _xbrl_to_rows(name_xbrl_xml_str_orig, bad_xml_folder)
+    return _filter_rows(rows, conditions), bad_xml
+
+
+@functools.cache
+def _parse_cache_version() -> str | None:
+    # The mappings from XBRL to columns are in the source of _xbrl_to_rows, so any change to them, or to how
+    # values are parsed, results in a different version, and so a separate part of the cache. Without the source,
+    # for example when installed only as bytecode, changes can't be detected, so the cache is not used
+    try:
+        source = inspect.getsource(_xbrl_to_rows)
+    except OSError:
+        logger.warning("Unable to find the source of the parser to version the parse cache, so not using it")
+        return None
+    return hashlib.sha256(json.dumps((source, _COLUMNS)).encode("utf-8")).hexdigest()[:16]
+
+
+# Dates and decimals are saved to the parse cache as strings, and strings, booleans and None as they are
+_PARSE_CACHE_ENCODERS: dict[type, collections.abc.Callable[[typing.Any], typing.Any]] = {
+    datetime.date: operator.methodcaller("isoformat"),
+    decimal.Decimal: str,
+}
+_PARSE_CACHE_DECODERS: dict[type, collections.abc.Callable[[typing.Any], typing.Any]] = {
+    datetime.date: datetime.date.fromisoformat,
+    decimal.Decimal: decimal.Decimal,
+}
+
+
+def _xbrl_to_cached_rows(
+    name_xbrl_xml_str_orig: tuple[str, bytes],
+    parse_cache_folder: str,
+    conditions: tuple[tuple[int, collections.abc.Callable[[typing.Any, typing.Any], bool], XBRLData, bool], ...],
+    bad_xml_folder: str | None = None,
+) -> tuple[tuple[XBRLRow, ...], bool, float | None]:
+    # Runs in the workers. Returns the rows of a member and whether it had bad XML, along with the time saved by
+    # them being in the cache, or None if they were not. Each entry is a JSON file, sharded into folders by the
+    # first 2 characters of its key
+    name, xbrl_xml_str = name_xbrl_xml_str_orig
+    key = hashlib.sha256(name.encode("utf-8") + b"\0" + xbrl_xml_str).hexdigest()
+    path = pathlib.Path(parse_cache_folder, typing.cast("str", _parse_cache_version()), key[:2], f"{key}.json")
+    decoders = tuple(_PARSE_CACHE_DECODERS.get(column_type) for column_type in _COLUMN_TYPES[:-1])
+    encoders = tuple(_PARSE_CACHE_ENCODERS.get(column_type) for column_type in _COLUMN_TYPES[:-1])
+
+    start = time.perf_counter()
+    try:
+        entry = json.loads(path.read_bytes())
+        rows = tuple(
+            tuple(value if decode is None or value is None else decode(value) for decode, value in zip(decoders, row))
+            for row in entry["rows"]
+        )
+    except (OSError, ValueError, KeyError, TypeError, decimal.InvalidOperation):
+        pass
+    else:
+        return (
+            _filter_rows(rows, conditions),
+            bool(entry["bad_xml"]),
+            entry["parse_seconds"] - (time.perf_counter() - start),
+        )
+
+    rows, bad_xml = _xbrl_to_rows(name_xbrl_xml_str_orig, bad_xml_folder)
+    parse_seconds = time.perf_counter() - start
+    entry_bytes = json.dumps({
+        "parse_seconds": parse_seconds,
+        "bad_xml": bad_xml,
+        "rows": [
+            [value if encode is None or value is None else encode(value) for encode, value in zip(encoders, row)]
+            for row in rows
+        ],
+    }).encode("utf-8")
+    # Not being able to write to the cache should not stop parsing, and an entry is only visible once complete
+    with suppress(OSError):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _write_file_atomically(path, entry_bytes)
+    return _filter_rows(rows, conditions), bad_xml, None
+
+
+@contextmanager
+def stream_read_xbrl_zip_batches(
+    zip_bytes_iter: typing.Iterable[bytes],
+    zip_url: str | None = None,
+    batch_size: int = 1000,
+    member_filter: collections.abc.Callable[[str], bool] | None = None,
+    row_filter: XBRLRowFilter | None = None,
+    parse_cache_folder: str | None = None,
+    member_timeout: float | None = None,
+    max_member_memory: int | None = None,
+    bad_xml_folder: str | None = None,
+) -> typing.Generator[
+    tuple[tuple[str, ...], typing.Generator[tuple[str | None, list[XBRLRow]], None, None]],
+    None,
+    None,
+]:
+    """Streams and parses XBRL files from a ZIP byte-stream, in batches of rows.
+
+    Unlike stream_read_xbrl_zip, the rows do not have the zip_url column, since it would be the same for every
+    row. This avoids building a new tuple for every row. Instead, zip_url is yielded once with each batch.
+    member_filter, row_filter, parse_cache_folder, member_timeout, max_member_memory and bad_xml_folder are as for
+    stream_read_xbrl_zip.
+
+    Yields:
+    A tuple of (columns, batch_generator).
+    The batch_generator yields tuples of (zip_url, batch), where each batch is a list of up to batch_size XBRLRow
+    tuples, in the same order as stream_read_xbrl_zip.
+    """
+
+    def batches(
+        results_iter: typing.Generator[tuple[int, str, int, tuple[XBRLRow, ...]], None, None],
+        member_done: collections.abc.Callable[[int, str, int, int], None],
+    ) -> typing.Generator[tuple[str | None, list[XBRLRow]], None, None]:
+        # Members are only done once the batch with their last row has been yielded
+        batch: list[XBRLRow] = []
+        done: list[tuple[int, str, int, int]] = []
+        for index, name, size, results in results_iter:
+            offset = 0
+            while offset < len(results):
+                num_rows = batch_size - len(batch)
+                batch.extend(results[offset : offset + num_rows])
+                offset += num_rows
+                if len(batch) == batch_size:
+                    yield zip_url, batch
+                    batch = []
+                    for member in done:
+                        member_done(*member)
+                    done.clear()
+            done.append((index, name, size, len(results)))
+        if batch:
+            yield zip_url, batch
+        for member in done:
+            member_done(*member)
+
+    _row_filter_conditions(row_filter)
+    with _stream_read_xbrl_zip_results(
+        zip_bytes_iter,
+        zip_url,
+        include_member=_include_member(member_filter),
+        row_filter=row_filter,
+        parse_cache_folder=parse_cache_folder,
+        member_timeout=member_timeout,
+        max_member_memory=max_member_memory,
+        bad_xml_folder=bad_xml_folder,
+    ) as (results_iter, member_done):
+        yield (_COLUMNS[:-1], batches(results_iter, member_done))
+
+
+def _num_workers() -> int | None:
     cpu_count = os.cpu_count()
-    num_workers = max(cpu_count - 1, 1) if cpu_count else None
+    return max(cpu_count - 1, 1) if cpu_count else None
 
-    def imap(
-        executor: concurrent.futures.ProcessPoolExecutor,
-        func: collections.abc.Callable[[tuple[str, bytes]], tuple[XBRLRow, ...]],
-        param_iterables: typing.Generator[tuple[str, bytes], None, None],
-    ) -> typing.Generator[tuple[XBRLRow, ...], None, None]:
-        for params in param_iterables:
-            if len(queue) == num_workers:
-                yield queue.popleft().result()
 
-            queue.append(executor.submit(func, params))
+class _InFlightBudget:
+    # Limits the total bytes of members in flight across all ZIPs sharing a pool. A ZIP with nothing in flight
+    # can always take the next member, so the ZIP being iterated over can't be starved by ones buffered ahead.
+    #
+    # Also limits the number of members being parsed in the pool across all the ZIPs to max_tasks, the number
+    # of workers, so any ZIP can use all of the workers when the others don't need them. While the ZIP being
+    # iterated over, the priority owner, is waiting for one of these slots, the other ZIPs can't take them
+    def __init__(self, max_bytes: int, max_tasks: int) -> None:
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.num_bytes_by_owner: collections.Counter[object] = collections.Counter()
+        self.max_tasks = max_tasks
+        self.num_tasks = 0
+        self.priority_owner: object = None
+        self.owners_waiting_for_task: set[object] = set()
+        self.condition = threading.Condition()
 
-        while queue:
-            yield queue.popleft().result()
+    def prioritise(self, owner: object) -> None:
+        with self.condition:
+            self.priority_owner = owner
+            self.condition.notify_all()
 
-    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
-        yield (
-            _COLUMNS,
-            (
-                (*row, zip_url)
-                for results in imap(
-                    executor,
-                    _xbrl_to_rows,
-                    ((name.decode(), b"".join(chunks)) for name, _, chunks in stream_unzip(zip_bytes_iter)),
-                )
-                for row in results
-            ),
+    def acquire_task(self, owner: object, stop: threading.Event) -> bool:
+        with self.condition:
+            try:
+                while self.num_tasks >= self.max_tasks or (
+                    owner != self.priority_owner and self.priority_owner in self.owners_waiting_for_task
+                ):
+                    if stop.is_set():
+                        return False
+                    self.owners_waiting_for_task.add(owner)
+                    self.condition.wait(timeout=0.1)
+            finally:
+                self.owners_waiting_for_task.discard(owner)
+            self.num_tasks += 1
+            return True
+
+    def release_task(self) -> None:
+        with self.condition:
+            self.num_tasks -= 1
+            self.condition.notify_all()
+
+    def acquire(self, owner: object, num_bytes: int, stop: threading.Event) -> bool:
+        with self.condition:
+            while self.num_bytes_by_owner[owner] and self.num_bytes + num_bytes > self.max_bytes:
+                if stop.is_set():
+                    return False
+                self.condition.wait(timeout=0.1)
+            self.num_bytes += num_bytes
+            self.num_bytes_by_owner[owner] += num_bytes
+            return True
+
+    def release(self, owner: object, num_bytes: int) -> None:
+        with self.condition:
+            self.num_bytes -= num_bytes
+            self.num_bytes_by_owner[owner] -= num_bytes
+            self.condition.notify_all()
+
+
+def _limit_memory(max_bytes: int) -> None:
+    # Runs in each worker process as it starts, so parsing a member that needs more memory than this raises a
+    # MemoryError rather than using up the memory of the machine
+    import resource  # noqa: PLC0415
+
+    resource.setrlimit(resource.RLIMIT_AS, (max_bytes, max_bytes))
+
+
+class _SupervisedPool:
+    # A pool of worker processes that is replaced when one of them stops, for example from a segfault, or takes
+    # too long. A ProcessPoolExecutor can't stop a single task, and can't be used once one of its processes has
+    # stopped, so all its processes are stopped and a new ProcessPoolExecutor started. Tasks that were in the old
+    # one are resubmitted by whoever submitted them. It can be shared by several threads, and so by several ZIPs.
+    #
+    # An executor replaced because one of its tasks took too long is interrupted: its other tasks, including
+    # those of other ZIPs, did nothing wrong, and are resubmitted as they were rather than treated as suspects.
+    #
+    # Worker processes are forked when tasks are submitted, and only one pool submits at a time. Otherwise a
+    # process forked from one thread can inherit the pipe that another thread's new process closes to signal that
+    # it has stopped, and so that process stopping would not be noticed until the first one stops too
+    submit_lock = threading.Lock()
+
+    def __init__(self, max_workers: int | None, max_memory: int | None = None) -> None:
+        self.max_workers = max_workers
+        self.max_memory = max_memory
+        self.lock = threading.Lock()
+        self.executor = self._start()
+        self.interrupted_executors: weakref.WeakSet[concurrent.futures.ProcessPoolExecutor] = weakref.WeakSet()
+
+    def _start(self) -> concurrent.futures.ProcessPoolExecutor:
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=functools.partial(_limit_memory, self.max_memory) if self.max_memory is not None else None,
         )
 
+    def _replace(self) -> None:
+        # There is no public way to stop the processes of a ProcessPoolExecutor before Python 3.14
+        for process in tuple((self.executor._processes or {}).values()):  # noqa: SLF001
+            process.kill()
+            process.join()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = self._start()
+
+    def submit(
+        self, func: collections.abc.Callable[[_T], typing.Any], arg: _T
+    ) -> tuple[concurrent.futures.ProcessPoolExecutor, concurrent.futures.Future[typing.Any]]:
+        with self.lock, _SupervisedPool.submit_lock:
+            try:
+                return self.executor, self.executor.submit(func, arg)
+            except concurrent.futures.process.BrokenProcessPool:
+                self._replace()
+                return self.executor, self.executor.submit(func, arg)
+
+    def replace(self, executor: concurrent.futures.ProcessPoolExecutor, *, interrupted: bool = False) -> None:
+        # Only if it's not already been replaced because of another task
+        with self.lock:
+            if executor is self.executor:
+                if interrupted:
+                    self.interrupted_executors.add(executor)
+                self._replace()
+
+    def was_interrupted(self, executor: concurrent.futures.ProcessPoolExecutor) -> bool:
+        with self.lock:
+            return executor in self.interrupted_executors
+
+    def close(self) -> None:
+        with self.lock:
+            self.executor.shutdown()
+
+
+@dataclass
+class _ParseTask:
+    index: int
+    name: str
+    size: int
+    xbrl_xml_str: bytes | None
+    rows: tuple[XBRLRow, ...] | None = None
+    bad_xml: bool = False
+    executor: concurrent.futures.ProcessPoolExecutor | None = None
+    future: concurrent.futures.Future[typing.Any] | None = None
+    deadline: float | None = None
+
 
 @contextmanager
-def stream_read_xbrl_sync(
-    ingest_data_after_date: datetime.date = datetime.date(datetime.MINYEAR, 1, 1),
-    data_urls: tuple[str, ...] = (
-        "https://download.companieshouse.gov.uk/en_accountsdata.html",
-        "https://download.companieshouse.gov.uk/en_monthlyaccountsdata.html",
-        "https://download.companieshouse.gov.uk/historicmonthlyaccountsdata.html",
-    ),
-    get_client: collections.abc.Callable[[], httpx.Client] = lambda: httpx.Client(
-        timeout=60.0, transport=httpx.HTTPTransport(retries=3)
-    ),
-    chunk_size: int = 100 * 1048576,  # 100 MiB
+def _iterate_in_thread(
+    iterable: collections.abc.Generator[_T, None, None],
+    maxsize: int,
+    stop: threading.Event,
+    on_ready: collections.abc.Callable[[], None],
+) -> typing.Generator[typing.Generator[_T, None, None], None, None]:
+    # Iterates over iterable in its own thread, so it progresses while the caller is busy with something else.
+    # on_ready is called once, as soon as the first item or the end of the iterable is available
+    items: queue.Queue[tuple[bool, _T | None, BaseException | None]] = queue.Queue(maxsize)
+    ready = threading.Event()
+
+    def put(item: tuple[bool, _T | None, BaseException | None]) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            if not ready.is_set():
+                ready.set()
+                on_ready()
+            return True
+        return False
+
+    def run() -> None:
+        try:
+            for item in iterable:
+                if not put((False, item, None)):
+                    return
+        except BaseException as e:  # noqa: BLE001
+            put((True, None, e))
+        else:
+            put((True, None, None))
+        finally:
+            iterable.close()
+
+    def get() -> typing.Generator[_T, None, None]:
+        while True:
+            is_done, item, exception = items.get()
+            if exception is not None:
+                raise exception
+            if is_done:
+                break
+            yield typing.cast("_T", item)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        yield get()
+    finally:
+        stop.set()
+        thread.join()
+
+
+@contextmanager
+def _stream_read_xbrl_zip_results(
+    zip_bytes_iter: typing.Iterable[bytes],
+    zip_url: str | None = None,
+    first_member_index: int = 0,
+    include_member: collections.abc.Callable[[int, str], bool] = lambda _index, _name: True,
+    on_member_done: collections.abc.Callable[[int, str, int], None] = lambda _index, _name, _num_rows: None,
+    executor: _SupervisedPool | None = None,
+    max_in_flight: int | None = None,
+    in_flight_budget: _InFlightBudget | None = None,
+    on_ready: collections.abc.Callable[[], None] | None = None,
+    row_filter: XBRLRowFilter | None = None,
+    parse_cache_folder: str | None = None,
+    member_timeout: float | None = None,
+    max_member_memory: int | None = None,
+    bad_xml_folder: str | None = None,
 ) -> typing.Generator[
     tuple[
-        tuple[str, ...],
-        typing.Generator[
-            tuple[tuple[datetime.date, datetime.date], typing.Generator[XBRLRow, None, None]],
-            None,
-            None,
-        ],
+        typing.Generator[tuple[int, str, int, tuple[XBRLRow, ...]], None, None],
+        collections.abc.Callable[[int, str, int, int], None],
     ],
     None,
     None,
 ]:
-    """Yields a stream of parsed XBRL data for files modified after the specified date."""
+    # Yields the index, name, size and rows of each member, without the zip_url, in order, along with a function
+    # that must be called with the index, name, size and number of rows of each member once its rows have all
+    # been iterated over.
+    #
+    # Member indexes count up from first_member_index, which is non-zero when zip_bytes_iter starts part way
+    # through a ZIP. Members rejected by include_member are drained without being parsed, and the number of them
+    # and their uncompressed bytes are logged along with zip_url. on_member_done is called for every member, in
+    # order, once all of its rows have been iterated over.
+    #
+    # To share a pool between several ZIPs, an executor can be passed, along with the maximum number of this
+    # ZIP's members that can be in flight at once, and a budget of bytes and of slots in the pool shared between
+    # the ZIPs. If
+    # on_ready is passed, the ZIP is fetched, unzipped and parsed in its own thread ahead of the rows being
+    # iterated over, and on_ready is called once the first rows are available. Rows not matching row_filter are
+    # discarded in the workers. With a parse_cache_folder, the workers return the rows along with the time saved
+    # by them being in the cache, which are totalled to be logged.
+    #
+    # A member that takes longer than member_timeout seconds to parse, or that stops its worker process, is given
+    # a row with only the parts of its name and an error, and the pool is replaced. Worker processes are limited
+    # to max_member_memory bytes of address space, and a member that needs more is also given an error row.
+    #
+    # Members with bad XML are logged by the workers with only the start of their contents, saved to
+    # bad_xml_folder if it's passed, and counted from the flag the workers return with their rows to be logged
+    # once per ZIP
+    if parse_cache_folder is not None and _parse_cache_version() is None:
+        parse_cache_folder = None
+    queue: collections.deque[_ParseTask] = collections.deque()
+    num_workers = _num_workers()
+    max_in_flight = max_in_flight or num_workers
+    stop = threading.Event()
+    # Each ZIP of a sync has a different URL, which is how the ZIP being iterated over is given priority
+    budget_owner: object = zip_url if zip_url is not None else object()
+    conditions = _row_filter_conditions(row_filter)
+    parse_cache_lookups = 0
+    parse_cache_hits = 0
+    parse_cache_seconds_saved = 0.0
+    num_members_parsed = 0
+    num_members_bad_xml = 0
 
-    def extract_start_end_dates(url: str) -> tuple[datetime.date, datetime.date] | tuple[None, None]:
-        file_name_no_ext = pathlib.Path(url).stem
-        if "JanToDec" in file_name_no_ext or "JanuaryToDecember" in file_name_no_ext:
-            year = pathlib.Path(url).stem[-4:]
-            return datetime.date(int(year), 1, 1), datetime.date(int(year), 12, 31)
-        if "Accounts_Monthly_Data" in file_name_no_ext and file_name_no_ext[-4:].isnumeric():
-            year_int = int(file_name_no_ext[-4:])
-            month_name = file_name_no_ext.split("-")[1][:-4]
-            # Convert the month name to a month number
-            month_num = datetime.datetime.strptime(month_name, "%B").astimezone().month
-            # Calculate the last date of the month
-            first_day_of_month = datetime.date(year_int, month_num, 1)
-            next_month = datetime.date(year_int, month_num, 28) + datetime.timedelta(days=4)
-            last_day_of_month = next_month - datetime.timedelta(days=next_month.day)
-            return (first_day_of_month, last_day_of_month)
-        if "Accounts_Bulk_Data" in file_name_no_ext:
-            date_str = file_name_no_ext.split("-", 1)[1]
-            day = datetime.datetime.strptime(date_str, "%Y-%m-%d").astimezone().date()
-            return (day, day)
-        return (None, None)
+    def unwrap(task: _ParseTask, result: typing.Any) -> tuple[XBRLRow, ...]:  # noqa: ANN401
+        nonlocal parse_cache_lookups, parse_cache_hits, parse_cache_seconds_saved
+        if parse_cache_folder is None:
+            rows, task.bad_xml = result
+            return typing.cast("tuple[XBRLRow, ...]", rows)
+        rows, task.bad_xml, seconds_saved = result
+        parse_cache_lookups += 1
+        if seconds_saved is not None:
+            parse_cache_hits += 1
+            parse_cache_seconds_saved += seconds_saved
+        return typing.cast("tuple[XBRLRow, ...]", rows)
 
-    def get_content(client: httpx.Client, url: str) -> bytes:
-        r = client.get(url)
-        r.raise_for_status()
-        return r.content
-
-    @contextmanager
-    def get_content_streamed(
-        client: httpx.Client, url: str
-    ) -> typing.Generator[typing.Generator[bytes, None, None], None, None]:
-
-        def get_chunks() -> typing.Generator[bytes, None, None]:
-            start = 0
-            end = chunk_size - 1
-            etag = None
-            remaining = None
-
-            while remaining is None or remaining > 0:
-                with client.stream("GET", url, headers={"range": f"bytes={start}-{end}"}) as r:
-                    r.raise_for_status()
-                    if etag is None:
-                        etag = r.headers["etag"]
-                    elif etag != r.headers["etag"]:
-                        error_msg = "etag has changed since beginning requests"
-                        raise RuntimeError(error_msg)
-                    if remaining is None:
-                        remaining = int(r.headers["content-range"].split("/")[1])
-                    content_length = int(r.headers["content-length"])
-                    if not content_length > 0:
-                        error_msg = "content_length is <= 0"
-                        raise ValueError(error_msg)
-                    remaining -= content_length
-                    yield from r.iter_bytes(chunk_size=65536)
-                start += chunk_size
-                end += chunk_size
-
-        chunks = get_chunks()
+    def submit(
+        pool: _SupervisedPool, func: collections.abc.Callable[[tuple[str, bytes]], typing.Any], task: _ParseTask
+    ) -> None:
+        task.executor, task.future = pool.submit(func, (task.name, typing.cast("bytes", task.xbrl_xml_str)))
+        task.deadline = None
+
+    def wait(
+        pool: _SupervisedPool,
+        func: collections.abc.Callable[[tuple[str, bytes]], typing.Any],
+        task: _ParseTask,
+        isolation_pool: _SupervisedPool | None,
+    ) -> tuple[XBRLRow, ...]:
+        # Without an isolation_pool, the task is the only one in its pool
+        future = typing.cast("concurrent.futures.Future[typing.Any]", task.future)
+        executor = typing.cast("concurrent.futures.ProcessPoolExecutor", task.executor)
         try:
-            yield chunks
-        finally:
-            # This is for the case of unfinished iteration. It raises a GeneratorExit in get_chunks, so any
-            # open context in "get_chunks" gets properly closed, i.e. to close its open HTTP connection
-            chunks.close()
-
-    with get_client() as client:
-        pages_of_links = [
-            (data_url, BeautifulSoup(get_content(client, data_url), "html.parser").find_all("a"))
-            for data_url in data_urls
-        ]
+            if member_timeout is not None and task.deadline is None:
+                # Timed from when the member is passed to the worker processes rather than when it's submitted,
+                # since it can be queued behind the members of other ZIPs sharing the pool
+                while not future.running() and not future.done():
+                    concurrent.futures.wait((future,), timeout=0.1)
+                task.deadline = time.monotonic() + member_timeout
+            return unwrap(
+                task, future.result(timeout=None if task.deadline is None else max(task.deadline - time.monotonic(), 0))
+            )
+        except concurrent.futures.TimeoutError:
+            error = f"Timed out after {member_timeout} seconds"
+            pool.replace(executor, interrupted=True)
+        except MemoryError:
+            error = f"Ran out of memory, limited to {max_member_memory} bytes"
+        except (concurrent.futures.process.BrokenProcessPool, concurrent.futures.CancelledError):
+            if pool.was_interrupted(executor):
+                # Stopped because another member, possibly of another ZIP, timed out, so this member and the others
+                # of this ZIP in the same executor are resubmitted as they were
+                for other in (task, *queue):
+                    if other.rows is None and other.executor is executor:
+                        submit(pool, func, other)
+                return wait(pool, func, task, isolation_pool)
+            pool.replace(executor)
+            if isolation_pool is None:
+                error = "Worker process stopped"
+            else:
+                # Which member stopped the worker process is not known, so each of this ZIP's members that were in
+                # it is parsed on its own, in a pool that other ZIPs don't share
+                for suspect in (task, *queue):
+                    if suspect.rows is None and suspect.executor is executor:
+                        submit(isolation_pool, func, suspect)
+                        suspect.rows = wait(isolation_pool, func, suspect, None)
+                return typing.cast("tuple[XBRLRow, ...]", task.rows)
+        logger.warning("Unable to parse %s of %s: %s", task.name, zip_url, error)
+        return _filter_rows(_error_rows(task.name, error), conditions)
 
-        all_zip_urls = [
-            link_href.strip()
-            if link_href.strip().startswith("http://") or link_href.strip().startswith("https://")
-            else urllib.parse.urljoin(data_url, link_href.strip())
-            for (data_url, page_of_links) in pages_of_links
-            for link in page_of_links
-            if isinstance(link_href := link.attrs["href"], str) and link_href.endswith(".zip")
-        ]
+    def imap(
+        pool: _SupervisedPool,
+        isolation_pool: _SupervisedPool,
+        func: collections.abc.Callable[[tuple[str, bytes]], typing.Any],
+        param_iterables: typing.Generator[tuple[int, str, bytes | None], None, None],
+    ) -> typing.Generator[tuple[int, str, int, tuple[XBRLRow, ...]], None, None]:
+        def result(task: _ParseTask) -> tuple[int, str, int, tuple[XBRLRow, ...]]:
+            nonlocal num_members_parsed, num_members_bad_xml
+            if task.rows is None:
+                task.rows = wait(pool, func, task, isolation_pool)
+            if task.xbrl_xml_str is not None:
+                num_members_parsed += 1
+                num_members_bad_xml += task.bad_xml
+            return task.index, task.name, task.size, task.rows
 
-        all_zip_urls_with_dates = [(zip_url, extract_start_end_dates(zip_url)) for zip_url in all_zip_urls]
+        for index, name, xbrl_xml_str in param_iterables:
+            if len(queue) == max_in_flight:
+                yield result(queue.popleft())
 
-        all_zip_urls_with_parseable_dates = [
-            (zip_url, dates) for (zip_url, dates) in all_zip_urls_with_dates if dates != (None, None)
-        ]
+            if xbrl_xml_str is None:
+                task = _ParseTask(index, name, 0, None, rows=())
+            else:
+                task = _ParseTask(index, name, len(xbrl_xml_str), xbrl_xml_str)
+                if in_flight_budget is not None and not (
+                    in_flight_budget.acquire(budget_owner, task.size, stop)
+                    and in_flight_budget.acquire_task(budget_owner, stop)
+                ):
+                    return
+                submit(pool, func, task)
+                # The slot in the pool is released once the member has been parsed, or has failed. If it is then
+                # resubmitted because the pool was replaced, it is not counted again
+                if in_flight_budget is not None:
+                    typing.cast("concurrent.futures.Future[typing.Any]", task.future).add_done_callback(
+                        lambda _: in_flight_budget.release_task()
+                    )
+            queue.append(task)
+
+        while queue:
+            yield result(queue.popleft())
+
+    def members() -> typing.Generator[tuple[int, str, bytes | None], None, None]:
+        num_members = 0
+        num_members_skipped = 0
+        num_bytes_skipped = 0
+        for index, (name, _, chunks) in enumerate(stream_unzip(zip_bytes_iter), first_member_index):
+            name_str = name.decode()
+            num_members += 1
+            if include_member(index, name_str):
+                yield index, name_str, b"".join(chunks)
+            else:
+                num_members_skipped += 1
+                num_bytes_skipped += sum(map(len, chunks))
+                yield index, name_str, None
+        if num_members_skipped:
+            logger.info(
+                "Skipped %s of %s members of %s without parsing them, %s bytes uncompressed",
+                num_members_skipped,
+                num_members,
+                zip_url,
+                num_bytes_skipped,
+            )
+
+    def member_done(index: int, name: str, size: int, num_rows: int) -> None:
+        on_member_done(index, name, num_rows)
+        # A member's bytes count against the budget until its rows have been iterated over
+        if in_flight_budget is not None:
+            in_flight_budget.release(budget_owner, size)
 
-        all_zip_urls_with_dates_oldest_first = sorted(
-            all_zip_urls_with_parseable_dates, key=lambda zip_start_end: (zip_start_end[1][0], zip_start_end[1][1])
+    with ExitStack() as stack:
+        executor = (
+            executor
+            if executor is not None
+            else stack.enter_context(closing(_SupervisedPool(num_workers, max_member_memory)))
+        )
+        results_iter = imap(
+            executor,
+            # Processes are only started once a task is submitted, so this costs little when it's not used
+            stack.enter_context(closing(_SupervisedPool(1, max_member_memory))),
+            functools.partial(
+                _xbrl_to_cached_rows,
+                parse_cache_folder=parse_cache_folder,
+                conditions=conditions,
+                bad_xml_folder=bad_xml_folder,
+            )
+            if parse_cache_folder is not None
+            else functools.partial(_xbrl_to_filtered_rows, conditions=conditions, bad_xml_folder=bad_xml_folder)
+            if conditions
+            else functools.partial(_xbrl_to_rows, bad_xml_folder=bad_xml_folder)
+            if bad_xml_folder is not None
+            else _xbrl_to_rows,
+            members(),
         )
+        if on_ready is not None:
+            results_iter = stack.enter_context(_iterate_in_thread(results_iter, max_in_flight or 1, stop, on_ready))
+        try:
+            yield results_iter, member_done
+        finally:
+            if parse_cache_lookups:
+                logger.info(
+                    "Parse cache hits for %s: %s of %s members (%.1f%%), saving %.1f seconds of parsing",
+                    zip_url,
+                    parse_cache_hits,
+                    parse_cache_lookups,
+                    100 * parse_cache_hits / parse_cache_lookups,
+                    parse_cache_seconds_saved,
+                )
+            if num_members_bad_xml:
+                logger.warning(
+                    "%s of %s members of %s parsed had bad XML%s",
+                    num_members_bad_xml,
+                    num_members_parsed,
+                    zip_url,
+                    f", saved to {bad_xml_folder}" if bad_xml_folder is not None else "",
+                )
 
-        zip_urls_with_date_in_range_to_ingest = [
-            (zip_url, (start_date, end_date))
-            for (zip_url, (start_date, end_date)) in all_zip_urls_with_dates_oldest_first
-            if (start_date is not None and end_date is not None) and end_date > ingest_data_after_date
-        ]
 
-        def _final_date_and_rows() -> typing.Generator[
-            tuple[tuple[datetime.date, datetime.date], typing.Generator[XBRLRow, None, None]], None, None
-        ]:
-            for zip_url, (start_date, end_date) in zip_urls_with_date_in_range_to_ingest:
-                with (
-                    get_content_streamed(client, zip_url) as chunks,
-                    stream_read_xbrl_zip(chunks, zip_url=zip_url) as (
-                        _,
-                        rows,
-                    ),
-                ):
-                    yield (start_date, end_date), rows
+@contextmanager
+def _stream_read_xbrl_zip(
+    zip_bytes_iter: typing.Iterable[bytes],
+    zip_url: str | None = None,
+    first_member_index: int = 0,
+    include_member: collections.abc.Callable[[int, str], bool] = lambda _index, _name: True,
+    on_member_done: collections.abc.Callable[[int, str, int], None] = lambda _index, _name, _num_rows: None,
+    executor: _SupervisedPool | None = None,
+    max_in_flight: int | None = None,
+    in_flight_budget: _InFlightBudget | None = None,
+    on_ready: collections.abc.Callable[[], None] | None = None,
+    row_filter: XBRLRowFilter | None = None,
+    parse_cache_folder: str | None = None,
+    member_timeout: float | None = None,
+    max_member_memory: int | None = None,
+    bad_xml_folder: str | None = None,
+) -> typing.Generator[
+    tuple[tuple[str, ...], typing.Generator[XBRLRow, None, None]],
+    None,
+    None,
+]:
+    def rows(
+        results_iter: typing.Generator[tuple[int, str, int, tuple[XBRLRow, ...]], None, None],
+        member_done: collections.abc.Callable[[int, str, int, int], None],
+    ) -> typing.Generator[XBRLRow, None, None]:
+        for index, name, size, results in results_iter:
+            for row in results:
+                yield (*row, zip_url)
+            member_done(index, name, size, len(results))
 
-        yield (_COLUMNS, _final_date_and_rows())
+    with _stream_read_xbrl_zip_results(
+        zip_bytes_iter,
+        zip_url,
+        first_member_index,
+        include_member,
+        on_member_done,
+        executor,
+        max_in_flight,
+        in_flight_budget,
+        on_ready,
+        row_filter,
+        parse_cache_folder,
+        member_timeout,
+        max_member_memory,
+        bad_xml_folder,
+    ) as (results_iter, member_done):
+        yield (_COLUMNS, rows(results_iter, member_done))
 
 
-def stream_read_xbrl_sync_s3_csv(s3_client: mypy_boto3_s3.S3Client, bucket_name: str, key_prefix: str) -> None:
-    """Synchronizes XBRL data to an S3 bucket as CSV files."""
+def _default_client() -> httpx.Client:
+    return httpx.Client(timeout=60.0, transport=httpx.HTTPTransport(retries=3))
 
-    def _to_file_like_obj(iterable: typing.Generator[bytes, None, None]) -> typing.BinaryIO:
-        chunk = b""
-        offset: int = 0
-        it = iter(iterable)
 
-        def up_to_iter(size: float) -> typing.Generator[bytes, None, None]:
-            nonlocal chunk, offset
+@dataclass
+class _RemoteFile:
+    etag: str | None = None
+    last_modified: str | None = None
+    size: int | None = None
+    # Set if the file is in the local cache
+    path: pathlib.Path | None = None
 
-            while size:
-                if offset == len(chunk):
-                    try:
-                        chunk = next(it)
-                    except StopIteration:
-                        break
-                    else:
-                        offset = 0
-                to_yield = int(min(size, len(chunk) - offset))
-                offset += to_yield
-                size -= to_yield
-                yield chunk[offset - to_yield : offset]
 
-        class FileLikeObj(io.IOBase):
-            @staticmethod
-            def readable() -> bool:
-                return True
+@contextmanager
+def _get_content_streamed(
+    client: httpx.Client, url: str, chunk_size: int, etag: str | None = None, start: int = 0
+) -> typing.Generator[tuple[_RemoteFile, typing.Generator[bytes, None, None]], None, None]:
+    remote_file = _RemoteFile(etag=etag)
 
-            @staticmethod
-            def read(size: float = -1) -> bytes:
-                return b"".join(up_to_iter(float("inf") if size is None or size < 0 else size))
+    def get_chunks() -> typing.Generator[bytes, None, None]:
+        nonlocal start
 
-        return typing.cast("typing.BinaryIO", FileLikeObj())
+        end = start + chunk_size - 1
+        remaining = None
 
-    def _convert_to_csv(
-        columns: tuple[str, ...], rows: typing.Generator[XBRLRow, None, None]
-    ) -> typing.Generator[bytes, None, None]:
-        class PseudoBuffer:
-            @staticmethod
-            def write(value: str) -> bytes:
-                return value.encode("utf-8")
-
-        pseudo_buffer = PseudoBuffer()
-        csv_writer = csv.writer(pseudo_buffer, quoting=csv.QUOTE_NONNUMERIC)
-        yield csv_writer.writerow(columns)
-        yield from (csv_writer.writerow(row) for row in rows)
-
-    s3_paginator = s3_client.get_paginator("list_objects_v2")
-    dates = (
-        # The -10: is to support older versions where only the end date was in the file name
-        datetime.date.fromisoformat(pathlib.PurePosixPath(content["Key"]).stem[-10:])
-        for page in s3_paginator.paginate(Bucket=bucket_name, Prefix=key_prefix)
-        for content in page.get("Contents", ())
-    )
-    latest_completed_date = max(dates, default=datetime.date(datetime.MINYEAR, 1, 1))
+        while remaining is None or remaining > 0:
+            with client.stream("GET", url, headers={"range": f"bytes={start}-{end}"}) as r:
+                r.raise_for_status()
+                if remote_file.etag is None:
+                    remote_file.etag = r.headers["etag"]
+                elif remote_file.etag != r.headers["etag"]:
+                    error_msg = "etag has changed since beginning requests"
+                    raise RuntimeError(error_msg)
+                if remaining is None:
+                    remote_file.size = int(r.headers["content-range"].split("/")[1])
+                    remaining = remote_file.size - start
+                    remote_file.last_modified = r.headers.get("last-modified")
+                content_length = int(r.headers["content-length"])
+                if not content_length > 0:
+                    error_msg = "content_length is <= 0"
+                    raise ValueError(error_msg)
+                remaining -= content_length
+                yield from r.iter_bytes(chunk_size=65536)
+            start += chunk_size
+            end += chunk_size
 
-    with stream_read_xbrl_sync(latest_completed_date) as (columns, final_date_and_rows):
-        for (start_date, final_date), rows in final_date_and_rows:
-            key = f"{key_prefix}{start_date}--{final_date}.csv"
-            logger.info("Saving Companies House accounts data to %s/%s ...", bucket_name, key)
-            csv_file = _to_file_like_obj(_convert_to_csv(columns, rows))
-            s3_client.upload_fileobj(Bucket=bucket_name, Key=key, Fileobj=csv_file)
-            logger.info("Saving Companies House accounts data to %s/%s (done)", bucket_name, key)
+    chunks = get_chunks()
+    try:
+        yield remote_file, chunks
+    finally:
+        # This is for the case of unfinished iteration. It raises a GeneratorExit in get_chunks, so any
+        # open context in "get_chunks" gets properly closed, i.e. to close its open HTTP connection
+        chunks.close()
 
 
-def stream_read_xbrl_debug(
-    zip_url: str, run_code: str, company_id: str, date: datetime.date, debug_cache_folder: str = ".debug-cache"
-) -> None:
-    """Debug function that extracts a specific XBRL file from a ZIP archive and prints info."""
-    pathlib.Path(debug_cache_folder).mkdir(parents=True, exist_ok=True)
+@contextmanager
+def _get_whole_content_streamed(
+    client: httpx.Client, url: str
+) -> typing.Generator[tuple[_RemoteFile, typing.Generator[bytes, None, None]], None, None]:
+    # For servers that don't send the ETag needed to check that ranges are from the same version of the file,
+    # the file is fetched in a single request
+    remote_file = _RemoteFile()
 
-    # Hashing so we have a filesystem-safe URL
-    hashed_zip_url = hashlib.sha256(zip_url.encode("utf-8")).hexdigest()
-    local_zip_file = pathlib.Path(debug_cache_folder).joinpath(hashed_zip_url)
+    def get_chunks() -> typing.Generator[bytes, None, None]:
+        with client.stream("GET", url) as r:
+            r.raise_for_status()
+            remote_file.etag = r.headers.get("etag")
+            remote_file.last_modified = r.headers.get("last-modified")
+            content_length = r.headers.get("content-length")
+            remote_file.size = int(content_length) if content_length is not None else None
+            yield from r.iter_bytes(chunk_size=65536)
 
-    if not local_zip_file.exists():
-        print("The ZIP", zip_url, "does not exist in local cache. Downloading...", file=sys.stderr)
-        done = False
-        try:
-            with httpx.stream("GET", zip_url) as r, pathlib.Path.open(local_zip_file, "wb") as f:
-                r.raise_for_status()
-                for chunk in r.iter_bytes():
-                    f.write(chunk)
-            done = True
-        finally:
-            if not done:
-                local_zip_file.unlink(missing_ok=True)
-        print("Downloaded", file=sys.stderr)
-    else:
-        print("Found", zip_url, "in local cache", file=sys.stderr)
+    chunks = get_chunks()
+    try:
+        yield remote_file, chunks
+    finally:
+        chunks.close()
+
+
+@contextmanager
+def _get_local_content_streamed(
+    path: pathlib.Path, start: int = 0
+) -> typing.Generator[typing.Generator[bytes, None, None], None, None]:
 
-    def local_chunks() -> typing.Generator[bytes, None, None]:
-        with pathlib.Path.open(local_zip_file, "rb") as f:
+    def get_chunks() -> typing.Generator[bytes, None, None]:
+        with pathlib.Path.open(path, "rb") as f:
+            f.seek(start)
             while True:
                 chunk = f.read(65536)
                 if not chunk:
                     break
                 yield chunk
 
+    chunks = get_chunks()
+    try:
+        yield chunks
+    finally:
+        chunks.close()
+
+
+def _zip_cache_paths(zip_cache_folder: str, url: str) -> tuple[pathlib.Path, pathlib.Path]:
+    # Hashing so we have a filesystem-safe URL
+    hashed_url = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return (
+        pathlib.Path(zip_cache_folder).joinpath(hashed_url),
+        pathlib.Path(zip_cache_folder).joinpath(f"{hashed_url}.json"),
+    )
+
+
+def _write_file_atomically(path: pathlib.Path, content: bytes) -> None:
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp", delete=False) as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    pathlib.Path(f.name).replace(path)
+
+
+def _evict_from_zip_cache(zip_cache_folder: str, zip_cache_max_size: int, keep: pathlib.Path) -> None:
+    # Least recently used first, where "used" is the modification time that is bumped on each cache hit
+    zip_files = sorted(
+        (
+            (path.stat(), path)
+            for path in pathlib.Path(zip_cache_folder).iterdir()
+            if re.match(r"^[0-9a-f]{64}$", path.name)
+        ),
+        key=lambda stat_path: stat_path[0].st_mtime,
+    )
+    total_size = sum(stat.st_size for stat, _ in zip_files)
+    for stat, path in zip_files:
+        if total_size <= zip_cache_max_size:
+            break
+        if path == keep:
+            continue
+        logger.info("Evicting %s from ZIP cache", path)
+        path.with_suffix(".json").unlink(missing_ok=True)
+        path.unlink(missing_ok=True)
+        total_size -= stat.st_size
+
+
+def _is_cached_zip_current(
+    metadata: dict[str, typing.Any],
+    zip_path: pathlib.Path,
+    *,
+    not_modified: bool,
+    etag: str | None,
+    last_modified: str | None,
+    size: int | None,
+) -> bool:
+    if metadata.get("etag") is not None:
+        return not_modified or (etag, last_modified) == (metadata["etag"], metadata.get("last_modified"))
+    # Without an ETag, the Last-Modified and size of the file are compared instead
+    return (
+        etag is None
+        and last_modified is not None
+        and size is not None
+        and (last_modified, size) == (metadata.get("last_modified"), metadata.get("size"))
+        and size == zip_path.stat().st_size
+    )
+
+
+@contextmanager
+def _get_zip_content_streamed(
+    client: httpx.Client,
+    url: str,
+    chunk_size: int,
+    zip_cache_folder: str | None = None,
+    zip_cache_max_size: int | None = None,
+    start: int = 0,
+) -> typing.Generator[tuple[_RemoteFile, typing.Generator[bytes, None, None]], None, None]:
+    # Streams the bytes of a ZIP, optionally via an on-disk cache keyed by URL and validated against the
+    # ETag/Last-Modified of the remote file using a conditional request. On a cache miss the download is
+    # written to a temporary file as it is streamed, and only moved into the cache once it has completed.
+    # A server that doesn't send an ETag is validated against its Last-Modified and Content-Length instead, and
+    # one that sends neither isn't cached. A download that doesn't start at the beginning of the ZIP isn't cached
+    if zip_cache_folder is None:
+        with _get_content_streamed(client, url, chunk_size, start=start) as (remote_file, chunks):
+            yield remote_file, chunks
+        return
+
+    pathlib.Path(zip_cache_folder).mkdir(parents=True, exist_ok=True)
+    zip_path, metadata_path = _zip_cache_paths(zip_cache_folder, url)
+
+    try:
+        metadata = json.loads(metadata_path.read_bytes()) if zip_path.exists() else None
+    except (OSError, ValueError):
+        metadata = None
+
+    # A 304 doesn't have to include a Content-Length, so conditional requests are only made with an ETag
+    conditional_headers = (
+        {}
+        if metadata is None or metadata.get("etag") is None
+        else {
+            "if-none-match": metadata["etag"],
+            **({"if-modified-since": metadata["last_modified"]} if metadata.get("last_modified") else {}),
+        }
+    )
+    r = client.head(url, headers=conditional_headers)
+    not_modified = r.status_code == httpx.codes.NOT_MODIFIED
+    # A server that doesn't support HEAD is treated as one that doesn't send validators
+    headers = r.headers if not_modified or r.is_success else httpx.Headers()
+    etag = headers.get("etag")
+    last_modified = headers.get("last-modified")
+    content_length = headers.get("content-length")
+    size = int(content_length) if etag is None and content_length is not None else None
+
+    # Some servers ignore conditional headers, so also compare the validators ourselves
+    if metadata is not None and _is_cached_zip_current(
+        metadata, zip_path, not_modified=not_modified, etag=etag, last_modified=last_modified, size=size
+    ):
+        logger.info("Using cached ZIP for %s", url)
+        os.utime(zip_path)
+        with _get_local_content_streamed(zip_path, start) as chunks:
+            yield (
+                _RemoteFile(metadata.get("etag"), metadata.get("last_modified"), zip_path.stat().st_size, zip_path),
+                chunks,
+            )
+        return
+
+    if start:
+        with _get_content_streamed(client, url, chunk_size, etag=etag, start=start) as (remote_file, chunks):
+            yield remote_file, chunks
+        return
+
+    if etag is None and (last_modified is None or size is None):
+        logger.info(
+            "No ETag, or Last-Modified and Content-Length, for %s so not using the ZIP cache. Downloading...", url
+        )
+        with _get_whole_content_streamed(client, url) as (remote_file, chunks):
+            yield remote_file, chunks
+        return
+
+    def tee_to_cache(
+        remote_file: _RemoteFile, chunks: typing.Generator[bytes, None, None]
+    ) -> typing.Generator[bytes, None, None]:
+        done = False
+        with tempfile.NamedTemporaryFile(
+            dir=zip_cache_folder, prefix=f".{zip_path.name}.", suffix=".tmp", delete=False
+        ) as f:
+            try:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+                done = True
+            finally:
+                if not done:
+                    f.close()
+                    pathlib.Path(f.name).unlink(missing_ok=True)
+            written = f.tell()
+
+        # Without an ETag, the download is only cached if it's the version the HEAD request described
+        if etag is None and (remote_file.last_modified, remote_file.size, written) != (last_modified, size, size):
+            logger.info("ZIP for %s changed while downloading, so not caching it", url)
+            pathlib.Path(f.name).unlink(missing_ok=True)
+            return
+
+        # Removing the metadata first so a crash part way through can't pair new metadata with an old ZIP
+        metadata_path.unlink(missing_ok=True)
+        pathlib.Path(f.name).replace(zip_path)
+        _write_file_atomically(
+            metadata_path,
+            json.dumps({"url": url, "etag": etag, "last_modified": last_modified, "size": size}).encode("utf-8"),
+        )
+        if zip_cache_max_size is not None:
+            _evict_from_zip_cache(zip_cache_folder, zip_cache_max_size, zip_path)
+
+    logger.info("ZIP for %s not in cache. Downloading...", url)
+    # Without an ETag, ranges can't be shown to be from the same version of the file, so it's fetched in one request
+    with (
+        _get_content_streamed(client, url, chunk_size, etag=etag)
+        if etag is not None
+        else _get_whole_content_streamed(client, url)
+    ) as (remote_file, chunks):
+        cached_chunks = tee_to_cache(remote_file, chunks)
+        try:
+            yield remote_file, cached_chunks
+        finally:
+            cached_chunks.close()
+
+
+def _is_range_of_same_version(r: httpx.Response, remote_file: _RemoteFile) -> bool:
+    # Without an ETag, the Last-Modified and size of the file are compared instead. Without either an ETag or a
+    # Last-Modified, nothing shows that the range is from the same version of the file
+    if r.status_code != httpx.codes.PARTIAL_CONTENT:
+        return False
+    if remote_file.etag is not None:
+        return bool(r.headers.get("etag") == remote_file.etag)
+    return bool(
+        remote_file.last_modified is not None
+        and r.headers.get("last-modified") == remote_file.last_modified
+        and (remote_file.size is None or r.headers.get("content-range", "").rpartition("/")[2] == str(remote_file.size))
+    )
+
+
+def _get_zip_range(client: httpx.Client, url: str, remote_file: _RemoteFile, start: int, end: int) -> bytes:
+    if remote_file.path is not None:
+        with pathlib.Path.open(remote_file.path, "rb") as f:
+            f.seek(start)
+            return f.read(end - start + 1)
+
+    r = client.get(url, headers={"range": f"bytes={start}-{end}"})
+    r.raise_for_status()
+    if not _is_range_of_same_version(r, remote_file):
+        error_msg = "Unable to fetch range of the same version of the file"
+        raise ValueError(error_msg)
+    return r.content
+
+
+@contextmanager
+def _get_zip_members_content_streamed(
+    client: httpx.Client, url: str, include_member: collections.abc.Callable[[int, str], bool]
+) -> typing.Generator[tuple[_RemoteFile, typing.Generator[bytes, None, None]], None, None]:
+    # Streams the local headers and data of only the included members of a ZIP, followed by its central
+    # directory, using a range request for each run of consecutive included members. This is still a valid
+    # stream for stream_unzip, since it doesn't use the offsets of members in the central directory.
+    #
+    # Without the size of the ZIP, from a server that doesn't support HEAD or doesn't send a content-length, the
+    # central directory can't be found. Without an ETag or Last-Modified, ranges can't be checked to be from the
+    # same version of the ZIP, and some servers ignore range requests. In all of these cases the whole ZIP is
+    # fetched, and members not included are drained
+    r = client.head(url)
+    content_length = r.headers.get("content-length") if r.is_success else None
+    etag = r.headers.get("etag")
+    last_modified = r.headers.get("last-modified")
+    central_directory = None
+    if content_length is None:
+        logger.warning("Unable to find the size of %s, so fetching all of it", url)
+    elif etag is None and last_modified is None:
+        logger.warning("Unable to check the version of ranges of %s, so fetching all of it", url)
+    else:
+        size = int(content_length)
+        remote_file = _RemoteFile(etag, last_modified, size)
+        try:
+            central_directory = _get_zip_central_directory(
+                lambda start, end: _get_zip_range(client, url, remote_file, start, end), size
+            )
+        except ValueError:
+            logger.warning("Unable to fetch ranges of %s, so fetching all of it", url, exc_info=True)
+    if central_directory is None:
+        with _get_whole_content_streamed(client, url) as (remote_file, chunks):
+            yield remote_file, chunks
+        return
+    members, central_directory_offset = central_directory
+
+    ranges: list[list[int]] = []
+    member_ends = (*(member.local_header_offset for member in members[1:]), central_directory_offset)
+    for index, (member, member_end) in enumerate(zip(members, member_ends)):
+        if not include_member(index, member.name):
+            continue
+        if ranges and ranges[-1][1] == member.local_header_offset:
+            ranges[-1][1] = member_end
+        else:
+            ranges.append([member.local_header_offset, member_end])
+    ranges.append([central_directory_offset, size])
+    logger.info(
+        "Fetching %s of %s bytes of %s in %s ranges",
+        sum(end - start for start, end in ranges),
+        size,
+        url,
+        len(ranges),
+    )
+
+    def get_chunks() -> typing.Generator[bytes, None, None]:
+        for start, end in ranges:
+            with client.stream("GET", url, headers={"range": f"bytes={start}-{end - 1}"}) as r:
+                r.raise_for_status()
+                if not _is_range_of_same_version(r, remote_file):
+                    error_msg = "Unable to fetch range of the same version of the file"
+                    raise ValueError(error_msg)
+                yield from r.iter_bytes(chunk_size=65536)
+
+    chunks = get_chunks()
+    try:
+        yield remote_file, chunks
+    finally:
+        chunks.close()
+
+
+@dataclass
+class _ZipMember:
+    name: str
+    local_header_offset: int
+    compressed_size: int
+    crc_32: int
+
+
+def _get_zip_central_directory(
+    get_range: collections.abc.Callable[[int, int], bytes], size: int
+) -> tuple[tuple[_ZipMember, ...], int]:
+    # Returns the members of a ZIP in the order of their local headers, along with the offset of the central
+    # directory, which immediately follows the last member
+    end_of_central_directory_struct = struct.Struct("<4sHHHHIIH")
+    zip64_end_of_central_directory_locator_struct = struct.Struct("<4sIQI")
+    zip64_end_of_central_directory_struct = struct.Struct("<4sQHHIIQQQQ")
+    central_directory_header_struct = struct.Struct("<4sHHHHHHIIIHHHHHII")
+    # Values in the 16 and 32-bit fields that mean the real value is in a zip64 record or extra field
+    zip64_marker_16 = 0xFFFF
+    zip64_marker_32 = 0xFFFFFFFF
+    zip64_extra_id = 0x0001
+
+    # The end of central directory record is at the end of the file, followed by a comment of up to 64KiB
+    tail_start = max(size - end_of_central_directory_struct.size - 65535, 0)
+    tail = get_range(tail_start, size - 1)
+    end_of_central_directory_offset = tail.rfind(b"PK\x05\x06")
+    if end_of_central_directory_offset == -1:
+        error_msg = "Unable to find end of central directory"
+        raise ValueError(error_msg)
+    _, _, _, _, num_members, central_directory_size, central_directory_offset, _ = (
+        end_of_central_directory_struct.unpack_from(tail, end_of_central_directory_offset)
+    )
+
+    if num_members == zip64_marker_16 or zip64_marker_32 in {central_directory_size, central_directory_offset}:
+        signature, _, zip64_end_of_central_directory_offset, _ = (
+            zip64_end_of_central_directory_locator_struct.unpack_from(
+                tail, end_of_central_directory_offset - zip64_end_of_central_directory_locator_struct.size
+            )
+        )
+        if signature != b"PK\x06\x07":
+            error_msg = "Unable to find zip64 end of central directory locator"
+            raise ValueError(error_msg)
+        (_, _, _, _, _, _, _, num_members, central_directory_size, central_directory_offset) = (
+            zip64_end_of_central_directory_struct.unpack(
+                get_range(
+                    zip64_end_of_central_directory_offset,
+                    zip64_end_of_central_directory_offset + zip64_end_of_central_directory_struct.size - 1,
+                )
+            )
+        )
+
+    central_directory = get_range(central_directory_offset, central_directory_offset + central_directory_size - 1)
+    members = []
+    offset = 0
+    for _ in range(num_members):
+        (
+            signature,
+            _,
+            _,
+            _,
+            _,
+            _,
+            _,
+            crc_32,
+            compressed_size,
+            uncompressed_size,
+            name_length,
+            extra_length,
+            comment_length,
+            _,
+            _,
+            _,
+            local_header_offset,
+        ) = central_directory_header_struct.unpack_from(central_directory, offset)
+        if signature != b"PK\x01\x02":
+            error_msg = "Unexpected signature in central directory"
+            raise ValueError(error_msg)
+        offset += central_directory_header_struct.size
+        name = central_directory[offset : offset + name_length].decode()
+        extra = central_directory[offset + name_length : offset + name_length + extra_length]
+        offset += name_length + extra_length + comment_length
+
+        # Sizes and offsets that don't fit in 32 bits are in the zip64 extra field, in this order
+        extra_offset = 0
+        while extra_offset + 4 <= len(extra):
+            extra_id, extra_size = struct.unpack_from("<HH", extra, extra_offset)
+            if extra_id == zip64_extra_id:
+                zip64_values = iter(struct.unpack_from(f"<{extra_size // 8}Q", extra, extra_offset + 4))
+                if uncompressed_size == zip64_marker_32:
+                    next(zip64_values)
+                if compressed_size == zip64_marker_32:
+                    compressed_size = next(zip64_values)
+                if local_header_offset == zip64_marker_32:
+                    local_header_offset = next(zip64_values)
+                break
+            extra_offset += 4 + extra_size
+
+        members.append(_ZipMember(name, local_header_offset, compressed_size, crc_32))
+
+    return (
+        tuple(sorted(members, key=lambda member: member.local_header_offset)),
+        central_directory_offset,
+    )
+
+
+def _get_zip_member(
+    get_range: collections.abc.Callable[[int, int], bytes], local_header_offset: int, compressed_size: int, crc_32: int
+) -> bytes:
+    # Returns the uncompressed bytes of a single member of a ZIP from its location in the central directory. The
+    # local header is read first for the length of its variable fields, and then the member, along with enough of
+    # what follows for any data descriptor and the signature after it, is unzipped by stream_unzip
+    local_header_struct = struct.Struct("<4sHHHHHIIIHH")
+    data_descriptor_max_size = 24
+
+    signature, _, _, _, _, _, _, _, _, name_length, extra_length = local_header_struct.unpack(
+        get_range(local_header_offset, local_header_offset + local_header_struct.size - 1)
+    )
+    if signature != b"PK\x03\x04":
+        error_msg = "Unexpected signature of local header"
+        raise ValueError(error_msg)
+    end = (
+        local_header_offset
+        + local_header_struct.size
+        + name_length
+        + extra_length
+        + compressed_size
+        + data_descriptor_max_size
+        + len(signature)
+    )
+    _, _, chunks = next(stream_unzip((get_range(local_header_offset, end - 1),)))
+    content = b"".join(chunks)
+    if zlib.crc32(content) != crc_32:
+        error_msg = "CRC-32 of member does not match the central directory"
+        raise ValueError(error_msg)
+    return content
+
+
+@contextmanager
+def _open_catalogue(catalogue_path: str | None) -> typing.Generator[sqlite3.Connection, None, None]:
+    # One row per ZIP file linked from the Companies House index pages, and one row per member file processed
+    # from them, keyed on the parts of its name. With index_members, also the location of each member file in each
+    # ZIP file, from its central directory. Without a path the catalogue is only in memory, and so lasts
+    # for a single sync. Rows can be iterated from other threads, for example by boto3
+    # when uploading, and so the connection is allowed to be used from them
+    with closing(
+        sqlite3.connect(catalogue_path if catalogue_path is not None else ":memory:", check_same_thread=False)
+    ) as catalogue:
+        with catalogue:
+            catalogue.executescript("""
+                CREATE TABLE IF NOT EXISTS index_pages (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT
+                );
+                CREATE TABLE IF NOT EXISTS zip_files (
+                    url TEXT PRIMARY KEY,
+                    index_page_url TEXT NOT NULL,
+                    start_date TEXT,
+                    end_date TEXT,
+                    size INTEGER,
+                    etag TEXT,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    processed_at TEXT
+                );
+                CREATE INDEX IF NOT EXISTS zip_files_end_date ON zip_files (end_date);
+                CREATE TABLE IF NOT EXISTS processed_members (
+                    run_code TEXT NOT NULL,
+                    company_id TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    PRIMARY KEY (run_code, company_id, date)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS member_locations (
+                    company_id TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    run_code TEXT NOT NULL,
+                    zip_url TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    local_header_offset INTEGER NOT NULL,
+                    compressed_size INTEGER NOT NULL,
+                    crc_32 INTEGER NOT NULL,
+                    PRIMARY KEY (company_id, date, run_code, zip_url)
+                ) WITHOUT ROWID;
+            """)
+        yield catalogue
+
+
+def _member_key(name: str) -> tuple[str, str, str] | None:
+    # The (run_code, company_id, date) of a member file, which identifies the same filing in the daily, monthly
+    # and historic ZIP files
+    mo = re.match(r"^(Prod\d+_\d+)_([^_]+)_(\d\d\d\d)(\d\d)(\d\d)\.(html|xml|zip)", pathlib.Path(name).name)
+    if not mo:
+        return None
+    run_code, company_id, year, month, day, _ = mo.groups()
+    return run_code, company_id, f"{year}-{month}-{day}"
+
+
+def _catalogue_index_page(
+    catalogue: sqlite3.Connection,
+    index_page_url: str,
+    r: httpx.Response,
+    extract_start_end_dates: collections.abc.Callable[[str], tuple[datetime.date, datetime.date] | tuple[None, None]],
+) -> None:
+    root = lxml.etree.fromstring(r.content, lxml.etree.HTMLParser()) if r.content.strip() else None
+    hrefs = (href.strip() for href in typing.cast("list[str]", root.xpath("//a/@href"))) if root is not None else ()
+    zip_urls = {
+        href if href.startswith(("http://", "https://")) else urllib.parse.urljoin(index_page_url, href): None
+        for href in hrefs
+        if href.endswith(".zip")
+    }
+    existing_zip_urls = {
+        zip_url
+        for (zip_url,) in catalogue.execute("SELECT url FROM zip_files WHERE index_page_url = ?", (index_page_url,))
+    }
+
+    with catalogue:
+        catalogue.execute(
+            """
+            INSERT INTO index_pages (url, etag, last_modified) VALUES (?, ?, ?)
+            ON CONFLICT (url) DO UPDATE SET etag = excluded.etag, last_modified = excluded.last_modified
+            """,
+            (index_page_url, r.headers.get("etag"), r.headers.get("last-modified")),
+        )
+        # Locations of members of removed ZIP files are deleted with them, since the ZIP files can't be fetched
+        for statement in ("DELETE FROM zip_files WHERE url = ?", "DELETE FROM member_locations WHERE zip_url = ?"):
+            catalogue.executemany(statement, ((zip_url,) for zip_url in existing_zip_urls - zip_urls.keys()))
+        # Dates are only derived for ZIP files not seen before
+        catalogue.executemany(
+            """
+            INSERT INTO zip_files (url, index_page_url, start_date, end_date) VALUES (?, ?, ?, ?)
+            ON CONFLICT (url) DO UPDATE SET index_page_url = excluded.index_page_url
+            """,
+            (
+                (
+                    zip_url,
+                    index_page_url,
+                    *(None if date is None else date.isoformat() for date in extract_start_end_dates(zip_url)),
+                )
+                for zip_url in zip_urls
+                if zip_url not in existing_zip_urls
+            ),
+        )
+
+
+@contextmanager
+def stream_read_xbrl_sync(
+    ingest_data_after_date: datetime.date = datetime.date(datetime.MINYEAR, 1, 1),
+    data_urls: tuple[str, ...] = (
+        "https://download.companieshouse.gov.uk/en_accountsdata.html",
+        "https://download.companieshouse.gov.uk/en_monthlyaccountsdata.html",
+        "https://download.companieshouse.gov.uk/historicmonthlyaccountsdata.html",
+    ),
+    get_client: collections.abc.Callable[[], httpx.Client] = _default_client,
+    chunk_size: int = 100 * 1048576,  # 100 MiB
+    zip_cache_folder: str | None = None,
+    zip_cache_max_size: int | None = None,
+    catalogue_path: str | None = None,
+    checkpoint_path: str | None = None,
+    checkpoint_interval: int = 1000,
+    max_concurrent_zips: int = 1,
+    max_in_flight_bytes: int = 1024 * 1048576,  # 1 GiB
+    *,
+    in_completion_order: bool = False,
+    skip_processed_members: bool = False,
+    member_filter: collections.abc.Callable[[str], bool] | None = None,
+    row_filter: XBRLRowFilter | None = None,
+    fetch_included_members_only: bool = False,
+    index_members: bool = False,
+    parse_cache_folder: str | None = None,
+    member_timeout: float | None = None,
+    max_member_memory: int | None = None,
+    bad_xml_folder: str | None = None,
+) -> typing.Generator[
+    tuple[
+        tuple[str, ...],
+        typing.Generator[
+            tuple[tuple[datetime.date, datetime.date], typing.Generator[XBRLRow, None, None]],
+            None,
+            None,
+        ],
+    ],
+    None,
+    None,
+]:
+    """Yields a stream of parsed XBRL data for files modified after the specified date.
+
+    member_filter, row_filter, parse_cache_folder, member_timeout, max_member_memory and bad_xml_folder are as
+    for stream_read_xbrl_zip.
+
+    If fetch_included_members_only is True, the central directory of each ZIP is fetched first, and then only the
+    bytes of the members that are included by member_filter and skip_processed_members, using range requests.
+    This is much faster when few members are included, for example when sampling with filter_members.
+
+    If index_members is True, once each ZIP has been processed the location of each of its members is saved to the
+    member_locations table of the catalogue, for stream_read_xbrl_company and stream_read_xbrl_debug.
+
+    Raises:
+        ValueError: If checkpoint_path is passed when processing more than one ZIP at once, or with
+            fetch_included_members_only, or if zip_cache_folder is passed with fetch_included_members_only, or
+            row_filter is not valid.
+    """
+    if checkpoint_path is not None and max_concurrent_zips > 1:
+        error_msg = "checkpoint_path is not supported when processing ZIPs concurrently"
+        raise ValueError(error_msg)
+    if fetch_included_members_only and (checkpoint_path is not None or zip_cache_folder is not None):
+        error_msg = "checkpoint_path and zip_cache_folder are not supported with fetch_included_members_only"
+        raise ValueError(error_msg)
+    _row_filter_conditions(row_filter)
+
+    def extract_start_end_dates(url: str) -> tuple[datetime.date, datetime.date] | tuple[None, None]:
+        file_name_no_ext = pathlib.Path(url).stem
+        if "JanToDec" in file_name_no_ext or "JanuaryToDecember" in file_name_no_ext:
+            year = pathlib.Path(url).stem[-4:]
+            return datetime.date(int(year), 1, 1), datetime.date(int(year), 12, 31)
+        if "Accounts_Monthly_Data" in file_name_no_ext and file_name_no_ext[-4:].isnumeric():
+            year_int = int(file_name_no_ext[-4:])
+            month_name = file_name_no_ext.split("-")[1][:-4]
+            # Convert the month name to a month number
+            month_num = datetime.datetime.strptime(month_name, "%B").astimezone().month
+            # Calculate the last date of the month
+            first_day_of_month = datetime.date(year_int, month_num, 1)
+            next_month = datetime.date(year_int, month_num, 28) + datetime.timedelta(days=4)
+            last_day_of_month = next_month - datetime.timedelta(days=next_month.day)
+            return (first_day_of_month, last_day_of_month)
+        if "Accounts_Bulk_Data" in file_name_no_ext:
+            date_str = file_name_no_ext.split("-", 1)[1]
+            day = datetime.datetime.strptime(date_str, "%Y-%m-%d").astimezone().date()
+            return (day, day)
+        return (None, None)
+
+    with get_client() as client, _open_catalogue(catalogue_path) as catalogue:
+        # Members are looked up in the catalogue from the threads that unzip each ZIP
+        catalogue_lock = threading.Lock()
+
+        conditional_headers = {
+            index_page_url: {
+                **({"if-none-match": etag} if etag else {}),
+                **({"if-modified-since": last_modified} if last_modified else {}),
+            }
+            for (index_page_url, etag, last_modified) in catalogue.execute(
+                "SELECT url, etag, last_modified FROM index_pages"
+            )
+        }
+
+        def get_index_page(data_url: str) -> httpx.Response:
+            r = client.get(data_url, headers=conditional_headers.get(data_url, {}))
+            if r.status_code != httpx.codes.NOT_MODIFIED:
+                r.raise_for_status()
+            return r
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(data_urls), 1)) as executor:
+            index_pages = tuple(zip(data_urls, executor.map(get_index_page, data_urls)))
+
+        for data_url, r in index_pages:
+            if r.status_code == httpx.codes.NOT_MODIFIED:
+                logger.info("Index page %s not modified since last sync", data_url)
+            else:
+                _catalogue_index_page(catalogue, data_url, r, extract_start_end_dates)
+
+        zip_urls_with_date_in_range_to_ingest = [
+            (zip_url, (datetime.date.fromisoformat(start_date), datetime.date.fromisoformat(end_date)))
+            for (zip_url, start_date, end_date) in catalogue.execute(
+                f"""
+                SELECT url, start_date, end_date FROM zip_files
+                WHERE end_date > ? AND index_page_url IN ({",".join("?" * len(data_urls))})
+                ORDER BY start_date, end_date, rowid
+                """,  # noqa: S608
+                (ingest_data_after_date.isoformat(), *data_urls),
+            )
+        ]
+
+        def _get_checkpoint(zip_url: str) -> dict[str, typing.Any] | None:
+            if checkpoint_path is None:
+                return None
+            try:
+                checkpoint: dict[str, typing.Any] = json.loads(pathlib.Path(checkpoint_path).read_bytes())
+            except FileNotFoundError:
+                return None
+            if checkpoint["zip_url"] != zip_url:
+                return None
+            r = client.head(zip_url)
+            r.raise_for_status()
+            if r.headers.get("etag") != checkpoint["etag"]:
+                logger.warning("%s has changed since it was checkpointed. Starting from its beginning", zip_url)
+                return None
+            return checkpoint
+
+        @contextmanager
+        def _zip_rows(
+            zip_url: str,
+            executor: _SupervisedPool | None = None,
+            max_in_flight: int | None = None,
+            in_flight_budget: _InFlightBudget | None = None,
+            on_ready: collections.abc.Callable[[], None] | None = None,
+        ) -> typing.Generator[
+            tuple[typing.Generator[XBRLRow, None, None], collections.abc.Callable[[], None]], None, None
+        ]:
+            # With a checkpoint, members already emitted are skipped. If the checkpoint has the offset of the next
+            # member then the ZIP is streamed from there, otherwise from the start with earlier members drained
+            checkpoint = _get_checkpoint(zip_url)
+            start = checkpoint["compressed_offset"] if checkpoint and checkpoint["compressed_offset"] else 0
+            resume_member_index = checkpoint["member_index"] if checkpoint else 0
+            first_member_index = resume_member_index if start else 0
+            rows_emitted = checkpoint["rows_emitted"] if checkpoint else 0
+            num_members = resume_member_index
+            num_members_skipped = 0
+            # The keys of members whose rows have been emitted, only recorded as processed once the consumer has
+            # moved past the ZIP, or with a checkpoint, so members are never skipped before their rows are saved
+            processed_member_keys: list[tuple[str, str, str]] = []
+            rows_exhausted = False
+            if checkpoint:
+                logger.info("Resuming %s from member %s at offset %s", zip_url, resume_member_index, start)
+
+            local_header_offsets: tuple[int, ...] | None = None
+
+            # The central directory is used to find the compressed offset of each member, and is only fetched
+            # when first needed, by which point the size and ETag of the file are known
+            @functools.cache
+            def get_central_directory(size: int) -> tuple[tuple[_ZipMember, ...], int] | None:
+                try:
+                    return _get_zip_central_directory(
+                        lambda start, end: _get_zip_range(client, zip_url, remote_file, start, end), size
+                    )
+                except (httpx.HTTPError, ValueError, struct.error):
+                    logger.warning("Unable to find member offsets of %s", zip_url, exc_info=True)
+                    return None
+
+            def record_processed_members() -> None:
+                catalogue.executemany(
+                    "INSERT OR IGNORE INTO processed_members (run_code, company_id, date) VALUES (?, ?, ?)",
+                    processed_member_keys,
+                )
+                processed_member_keys.clear()
+
+            def write_checkpoint() -> None:
+                nonlocal local_header_offsets
+                if checkpoint_path is None:
+                    return
+
+                # So members are only skipped on resume if they were recorded as processed
+                with catalogue_lock, catalogue:
+                    record_processed_members()
+
+                if local_header_offsets is None and remote_file.size is not None:
+                    central_directory = get_central_directory(remote_file.size)
+                    local_header_offsets = (
+                        (
+                            *(member.local_header_offset for member in central_directory[0]),
+                            central_directory[1],
+                        )
+                        if central_directory is not None
+                        else ()
+                    )
+
+                _write_file_atomically(
+                    pathlib.Path(checkpoint_path),
+                    json.dumps({
+                        "zip_url": zip_url,
+                        "etag": remote_file.etag,
+                        "member_index": num_members,
+                        "compressed_offset": local_header_offsets[num_members]
+                        if local_header_offsets and num_members < len(local_header_offsets)
+                        else None,
+                        "rows_emitted": rows_emitted,
+                    }).encode("utf-8"),
+                )
+
+            def include_member(index: int, name: str) -> bool:
+                nonlocal num_members_skipped
+                if index < resume_member_index:
+                    return False
+                if member_filter is not None and not member_filter(name):
+                    return False
+                if not skip_processed_members or (key := _member_key(name)) is None:
+                    return True
+                with catalogue_lock:
+                    processed = catalogue.execute(
+                        "SELECT 1 FROM processed_members WHERE run_code = ? AND company_id = ? AND date = ?", key
+                    ).fetchone()
+                num_members_skipped += processed is not None
+                return processed is None
+
+            def on_member_done(index: int, name: str, num_rows: int) -> None:
+                nonlocal num_members, rows_emitted
+                num_members = index + 1
+                rows_emitted += num_rows if index >= resume_member_index else 0
+                # Recorded with the checkpoints or once the ZIP has been processed. Members excluded by member_filter,
+                # or with all rows excluded by row_filter, have no rows, and are not recorded so a later sync without
+                # the filters includes them
+                if skip_processed_members and index >= resume_member_index and num_rows and (key := _member_key(name)):
+                    processed_member_keys.append(key)
+                if num_members % checkpoint_interval == 0:
+                    write_checkpoint()
+
+            def save_member_locations(central_directory: tuple[tuple[_ZipMember, ...], int]) -> None:
+                catalogue.execute("DELETE FROM member_locations WHERE zip_url = ?", (zip_url,))
+                catalogue.executemany(
+                    """
+                    INSERT OR REPLACE INTO member_locations
+                        (run_code, company_id, date, zip_url, name, local_header_offset, compressed_size, crc_32)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        (
+                            *key,
+                            zip_url,
+                            member.name,
+                            member.local_header_offset,
+                            member.compressed_size,
+                            member.crc_32,
+                        )
+                        for member in central_directory[0]
+                        if (key := _member_key(member.name)) is not None
+                    ),
+                )
+
+            def rows_then_exhausted(
+                rows: typing.Generator[XBRLRow, None, None],
+            ) -> typing.Generator[XBRLRow, None, None]:
+                nonlocal rows_exhausted
+                yield from rows
+                if skip_processed_members:
+                    logger.info("Skipped %s members of %s already processed", num_members_skipped, zip_url)
+                rows_exhausted = True
+
+            def mark_processed() -> None:
+                # Called once the consumer has moved past the ZIP, and so has saved its rows. The processed members,
+                # member locations and status of the ZIP are committed together, and only for this ZIP, since the
+                # catalogue is shared between the ZIPs being processed concurrently. The final checkpoint is also
+                # only written now, rather than when the rows are exhausted, since the consumer may not have saved
+                # them by then
+                if not rows_exhausted:
+                    return
+                write_checkpoint()
+                central_directory = (
+                    get_central_directory(remote_file.size) if index_members and remote_file.size is not None else None
+                )
+                with catalogue_lock, catalogue:
+                    record_processed_members()
+                    if central_directory is not None:
+                        save_member_locations(central_directory)
+                    catalogue.execute(
+                        "UPDATE zip_files SET status = 'processed', size = ?, etag = ?, processed_at = ? WHERE url = ?",
+                        (
+                            remote_file.size,
+                            remote_file.etag,
+                            datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                            zip_url,
+                        ),
+                    )
+
+            with (
+                (
+                    _get_zip_members_content_streamed(client, zip_url, include_member)
+                    if fetch_included_members_only
+                    else _get_zip_content_streamed(
+                        client, zip_url, chunk_size, zip_cache_folder, zip_cache_max_size, start=start
+                    )
+                ) as (
+                    remote_file,
+                    chunks,
+                ),
+                _stream_read_xbrl_zip(
+                    chunks,
+                    zip_url=zip_url,
+                    first_member_index=first_member_index,
+                    include_member=include_member,
+                    on_member_done=on_member_done,
+                    executor=executor,
+                    max_in_flight=max_in_flight,
+                    in_flight_budget=in_flight_budget,
+                    on_ready=on_ready,
+                    row_filter=row_filter,
+                    parse_cache_folder=parse_cache_folder,
+                    member_timeout=member_timeout,
+                    max_member_memory=max_member_memory,
+                    bad_xml_folder=bad_xml_folder,
+                ) as (
+                    _,
+                    rows,
+                ),
+            ):
+                yield rows_then_exhausted(rows), mark_processed
+
+        def _final_date_and_rows() -> typing.Generator[
+            tuple[tuple[datetime.date, datetime.date], typing.Generator[XBRLRow, None, None]], None, None
+        ]:
+            if max_concurrent_zips == 1:
+                for zip_url, (start_date, end_date) in zip_urls_with_date_in_range_to_ingest:
+                    with _zip_rows(zip_url) as (rows, mark_processed):
+                        yield (start_date, end_date), rows
+                        mark_processed()
+                return
+
+            # Several ZIPs are fetched, unzipped and parsed at once, each in its own thread, with all their
+            # members parsed in a single shared pool. The workers are shared between the ZIPs, with priority given
+            # to the one being iterated over, and the bytes of members in flight across all ZIPs are limited to
+            # max_in_flight_bytes
+            num_workers = _num_workers() or 1
+            in_flight_budget = _InFlightBudget(max_in_flight_bytes, num_workers)
+            ready_zip_indexes: queue.Queue[int] = queue.Queue()
+            zips_to_start = iter(enumerate(zip_urls_with_date_in_range_to_ingest))
+            started_zips: dict[
+                int,
+                tuple[
+                    tuple[datetime.date, datetime.date],
+                    ExitStack,
+                    typing.Generator[XBRLRow, None, None],
+                    collections.abc.Callable[[], None],
+                ],
+            ] = {}
+
+            with closing(_SupervisedPool(num_workers, max_member_memory)) as executor:
+
+                def start_next_zip() -> None:
+                    for zip_index, (zip_url, dates) in islice(zips_to_start, 1):
+                        zip_stack = ExitStack()
+                        rows, mark_processed = zip_stack.enter_context(
+                            _zip_rows(
+                                zip_url,
+                                executor=executor,
+                                max_in_flight=num_workers,
+                                in_flight_budget=in_flight_budget,
+                                on_ready=functools.partial(ready_zip_indexes.put, zip_index),
+                            )
+                        )
+                        started_zips[zip_index] = (dates, zip_stack, rows, mark_processed)
+
+                try:
+                    for _ in range(max_concurrent_zips):
+                        start_next_zip()
+
+                    next_zip_index_in_date_order = 0
+                    while started_zips:
+                        zip_index = ready_zip_indexes.get() if in_completion_order else next_zip_index_in_date_order
+                        next_zip_index_in_date_order += 1
+                        dates, zip_stack, rows, mark_processed = started_zips.pop(zip_index)
+                        in_flight_budget.prioritise(zip_urls_with_date_in_range_to_ingest[zip_index][0])
+                        with zip_stack:
+                            yield dates, rows
+                            mark_processed()
+                        start_next_zip()
+                finally:
+                    for _, zip_stack, _, _ in started_zips.values():
+                        zip_stack.close()
+
+        yield (_COLUMNS, _final_date_and_rows())
+
+
+_DECIMAL_PRECISION = 38
+_DECIMAL_SCALE = 6
+# The columns that identify the member file a row is from, which are logged along with values that can't be written
+_FILING_COLUMNS = ("zip_url", "run_code", "company_id", "date", "file_type")
+
+
+def _describe_filing(columns: tuple[str, ...], row: XBRLRow) -> str:
+    return " ".join(f"{column}: {value}" for column, value in zip(columns, row) if column in _FILING_COLUMNS)
+
+
+def _arrow_schema(columns: tuple[str, ...]) -> pa.Schema:
+    import pyarrow as pa  # noqa: PLC0415
+
+    # Decimals are stored with a fixed scale, which is enough for the monetary and employee values in the data
+    arrow_types: dict[type, pa.DataType] = {
+        str: pa.string(),
+        bool: pa.bool_(),
+        datetime.date: pa.date32(),
+        decimal.Decimal: pa.decimal128(_DECIMAL_PRECISION, _DECIMAL_SCALE),
+    }
+    column_types = dict(zip(_COLUMNS, _COLUMN_TYPES))
+    return pa.schema([(column, arrow_types[column_types[column]]) for column in columns])
+
+
+def _arrow_record_batches(
+    columns: tuple[str, ...], rows: typing.Iterable[XBRLRow], batch_size: int
+) -> typing.Generator[pa.RecordBatch, None, None]:
+    import pyarrow as pa  # noqa: PLC0415
+
+    schema = _arrow_schema(columns)
+    decimal_context = decimal.Context(prec=_DECIMAL_PRECISION)
+    exponent = decimal.Decimal(10) ** -_DECIMAL_SCALE
+
+    def to_arrow_decimals(
+        column: str, values: tuple[decimal.Decimal | None, ...], batch: tuple[XBRLRow, ...]
+    ) -> tuple[decimal.Decimal | None, ...]:
+        def to_arrow_decimal(value: decimal.Decimal | None, row: XBRLRow) -> decimal.Decimal | None:
+            if value is None:
+                return None
+            try:
+                return value.quantize(exponent, context=decimal_context)
+            except decimal.InvalidOperation:
+                logger.warning(
+                    "Value %s of %s does not fit in DECIMAL(%s, %s), so is written as NULL. %s",
+                    value,
+                    column,
+                    _DECIMAL_PRECISION,
+                    _DECIMAL_SCALE,
+                    _describe_filing(columns, row),
+                )
+                return None
+
+        return tuple(map(to_arrow_decimal, values, batch))
+
+    it = iter(rows)
+    while batch := tuple(islice(it, batch_size)):
+        yield pa.RecordBatch.from_arrays(
+            [
+                pa.array(
+                    to_arrow_decimals(field.name, values, batch) if pa.types.is_decimal(field.type) else values,
+                    type=field.type,
+                )
+                for field, values in zip(schema, zip(*batch))
+            ],
+            schema=schema,
+        )
+
+
+@contextmanager
+def stream_read_xbrl_zip_arrow(
+    zip_bytes_iter: typing.Iterable[bytes],
+    zip_url: str | None = None,
+    batch_size: int = 65_536,
+    member_filter: collections.abc.Callable[[str], bool] | None = None,
+    row_filter: XBRLRowFilter | None = None,
+    parse_cache_folder: str | None = None,
+    member_timeout: float | None = None,
+    max_member_memory: int | None = None,
+    bad_xml_folder: str | None = None,
+) -> typing.Generator[tuple[pa.Schema, typing.Generator[pa.RecordBatch, None, None]], None, None]:
+    """Streams and parses XBRL files from a ZIP byte-stream as Apache Arrow record batches.
+
+    Requires pyarrow, which can be installed with the parquet extra. The schema is the same as for
+    stream_write_xbrl_parquet. member_filter, row_filter, parse_cache_folder, member_timeout, max_member_memory and
+    bad_xml_folder are as for stream_read_xbrl_zip.
+
+    Yields:
+    A tuple of (schema, record_batch_generator).
+    The record_batch_generator yields record batches of up to batch_size rows.
+    """
+    with stream_read_xbrl_zip(
+        zip_bytes_iter,
+        zip_url,
+        member_filter,
+        row_filter,
+        parse_cache_folder,
+        member_timeout,
+        max_member_memory,
+        bad_xml_folder,
+    ) as (columns, rows):
+        yield _arrow_schema(columns), _arrow_record_batches(columns, rows, batch_size)
+
+
+@contextmanager
+def stream_read_xbrl_sync_arrow(
+    ingest_data_after_date: datetime.date = datetime.date(datetime.MINYEAR, 1, 1),
+    batch_size: int = 65_536,
+    **sync_kwargs: typing.Any,  # noqa: ANN401
+) -> typing.Generator[
+    tuple[
+        pa.Schema,
+        typing.Generator[
+            tuple[tuple[datetime.date, datetime.date], typing.Generator[pa.RecordBatch, None, None]],
+            None,
+            None,
+        ],
+    ],
+    None,
+    None,
+]:
+    """Yields a stream of parsed XBRL data as Apache Arrow record batches for files modified after the specified date.
+
+    Requires pyarrow, which can be installed with the parquet extra. Other keyword arguments are passed to
+    stream_read_xbrl_sync.
+    """
+    with stream_read_xbrl_sync(ingest_data_after_date, **sync_kwargs) as (columns, date_range_and_rows):
+        yield (
+            _arrow_schema(columns),
+            (
+                (date_range, _arrow_record_batches(columns, rows, batch_size))
+                for date_range, rows in date_range_and_rows
+            ),
+        )
+
+
+def _pandas_data_frames(
+    columns: tuple[str, ...], rows: typing.Iterable[XBRLRow], chunksize: int, decimal_scale: int | None
+) -> typing.Generator[pd.DataFrame, None, None]:
+    import pandas as pd  # noqa: PLC0415
+
+    # Columns with few distinct values are categorical, so each value is only stored once per DataFrame
+    categorical_columns = {"run_code", "file_type", "taxonomy", "zip_url"}
+    column_types = dict(zip(_COLUMNS, _COLUMN_TYPES))
+    multiplier = decimal.Decimal(10) ** decimal_scale if decimal_scale is not None else None
+
+    def _scaled(column: str, value: decimal.Decimal | None, row: XBRLRow) -> int | None:
+        if value is None or multiplier is None:
+            return None
+        scaled = (value * multiplier).to_integral_value()
+        if not -(2**63) <= scaled < 2**63:
+            logger.warning(
+                "Value %s of %s does not fit in Int64 with decimal_scale %s, so is written as NA. %s",
+                value,
+                column,
+                decimal_scale,
+                _describe_filing(columns, row),
+            )
+            return None
+        return int(scaled)
+
+    def _series(
+        column: str, values: tuple[typing.Any, ...], index: pd.RangeIndex, batch: tuple[XBRLRow, ...]
+    ) -> pd.Series[typing.Any]:
+        column_type = column_types[column]
+        if column in categorical_columns:
+            return pd.Series(values, index=index, dtype="category")
+        if column_type is datetime.date:
+            return pd.to_datetime(pd.Series(values, index=index, dtype=object))
+        if column_type is bool:
+            return pd.Series(values, index=index, dtype="boolean")
+        if column_type is decimal.Decimal and multiplier is None:
+            return pd.Series(values, index=index, dtype="float64")
+        if column_type is decimal.Decimal and multiplier is not None:
+            return pd.Series(
+                tuple(_scaled(column, value, row) for value, row in zip(values, batch)), index=index, dtype="Int64"
+            )
+        return pd.Series(values, index=index)
+
+    start = 0
+    it = iter(rows)
+    while batch := tuple(islice(it, chunksize)):
+        index = pd.RangeIndex(start, start + len(batch))
+        yield pd.DataFrame(
+            {column: _series(column, values, index, batch) for column, values in zip(columns, zip(*batch))},
+            index=index,
+        )
+        start += len(batch)
+
+
+@contextmanager
+def read_xbrl_zip_pandas(
+    zip_bytes_iter: typing.Iterable[bytes],
+    zip_url: str | None = None,
+    chunksize: int = 100_000,
+    decimal_scale: int | None = None,
+    member_filter: collections.abc.Callable[[str], bool] | None = None,
+    row_filter: XBRLRowFilter | None = None,
+    parse_cache_folder: str | None = None,
+    member_timeout: float | None = None,
+    max_member_memory: int | None = None,
+    bad_xml_folder: str | None = None,
+) -> typing.Generator[typing.Generator[pd.DataFrame, None, None], None, None]:
+    """Streams and parses XBRL files from a ZIP byte-stream as Pandas DataFrames of up to chunksize rows.
+
+    Requires pandas, which can be installed with the pandas extra. The run_code, file_type, taxonomy and zip_url
+    columns are categorical, dates are datetime64, and the company_dormant column is nullable boolean. Monetary
+    and employee values are float64, or if decimal_scale is passed, nullable Int64 in units of
+    10 ** -decimal_scale, for example pence if decimal_scale is 2. Values too large for Int64 once scaled are NA,
+    with a warning. member_filter, row_filter, parse_cache_folder, member_timeout, max_member_memory and
+    bad_xml_folder are as for stream_read_xbrl_zip.
+
+    Yields:
+    A generator of DataFrames, indexed by the position of each row in the ZIP.
+    """
+    with stream_read_xbrl_zip(
+        zip_bytes_iter,
+        zip_url,
+        member_filter,
+        row_filter,
+        parse_cache_folder,
+        member_timeout,
+        max_member_memory,
+        bad_xml_folder,
+    ) as (columns, rows):
+        yield _pandas_data_frames(columns, rows, chunksize, decimal_scale)
+
+
+def stream_write_xbrl_parquet(
+    columns: tuple[str, ...],
+    rows: typing.Iterable[XBRLRow],
+    row_group_size: int = 100_000,
+) -> typing.Generator[bytes, None, None]:
+    """Converts rows of parsed XBRL data to a Parquet file, yielding its bytes as each row group is written.
+
+    Requires pyarrow, which can be installed with the parquet extra.
+
+    Args:
+        columns: The columns, as returned by stream_read_xbrl_zip or stream_read_xbrl_sync.
+        rows: The rows, as returned by stream_read_xbrl_zip or stream_read_xbrl_sync.
+        row_group_size: The maximum number of rows held in memory and written to each row group.
+
+    Yields:
+        Chunks of bytes of the Parquet file.
+    """
+    import pyarrow.parquet as pq  # noqa: PLC0415
+
+    # Low cardinality string columns are dictionary encoded. Statistics are written for all columns, so readers
+    # can skip row groups without reading them
+    dictionary_columns = ["run_code", "file_type", "taxonomy", "error", "zip_url"]
+    chunks: list[bytes] = []
+
+    class ChunksSink:
+        closed = False
+        position = 0
+
+        def write(self, b: bytes) -> int:
+            chunk = bytes(b)
+            chunks.append(chunk)
+            self.position += len(chunk)
+            return len(chunk)
+
+        def tell(self) -> int:
+            return self.position
+
+        @staticmethod
+        def flush() -> None:
+            pass
+
+    def pop_chunks() -> typing.Generator[bytes, None, None]:
+        yield from chunks
+        chunks.clear()
+
+    with pq.ParquetWriter(
+        typing.cast("typing.BinaryIO", ChunksSink()),
+        _arrow_schema(columns),
+        # pyarrow also accepts a list of columns to dictionary encode
+        use_dictionary=typing.cast("bool", [column for column in columns if column in dictionary_columns]),
+        write_statistics=True,
+    ) as writer:
+        for record_batch in _arrow_record_batches(columns, rows, row_group_size):
+            writer.write_batch(record_batch, row_group_size=row_group_size)
+            yield from pop_chunks()
+    yield from pop_chunks()
+
+
+def stream_write_xbrl_csv(
+    columns: tuple[str, ...],
+    rows: typing.Iterable[XBRLRow],
+    block_size: int = 1048576,  # 1 MiB
+    batch_size: int = 1000,
+) -> typing.Generator[bytes, None, None]:
+    """Converts rows of parsed XBRL data to a CSV file, yielding its bytes in blocks.
+
+    Values that are not numbers are quoted, as with csv.QUOTE_NONNUMERIC.
+
+    Args:
+        columns: The columns, as returned by stream_read_xbrl_zip or stream_read_xbrl_sync.
+        rows: The rows, as returned by stream_read_xbrl_zip or stream_read_xbrl_sync.
+        block_size: The minimum size in bytes of each yielded block, other than the last.
+        batch_size: The number of rows written to the CSV writer at once.
+
+    Yields:
+        Blocks of bytes of the CSV file.
+    """
+    # Rows are written in batches to a single reusable buffer, which is only encoded once it is large enough,
+    # rather than each row being encoded to its own small bytes object
+    buffer = io.StringIO()
+    csv_writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+    csv_writer.writerow(columns)
+
+    it = iter(rows)
+    while batch := tuple(islice(it, batch_size)):
+        csv_writer.writerows(batch)
+        if buffer.tell() >= block_size:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue().encode("utf-8")
+
+
+_PGCOPY_NUMERIC_MAX_WEIGHT = 32767
+_PGCOPY_NUMERIC_MAX_DECIMAL_PLACES = 16383
+
+
+def _pgcopy_numeric(value: decimal.Decimal) -> bytes:
+    # A NUMERIC is its number of base 10000 digits, the weight of the first digit, its sign, its number of decimal
+    # places, and then the digits, with no leading or trailing zero digits. The digits are found using integer
+    # arithmetic, which is faster than working with the decimal digits as strings
+    if not value.is_finite():
+        sign = 0xC000 if value.is_nan() else 0xF000 if value.is_signed() else 0xD000
+        return struct.pack(">hhHh", 0, 0, sign, 0)
+
+    num_decimal_places = max(-typing.cast("int", value.as_tuple().exponent), 0)
+    if (value and value.adjusted() // 4 > _PGCOPY_NUMERIC_MAX_WEIGHT) or (
+        num_decimal_places > _PGCOPY_NUMERIC_MAX_DECIMAL_PLACES
+    ):
+        error_msg = f"Value {value} does not fit in NUMERIC"
+        raise ValueError(error_msg)
+    num_decimal_digits = -(-num_decimal_places // 4)
+    numerator, denominator = value.as_integer_ratio()
+    integer = abs(numerator) * 10000**num_decimal_digits // denominator
+
+    digits_reversed = []
+    while integer:
+        integer, digit = divmod(integer, 10000)
+        digits_reversed.append(digit)
+    weight = len(digits_reversed) - num_decimal_digits - 1
+    num_trailing_zeros = 0
+    while num_trailing_zeros < len(digits_reversed) and digits_reversed[num_trailing_zeros] == 0:
+        num_trailing_zeros += 1
+    digits = digits_reversed[: num_trailing_zeros - 1 : -1] if num_trailing_zeros else digits_reversed[::-1]
+
+    return struct.pack(
+        f">hhHh{len(digits)}h",
+        len(digits),
+        weight if digits else 0,
+        0x4000 if value < 0 else 0,
+        num_decimal_places,
+        *digits,
+    )
+
+
+def stream_write_xbrl_pgcopy(
+    columns: tuple[str, ...],
+    rows: typing.Iterable[XBRLRow],
+    block_size: int = 1048576,  # 1 MiB
+) -> typing.Generator[bytes, None, None]:
+    """Converts rows of parsed XBRL data to PostgreSQL's binary COPY format, yielding its bytes in blocks.
+
+    The bytes can be passed to COPY ... FROM STDIN (FORMAT binary) for a table with the same columns in the same
+    order. Dates must be DATE columns, the company_dormant column BOOLEAN, monetary and employee values NUMERIC,
+    and other columns TEXT. A value too large or with too many decimal places for NUMERIC is written as NULL, and
+    a warning is logged with its column and the member file it is from.
+
+    Args:
+        columns: The columns, as returned by stream_read_xbrl_zip or stream_read_xbrl_sync.
+        rows: The rows, as returned by stream_read_xbrl_zip or stream_read_xbrl_sync.
+        block_size: The minimum size in bytes of each yielded block, other than the last.
+
+    Yields:
+        Blocks of bytes in PostgreSQL's binary COPY format.
+    """
+    # Each field is its length followed by its value, or a length of -1 for NULL. Dates are days since 2000-01-01
+    postgres_epoch = datetime.date(2000, 1, 1).toordinal()
+    int32_struct = struct.Struct(">i")
+    date_struct = struct.Struct(">ii")
+    encoders: dict[type, collections.abc.Callable[[typing.Any], bytes]] = {
+        str: lambda value: int32_struct.pack(len(encoded := value.encode("utf-8"))) + encoded,
+        bool: lambda value: b"\x00\x00\x00\x01\x01" if value else b"\x00\x00\x00\x01\x00",
+        datetime.date: lambda value: date_struct.pack(4, value.toordinal() - postgres_epoch),
+        decimal.Decimal: lambda value: int32_struct.pack(len(encoded := _pgcopy_numeric(value))) + encoded,
+    }
+    column_types = dict(zip(_COLUMNS, _COLUMN_TYPES))
+    column_encoders = tuple(encoders[column_types[column]] for column in columns)
+    null = int32_struct.pack(-1)
+    num_fields = struct.pack(">h", len(columns))
+
+    def encode_or_null(
+        row: XBRLRow, column: str, encode: collections.abc.Callable[[typing.Any], bytes], value: XBRLData
+    ) -> bytes:
+        if value is None:
+            return null
+        try:
+            return encode(value)
+        except ValueError:
+            if not isinstance(value, decimal.Decimal):
+                raise
+            logger.warning(
+                "Value %s of %s does not fit in NUMERIC, so is written as NULL. %s",
+                value,
+                column,
+                _describe_filing(columns, row),
+            )
+            return null
+
+    buffer = bytearray(b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0))
+    for row in rows:
+        row_start = len(buffer)
+        buffer += num_fields
+        try:
+            for encode, value in zip(column_encoders, row):
+                buffer += null if value is None else encode(value)
+        except ValueError:
+            # Only rows with a value that can't be encoded take the slower path that handles each value
+            del buffer[row_start:]
+            buffer += num_fields
+            for column, encode, value in zip(columns, column_encoders, row):
+                buffer += encode_or_null(row, column, encode, value)
+        if len(buffer) >= block_size:
+            yield bytes(buffer)
+            buffer.clear()
+
+    buffer += struct.pack(">h", -1)
+    yield bytes(buffer)
+
+
+def stream_xbrl_to_sinks(
+    columns: tuple[str, ...],
+    date_range_and_rows: typing.Iterable[tuple[tuple[datetime.date, datetime.date], typing.Iterable[XBRLRow]],],
+    sinks: typing.Sequence[
+        collections.abc.Callable[
+            [tuple[datetime.date, datetime.date], tuple[str, ...], typing.Iterable[XBRLRow]],
+            None,
+        ]
+    ],
+    max_buffered_bytes: int = 64 * 1024 * 1024,
+    batch_size: int = 1000,
+) -> None:
+    """Passes the rows of each ZIP file from stream_read_xbrl_sync to several sinks, parsing them only once.
+
+    Each sink is called once per ZIP file with its date range, the columns, and an iterable of its rows, in its
+    own thread. Each sink has its own buffer of rows, and a slow sink only holds up the others once its buffer is
+    full. If a sink returns before iterating over all of the rows of a ZIP file, the rest are skipped for it.
+    If a sink raises an exception, the other sinks are stopped and the exception is re-raised.
+
+    The next ZIP file is only requested from date_range_and_rows once every sink has returned for the current one,
+    so stream_read_xbrl_sync only marks a ZIP file as processed once all of the sinks have handled its rows.
+
+    Args:
+        columns: The columns, as returned by stream_read_xbrl_sync.
+        date_range_and_rows: The date ranges and rows, as returned by stream_read_xbrl_sync.
+        sinks: The functions to pass the rows of each ZIP file to.
+        max_buffered_bytes: The approximate maximum size in memory of the rows buffered for each sink. A batch
+            larger than this is still passed to a sink with nothing buffered.
+        batch_size: The number of rows passed between threads at once.
+    """
+    stop = threading.Event()
+    errors: list[BaseException] = []
+    # Each queue has the start of each ZIP file, batches of its rows with their approximate size, and its end,
+    # followed by the end of all of the ZIP files. The start and end of each ZIP file are the date range and None
+    # respectively. The batches are shared between the queues, and so between the budgets of the sinks
+    queues: list[queue.Queue[tuple[str, typing.Any]]] = [queue.Queue() for _ in sinks]
+    budgets = [_InFlightBudget(max_buffered_bytes, 1) for _ in sinks]
+    # Passed by the thread of each sink once it has finished with a ZIP file, and by this thread before the next
+    # ZIP file is requested. Aborted when a sink raises an exception, or this thread does
+    zip_done_barrier = threading.Barrier(len(sinks) + 1)
+
+    def get(items: queue.Queue[tuple[str, typing.Any]]) -> tuple[str, typing.Any]:
+        while not stop.is_set():
+            try:
+                item = items.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            return item
+        return ("done", None)
+
+    def run(
+        sink: collections.abc.Callable[
+            [tuple[datetime.date, datetime.date], tuple[str, ...], typing.Iterable[XBRLRow]], None
+        ],
+        items: queue.Queue[tuple[str, typing.Any]],
+        budget: _InFlightBudget,
+    ) -> None:
+        zip_done = False
+
+        def rows() -> typing.Generator[XBRLRow, None, None]:
+            nonlocal zip_done
+            while True:
+                kind, batch_and_num_bytes = get(items)
+                if kind != "rows":
+                    zip_done = True
+                    return
+                batch, num_bytes = batch_and_num_bytes
+                try:
+                    yield from batch
+                finally:
+                    budget.release(None, num_bytes)
+
+        try:
+            while True:
+                kind, date_range = get(items)
+                if kind == "done":
+                    return
+                zip_done = False
+                with closing(rows()) as zip_rows:
+                    sink(date_range, columns, zip_rows)
+                while not zip_done:
+                    kind, batch_and_num_bytes = get(items)
+                    if kind != "rows":
+                        break
+                    budget.release(None, batch_and_num_bytes[1])
+                if stop.is_set():
+                    return
+                zip_done_barrier.wait()
+        except threading.BrokenBarrierError:
+            pass
+        except BaseException as e:  # noqa: BLE001
+            errors.append(e)
+            stop.set()
+            zip_done_barrier.abort()
+
+    def put_all(item: tuple[str, typing.Any], num_bytes: int = 0) -> None:
+        for items, budget in zip(queues, budgets):
+            if num_bytes and not budget.acquire(None, num_bytes, stop):
+                raise errors[0]
+            items.put(item)
+
+    threads = [
+        threading.Thread(target=run, args=(sink, items, budget), daemon=True)
+        for sink, items, budget in zip(sinks, queues, budgets)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for date_range, rows in date_range_and_rows:
+            put_all(("start", date_range))
+            it = iter(rows)
+            while batch := tuple(islice(it, batch_size)):
+                # Approximate, since values shared between rows are counted once for each row
+                num_bytes = sum(sys.getsizeof(row) + sum(map(sys.getsizeof, row)) for row in batch)
+                put_all(("rows", (batch, num_bytes)), num_bytes)
+            put_all(("end", None))
+            try:
+                zip_done_barrier.wait()
+            except threading.BrokenBarrierError:
+                raise errors[0] from None
+        put_all(("done", None))
+    except BaseException:
+        stop.set()
+        zip_done_barrier.abort()
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+
+
+def _compressor(compression: str, compression_level: int | None) -> zlib._Compress | zstandard.ZstdCompressionObj:
+    if compression == "gzip":
+        return zlib.compressobj(
+            compression_level if compression_level is not None else 6, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+        )
+    if compression == "zstd":
+        import zstandard  # noqa: PLC0415
+
+        return zstandard.ZstdCompressor(level=compression_level if compression_level is not None else 3).compressobj()
+    error_msg = f"Unsupported compression: {compression}"
+    raise ValueError(error_msg)
+
+
+def _compress(
+    chunks: typing.Generator[bytes, None, None],
+    compression: str,
+    compression_level: int | None,
+) -> typing.Generator[bytes, None, None]:
+    # The chunks are generated in their own thread, so rows continue to be parsed and converted while earlier ones
+    # are compressed, which zlib and zstandard both do without holding the GIL
+    compressor = _compressor(compression, compression_level)
+    with _iterate_in_thread(chunks, 4, threading.Event(), lambda: None) as chunks_in_thread:
+        for chunk in chunks_in_thread:
+            if compressed_chunk := compressor.compress(chunk):
+                yield compressed_chunk
+    yield compressor.flush()
+
+
+class _MultipartUpload:
+    # A multipart upload to a single key, with its parts uploaded on an executor that can be shared between several
+    # uploads. in_flight limits the number of parts being uploaded at once across all the uploads that share it,
+    # which bounds memory use, and the first error uploading a part is raised by the next call to upload_part
+    def __init__(
+        self,
+        s3_client: mypy_boto3_s3.S3Client,
+        bucket_name: str,
+        key: str,
+        executor: concurrent.futures.ThreadPoolExecutor,
+        in_flight: threading.Semaphore,
+        content_type: str,
+        content_encoding: str | None = None,
+    ) -> None:
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.executor = executor
+        self.in_flight = in_flight
+        self.futures: list[concurrent.futures.Future[mypy_boto3_s3.type_defs.CompletedPartTypeDef]] = []
+        self.size = 0
+        self.upload_id = (
+            s3_client.create_multipart_upload(
+                Bucket=bucket_name, Key=key, ContentType=content_type, ContentEncoding=content_encoding
+            )
+            if content_encoding is not None
+            else s3_client.create_multipart_upload(Bucket=bucket_name, Key=key, ContentType=content_type)
+        )["UploadId"]
+
+    def _upload_part(self, part_number: int, body: bytes) -> mypy_boto3_s3.type_defs.CompletedPartTypeDef:
+        try:
+            response = self.s3_client.upload_part(
+                Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id, PartNumber=part_number, Body=body
+            )
+        finally:
+            self.in_flight.release()
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+    def upload_part(self, body: bytes) -> None:
+        for future in self.futures:
+            if future.done():
+                future.result()
+        self.in_flight.acquire()
+        try:
+            self.futures.append(self.executor.submit(self._upload_part, len(self.futures) + 1, body))
+        except BaseException:
+            self.in_flight.release()
+            raise
+        self.size += len(body)
+
+    def complete(self) -> None:
+        # A multipart upload must have at least one part, even if empty
+        if not self.futures:
+            self.upload_part(b"")
+        self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": [future.result() for future in self.futures]},
+        )
+
+    def abort(self) -> None:
+        for future in self.futures:
+            future.cancel()
+        concurrent.futures.wait(self.futures)
+        self.s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id)
+
+
+# The minimum size that S3 allows of each part of a multipart upload other than the last
+_MIN_PART_SIZE = 5 * 1048576
+
+
+def _upload_multipart(
+    s3_client: mypy_boto3_s3.S3Client,
+    bucket_name: str,
+    key: str,
+    chunks: typing.Iterable[bytes],
+    part_size: int,
+    max_concurrency: int,
+    content_type: str,
+    content_encoding: str | None = None,
+) -> int:
+    # The bytes are split into parts of part_size, the last of which can be smaller, and each part is uploaded
+    # in a thread while the next is being filled. If anything fails the upload is aborted so S3 does not keep the
+    # parts already uploaded. Returns the size of the uploaded object
+    def parts() -> typing.Generator[bytes, None, None]:
+        buffer = bytearray()
+        for chunk in chunks:
+            buffer += chunk
+            while len(buffer) >= part_size:
+                yield bytes(buffer[:part_size])
+                del buffer[:part_size]
+        if buffer:
+            yield bytes(buffer)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        upload = _MultipartUpload(
+            s3_client, bucket_name, key, executor, threading.Semaphore(max_concurrency), content_type, content_encoding
+        )
+        try:
+            for part in parts():
+                upload.upload_part(part)
+            upload.complete()
+        except BaseException:
+            upload.abort()
+            raise
+    return upload.size
+
+
+class _ColumnStatistics:
+    # The number of rows, the number of nulls in each column, and the minimum and maximum of each date column,
+    # of the rows saved to a file. Only date columns have a minimum and maximum to keep the overhead per row low
+    def __init__(self, columns: tuple[str, ...]) -> None:
+        self.columns = columns
+        self.num_rows = 0
+        self.null_counts = [0] * len(columns)
+        column_types = dict(zip(_COLUMNS, _COLUMN_TYPES))
+        self.date_indexes = tuple(i for i, column in enumerate(columns) if column_types.get(column) is datetime.date)
+        self.mins: dict[int, datetime.date] = {}
+        self.maxs: dict[int, datetime.date] = {}
+
+    def update(self, row: XBRLRow) -> None:
+        self.num_rows += 1
+        for i, value in enumerate(row):
+            if value is None:
+                self.null_counts[i] += 1
+        for i in self.date_indexes:
+            value = row[i]
+            if isinstance(value, datetime.date):
+                if i not in self.mins or value < self.mins[i]:
+                    self.mins[i] = value
+                if i not in self.maxs or value > self.maxs[i]:
+                    self.maxs[i] = value
+
+    def rows(self, rows: typing.Iterable[XBRLRow]) -> typing.Generator[XBRLRow, None, None]:
+        for row in rows:
+            self.update(row)
+            yield row
+
+    def to_dict(self) -> dict[str, typing.Any]:
+        return {
+            "num_rows": self.num_rows,
+            "columns": {
+                column: {
+                    "null_count": self.null_counts[i],
+                    **({"min": self.mins[i].isoformat(), "max": self.maxs[i].isoformat()} if i in self.mins else {}),
+                }
+                for i, column in enumerate(self.columns)
+            },
+        }
+
+
+def partition_by_balance_sheet_year(row: XBRLRow) -> str:
+    """Returns the Hive-style partition of a row by the year of its balance sheet date.
+
+    For use as the partition_by argument of stream_read_xbrl_sync_s3_csv.
+
+    Args:
+        row: A row, as returned by stream_read_xbrl_sync.
+
+    Returns:
+        The partition, for example "balance_sheet_year=2022".
+    """
+    balance_sheet_date = row[_COLUMNS.index("balance_sheet_date")]
+    return (
+        f"balance_sheet_year={balance_sheet_date.year}"
+        if isinstance(balance_sheet_date, datetime.date)
+        else "balance_sheet_year=__HIVE_DEFAULT_PARTITION__"
+    )
+
+
+def partition_by_company_id_bucket(num_buckets: int) -> collections.abc.Callable[[XBRLRow], str]:
+    """Returns a function that gives the Hive-style partition of a row by a hash of its company ID.
+
+    For use as the partition_by argument of stream_read_xbrl_sync_s3_csv. All the rows of a company are in the
+    same partition.
+
+    Args:
+        num_buckets: The number of partitions.
+
+    Returns:
+        A function that returns the partition of a row, for example "company_id_bucket=07".
+    """
+    company_id_index = _COLUMNS.index("company_id")
+    width = len(str(num_buckets - 1))
+
+    def partition(row: XBRLRow) -> str:
+        bucket = zlib.crc32(str(row[company_id_index]).encode("utf-8")) % num_buckets
+        return f"company_id_bucket={bucket:0{width}}"
+
+    return partition
+
+
+def _upload_partitioned_csv(
+    s3_client: mypy_boto3_s3.S3Client,
+    bucket_name: str,
+    partition_key: collections.abc.Callable[[str, int], str],
+    columns: tuple[str, ...],
+    rows: typing.Iterable[XBRLRow],
+    partition_by: collections.abc.Callable[[XBRLRow], str],
+    part_size: int,
+    max_concurrency: int,
+    max_buffered_bytes: int,
+    max_open_partitions: int,
+    compression: str | None,
+    compression_level: int | None,
+) -> list[dict[str, typing.Any]]:
+    # Each partition has its own CSV writer and multipart upload, with all the parts uploaded on one executor.
+    # Rows are encoded, and compressed if requested, in blocks, and each partition uploads a part once it has
+    # part_size bytes. If more than max_buffered_bytes are waiting to be uploaded across all the partitions, the
+    # partition with the most is uploaded early if it has the minimum size of a part that S3 allows, and otherwise
+    # its file is completed, with any later rows of the partition going to another file, numbered from 1 by
+    # partition_key. Once max_open_partitions are open, the file of the least recently used partition is also
+    # completed before another is started, which bounds the multipart uploads, writers and compressors open at once.
+    # If anything fails, the uploads not yet completed are aborted and the files already completed are deleted, so
+    # a failure part way through does not leave some files in S3 without the others. Returns the key, size and
+    # statistics of each file
+    block_size = 1048576
+
+    @dataclass
+    class Partition:
+        upload: _MultipartUpload
+        text: io.StringIO
+        csv_writer: typing.Any
+        compressor: zlib._Compress | zstandard.ZstdCompressionObj | None
+        encoded: bytearray
+        statistics: _ColumnStatistics
+
+    # In order of when each was last used, least recently first
+    partitions: dict[str, Partition] = {}
+    completed: list[Partition] = []
+    num_files: collections.Counter[str] = collections.Counter()
+    # Both the text not yet encoded and the encoded bytes not yet uploaded
+    num_buffered_bytes = 0
+
+    def start(name: str) -> Partition:
+        nonlocal num_buffered_bytes
+        text = io.StringIO()
+        partition = partitions[name] = Partition(
+            upload=_MultipartUpload(
+                s3_client,
+                bucket_name,
+                partition_key(name, num_files[name]),
+                executor,
+                in_flight,
+                "text/csv",
+                compression,
+            ),
+            text=text,
+            csv_writer=csv.writer(text, quoting=csv.QUOTE_NONNUMERIC),
+            compressor=_compressor(compression, compression_level) if compression is not None else None,
+            encoded=bytearray(),
+            statistics=_ColumnStatistics(columns),
+        )
+        num_files[name] += 1
+        num_buffered_bytes += partition.csv_writer.writerow(columns)
+        return partition
+
+    def encode(partition: Partition, *, final: bool = False) -> None:
+        nonlocal num_buffered_bytes
+        num_buffered_bytes -= partition.text.tell()
+        encoded = partition.text.getvalue().encode("utf-8")
+        partition.text.seek(0)
+        partition.text.truncate()
+        if partition.compressor is not None:
+            encoded = partition.compressor.compress(encoded) + (partition.compressor.flush() if final else b"")
+        partition.encoded += encoded
+        num_buffered_bytes += len(encoded)
+
+    def upload(partition: Partition) -> None:
+        nonlocal num_buffered_bytes
+        partition.upload.upload_part(bytes(partition.encoded))
+        num_buffered_bytes -= len(partition.encoded)
+        partition.encoded.clear()
+
+    def complete(name: str) -> None:
+        partition = partitions[name]
+        encode(partition, final=True)
+        if partition.encoded:
+            upload(partition)
+        partition.upload.complete()
+        completed.append(partitions.pop(name))
+
+    def use(name: str) -> Partition:
+        # Moved to the end, so the first partition is always the least recently used
+        if name in partitions:
+            partition = partitions[name] = partitions.pop(name)
+            return partition
+        if len(partitions) >= max_open_partitions:
+            complete(next(iter(partitions)))
+        return start(name)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        in_flight = threading.Semaphore(max_concurrency)
+        try:
+            for row in rows:
+                partition = use(partition_by(row))
+                num_buffered_bytes += partition.csv_writer.writerow(row)
+                partition.statistics.update(row)
+
+                if partition.text.tell() >= block_size:
+                    encode(partition)
+                    if len(partition.encoded) >= part_size:
+                        upload(partition)
+                while num_buffered_bytes > max_buffered_bytes:
+                    name, largest = max(partitions.items(), key=lambda item: item[1].text.tell() + len(item[1].encoded))
+                    encode(largest)
+                    if len(largest.encoded) >= _MIN_PART_SIZE:
+                        upload(largest)
+                    else:
+                        complete(name)
+
+            for name in tuple(partitions):
+                complete(name)
+        except BaseException:
+            for partition in partitions.values():
+                partition.upload.abort()
+            for partition in completed:
+                s3_client.delete_object(Bucket=bucket_name, Key=partition.upload.key)
+            raise
+
+    return [
+        {"key": partition.upload.key, "size": partition.upload.size, **partition.statistics.to_dict()}
+        for partition in completed
+    ]
+
+
+def _stream_read_xbrl_sync_s3(
+    s3_client: mypy_boto3_s3.S3Client,
+    bucket_name: str,
+    key_prefix: str,
+    resume_extensions: tuple[str, ...],
+    save: collections.abc.Callable[
+        [str, tuple[str, ...], typing.Generator[XBRLRow, None, None]], list[dict[str, typing.Any]]
+    ],
+    zip_cache_folder: str | None,
+    zip_cache_max_size: int | None,
+    catalogue_path: str | None,
+    manifest_key: str | None,
+    member_filter: collections.abc.Callable[[str], bool] | None,
+    row_filter: XBRLRowFilter | None,
+    member_timeout: float | None,
+    max_member_memory: int | None,
+    parse_cache_folder: str | None,
+    bad_xml_folder: str | None,
+) -> None:
+    # If there is a manifest, it records the ZIP files whose rows have all been saved. The key, size and statistics
+    # of the files saved from each ZIP file are in a separate object for that ZIP file, so the manifest itself
+    # stays small even though it is replaced with a single PUT after each ZIP file. It is written after the object
+    # of the ZIP file, so it is always complete, and it is all that is needed to find where the previous sync
+    # finished
+    manifest: dict[str, typing.Any] | None = None
+    if manifest_key is not None:
+        try:
+            manifest = json.loads(s3_client.get_object(Bucket=bucket_name, Key=manifest_key)["Body"].read())
+        except s3_client.exceptions.NoSuchKey:
+            logger.info("No manifest at %s/%s. Finding where the previous sync finished", bucket_name, manifest_key)
+
+    # Without a manifest, only objects with one of resume_extensions are used to find where the previous sync
+    # finished, so a bucket can have both CSV and Parquet files under the same prefix, and compression can be
+    # changed between syncs. Objects in partitions under the prefix are included
+    if manifest is not None:
+        dates = (datetime.date.fromisoformat(zip_file["end_date"]) for zip_file in manifest["zip_files"])
+    else:
+        s3_paginator = s3_client.get_paginator("list_objects_v2")
+        dates = (
+            # The -10: is to support older versions where only the end date was in the file name
+            datetime.date.fromisoformat(content["Key"][: -len(resume_extension)][-10:])
+            for page in s3_paginator.paginate(Bucket=bucket_name, Prefix=key_prefix)
+            for content in page.get("Contents", ())
+            for resume_extension in resume_extensions
+            if content["Key"].endswith(resume_extension)
+        )
+    latest_completed_date = max(dates, default=datetime.date(datetime.MINYEAR, 1, 1))
+    manifest = manifest if manifest is not None else {"zip_files": []}
+    zip_file_manifest_prefix = f"{manifest_key.removesuffix('.json')}/" if manifest_key is not None else None
+
+    with stream_read_xbrl_sync(
+        latest_completed_date,
+        zip_cache_folder=zip_cache_folder,
+        zip_cache_max_size=zip_cache_max_size,
+        catalogue_path=catalogue_path,
+        member_filter=member_filter,
+        row_filter=row_filter,
+        member_timeout=member_timeout,
+        max_member_memory=max_member_memory,
+        parse_cache_folder=parse_cache_folder,
+        bad_xml_folder=bad_xml_folder,
+    ) as (columns, final_date_and_rows):
+        for (start_date, final_date), rows in final_date_and_rows:
+            name = f"{start_date}--{final_date}"
+            logger.info("Saving Companies House accounts data %s to %s/%s ...", name, bucket_name, key_prefix)
+            files = save(name, columns, rows)
+            logger.info("Saving Companies House accounts data %s to %s/%s (done)", name, bucket_name, key_prefix)
+
+            if manifest_key is not None:
+                zip_file_manifest_key = f"{zip_file_manifest_prefix}{name}.json"
+                completed_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+                s3_client.put_object(
+                    Bucket=bucket_name,
+                    Key=zip_file_manifest_key,
+                    Body=json.dumps({
+                        "start_date": start_date.isoformat(),
+                        "end_date": final_date.isoformat(),
+                        "completed_at": completed_at,
+                        "files": files,
+                    }).encode("utf-8"),
+                    ContentType="application/json",
+                )
+                # A daily and a monthly ZIP file can end on the same date, so each is keyed on both of its dates
+                manifest["zip_files"] = [
+                    *(
+                        zip_file
+                        for zip_file in manifest["zip_files"]
+                        if (zip_file["start_date"], zip_file["end_date"])
+                        != (start_date.isoformat(), final_date.isoformat())
+                    ),
+                    {
+                        "start_date": start_date.isoformat(),
+                        "end_date": final_date.isoformat(),
+                        "completed_at": completed_at,
+                        "manifest_key": zip_file_manifest_key,
+                    },
+                ]
+                s3_client.put_object(
+                    Bucket=bucket_name,
+                    Key=manifest_key,
+                    Body=json.dumps(manifest).encode("utf-8"),
+                    ContentType="application/json",
+                )
+
+
+def stream_read_xbrl_sync_s3_csv(
+    s3_client: mypy_boto3_s3.S3Client,
+    bucket_name: str,
+    key_prefix: str,
+    zip_cache_folder: str | None = None,
+    zip_cache_max_size: int | None = None,
+    catalogue_path: str | None = None,
+    part_size: int = 50 * 1048576,  # 50 MiB
+    max_upload_concurrency: int = 4,
+    compression: str | None = None,
+    compression_level: int | None = None,
+    partition_by: collections.abc.Callable[[XBRLRow], str] | None = None,
+    max_buffered_bytes: int = 1024 * 1048576,  # 1 GiB
+    max_open_partitions: int = 100,
+    manifest_key: str | None = None,
+    member_filter: collections.abc.Callable[[str], bool] | None = None,
+    row_filter: XBRLRowFilter | None = None,
+    member_timeout: float | None = None,
+    max_member_memory: int | None = None,
+    parse_cache_folder: str | None = None,
+    bad_xml_folder: str | None = None,
+) -> None:
+    """Synchronizes XBRL data to an S3 bucket as CSV files.
+
+    If compression is "gzip" or "zstd", the CSV files are compressed, and saved with a .csv.gz or .csv.zst
+    extension and the corresponding Content-Encoding. zstd requires zstandard, which can be installed with the
+    zstd extra.
+
+    If partition_by is passed, for example partition_by_balance_sheet_year, the rows of each ZIP file are split
+    into one CSV file per partition, saved under key_prefix followed by the partition and a forward slash. At most
+    max_open_partitions are uploaded at once, and once reached, the file of the least recently used partition is
+    completed, with any later rows of the partition going to another file.
+
+    If manifest_key is passed, a JSON manifest is saved at this key after each ZIP file, and is used rather than
+    listing the objects under key_prefix to find where the previous sync finished. The files saved from each ZIP
+    file are recorded in a separate JSON object, under manifest_key without its .json extension.
+
+    member_filter, row_filter, member_timeout, max_member_memory, parse_cache_folder and bad_xml_folder are as
+    for stream_read_xbrl_zip.
+
+    Raises:
+        ValueError: If compression is not one of None, "gzip" or "zstd", part_size is less than 5 MiB, or
+            max_open_partitions is less than 1.
+    """
+    compression_extensions = {None: "", "gzip": ".gz", "zstd": ".zst"}
+    if compression not in compression_extensions:
+        error_msg = f"Unsupported compression: {compression}"
+        raise ValueError(error_msg)
+    # Checked before anything is fetched or parsed, rather than S3 rejecting the upload of the second part
+    if part_size < _MIN_PART_SIZE:
+        error_msg = f"part_size must be at least {_MIN_PART_SIZE} bytes, the minimum that S3 allows"
+        raise ValueError(error_msg)
+    if max_open_partitions < 1:
+        error_msg = "max_open_partitions must be at least 1"
+        raise ValueError(error_msg)
+    extension = f".csv{compression_extensions[compression]}"
+
+    def save(
+        name: str, columns: tuple[str, ...], rows: typing.Generator[XBRLRow, None, None]
+    ) -> list[dict[str, typing.Any]]:
+        if partition_by is not None:
+            return _upload_partitioned_csv(
+                s3_client,
+                bucket_name,
+                lambda partition, file_number: (
+                    f"{key_prefix}{partition}/{name}{extension}"
+                    if file_number == 0
+                    else f"{key_prefix}{partition}/{file_number}-{name}{extension}"
+                ),
+                columns,
+                rows,
+                partition_by,
+                part_size,
+                max_upload_concurrency,
+                max_buffered_bytes,
+                max_open_partitions,
+                compression,
+                compression_level,
+            )
+
+        key = f"{key_prefix}{name}{extension}"
+        statistics = _ColumnStatistics(columns)
+        chunks = stream_write_xbrl_csv(columns, statistics.rows(rows))
+        size = _upload_multipart(
+            s3_client,
+            bucket_name,
+            key,
+            _compress(chunks, compression, compression_level) if compression is not None else chunks,
+            part_size,
+            max_upload_concurrency,
+            "text/csv",
+            compression,
+        )
+        return [{"key": key, "size": size, **statistics.to_dict()}]
+
+    _stream_read_xbrl_sync_s3(
+        s3_client,
+        bucket_name,
+        key_prefix,
+        tuple(f".csv{extension}" for extension in compression_extensions.values()),
+        save,
+        zip_cache_folder,
+        zip_cache_max_size,
+        catalogue_path,
+        manifest_key,
+        member_filter,
+        row_filter,
+        member_timeout,
+        max_member_memory,
+        parse_cache_folder,
+        bad_xml_folder,
+    )
+
+
+def stream_read_xbrl_sync_s3_parquet(
+    s3_client: mypy_boto3_s3.S3Client,
+    bucket_name: str,
+    key_prefix: str,
+    zip_cache_folder: str | None = None,
+    zip_cache_max_size: int | None = None,
+    catalogue_path: str | None = None,
+    part_size: int = 50 * 1048576,  # 50 MiB
+    max_upload_concurrency: int = 4,
+    row_group_size: int = 100_000,
+    manifest_key: str | None = None,
+    member_filter: collections.abc.Callable[[str], bool] | None = None,
+    row_filter: XBRLRowFilter | None = None,
+    member_timeout: float | None = None,
+    max_member_memory: int | None = None,
+    parse_cache_folder: str | None = None,
+    bad_xml_folder: str | None = None,
+) -> None:
+    """Synchronizes XBRL data to an S3 bucket as Parquet files.
+
+    Requires pyarrow, which can be installed with the parquet extra. manifest_key is as for
+    stream_read_xbrl_sync_s3_csv, and member_filter, row_filter, member_timeout, max_member_memory,
+    parse_cache_folder and bad_xml_folder are as for stream_read_xbrl_zip.
+
+    Raises:
+        ValueError: If part_size is less than 5 MiB.
+    """
+    # Checked before anything is fetched or parsed, rather than S3 rejecting the upload of the second part
+    if part_size < _MIN_PART_SIZE:
+        error_msg = f"part_size must be at least {_MIN_PART_SIZE} bytes, the minimum that S3 allows"
+        raise ValueError(error_msg)
+
+    def save(
+        name: str, columns: tuple[str, ...], rows: typing.Generator[XBRLRow, None, None]
+    ) -> list[dict[str, typing.Any]]:
+        key = f"{key_prefix}{name}.parquet"
+        statistics = _ColumnStatistics(columns)
+        size = _upload_multipart(
+            s3_client,
+            bucket_name,
+            key,
+            stream_write_xbrl_parquet(columns, statistics.rows(rows), row_group_size),
+            part_size,
+            max_upload_concurrency,
+            "application/vnd.apache.parquet",
+        )
+        return [{"key": key, "size": size, **statistics.to_dict()}]
+
+    _stream_read_xbrl_sync_s3(
+        s3_client,
+        bucket_name,
+        key_prefix,
+        (".parquet",),
+        save,
+        zip_cache_folder,
+        zip_cache_max_size,
+        catalogue_path,
+        manifest_key,
+        member_filter,
+        row_filter,
+        member_timeout,
+        max_member_memory,
+        parse_cache_folder,
+        bad_xml_folder,
+    )
+
+
+def stream_read_xbrl_sync_sqlite(
+    database_path: str,
+    zip_cache_folder: str | None = None,
+    zip_cache_max_size: int | None = None,
+    catalogue_path: str | None = None,
+    batch_size: int = 10_000,
+    member_filter: collections.abc.Callable[[str], bool] | None = None,
+    row_filter: XBRLRowFilter | None = None,
+    member_timeout: float | None = None,
+    max_member_memory: int | None = None,
+    parse_cache_folder: str | None = None,
+    bad_xml_folder: str | None = None,
+) -> None:
+    """Synchronizes XBRL data to a SQLite database.
+
+    Rows are upserted into the accounts table, keyed on company_id, date, period_start and period_end, and a row
+    is only written if it is new or has changed. Dates are stored as ISO 8601 text, and monetary and employee
+    values as TEXT, so they are exact. The date range of each ZIP file is saved to the zip_files table in the same
+    transaction as its rows, and the sync resumes from the latest of these. member_filter, row_filter,
+    member_timeout, max_member_memory, parse_cache_folder and bad_xml_folder are as for stream_read_xbrl_zip.
+    """
+    # Decimals are stored as TEXT rather than NUMERIC, which SQLite would convert to floating point
+    sqlite_types = {str: "TEXT", bool: "BOOLEAN", datetime.date: "DATE", decimal.Decimal: "TEXT"}
+    column_types = dict(zip(_COLUMNS, _COLUMN_TYPES))
+    # NULLs are distinct from each other in unique indexes, so missing periods are coalesced to be part of the key
+    key = "company_id, date, coalesce(period_start, ''), coalesce(period_end, '')"
+
+    with closing(sqlite3.connect(database_path)) as connection:
+        # Tuned for loading in bulk: the WAL allows readers during the load, and with it, only syncing at
+        # checkpoints does not risk corrupting the database, only losing the most recent transactions
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.execute("PRAGMA temp_store = MEMORY")
+        connection.execute("PRAGMA cache_size = -262144")  # 256 MiB
+        with connection:
+            connection.executescript(f"""
+                CREATE TABLE IF NOT EXISTS accounts (
+                    {", ".join(f"{column} {sqlite_types[column_types[column]]}" for column in _COLUMNS)}
+                );
+                CREATE UNIQUE INDEX IF NOT EXISTS accounts_key ON accounts ({key});
+                -- A daily and a monthly ZIP file can end on the same date, so each is keyed on both of its dates
+                CREATE TABLE IF NOT EXISTS zip_files (
+                    start_date TEXT NOT NULL,
+                    end_date TEXT NOT NULL,
+                    loaded_at TEXT NOT NULL,
+                    PRIMARY KEY (start_date, end_date)
+                );
+            """)
+        latest_completed_date = datetime.date.fromisoformat(
+            connection.execute("SELECT max(end_date) FROM zip_files").fetchone()[0] or datetime.date.min.isoformat()
+        )
+
+        with stream_read_xbrl_sync(
+            latest_completed_date,
+            zip_cache_folder=zip_cache_folder,
+            zip_cache_max_size=zip_cache_max_size,
+            catalogue_path=catalogue_path,
+            member_filter=member_filter,
+            row_filter=row_filter,
+            member_timeout=member_timeout,
+            max_member_memory=max_member_memory,
+            parse_cache_folder=parse_cache_folder,
+            bad_xml_folder=bad_xml_folder,
+        ) as (columns, final_date_and_rows):
+            converters: dict[type, collections.abc.Callable[[typing.Any], str]] = {
+                datetime.date: operator.methodcaller("isoformat"),
+                decimal.Decimal: str,
+            }
+            to_sqlite = tuple(converters.get(column_types[column]) for column in columns)
+            upsert = f"""
+                INSERT INTO accounts ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})
+                ON CONFLICT ({key}) DO UPDATE SET {", ".join(f"{column} = excluded.{column}" for column in columns)}
+                WHERE ({", ".join(columns)}) IS NOT ({", ".join(f"excluded.{column}" for column in columns)})
+            """  # noqa: S608
+
+            for (start_date, final_date), rows in final_date_and_rows:
+                name = f"{start_date}--{final_date}"
+                logger.info("Saving Companies House accounts data %s to %s ...", name, database_path)
+                with connection:
+                    total_changes = connection.total_changes
+                    it = iter(rows)
+                    while batch := tuple(islice(it, batch_size)):
+                        connection.executemany(
+                            upsert,
+                            (
+                                tuple(
+                                    value if convert is None or value is None else convert(value)
+                                    for convert, value in zip(to_sqlite, row)
+                                )
+                                for row in batch
+                            ),
+                        )
+                    num_changes = connection.total_changes - total_changes
+                    connection.execute(
+                        "INSERT OR REPLACE INTO zip_files (start_date, end_date, loaded_at) VALUES (?, ?, ?)",
+                        (
+                            start_date.isoformat(),
+                            final_date.isoformat(),
+                            datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                        ),
+                    )
+                logger.info(
+                    "Saving Companies House accounts data %s to %s (done, %s rows inserted or updated)",
+                    name,
+                    database_path,
+                    num_changes,
+                )
+
+        # Indexes for querying are created after the first load, which is faster than maintaining them during it
+        with connection:
+            connection.executescript("""
+                CREATE INDEX IF NOT EXISTS accounts_companies_house_registered_number
+                    ON accounts (companies_house_registered_number);
+                CREATE INDEX IF NOT EXISTS accounts_balance_sheet_date ON accounts (balance_sheet_date);
+            """)
+
+
+@contextmanager
+def stream_read_xbrl_sync_snapshot(
+    snapshot_path: str,
+    zip_cache_folder: str | None = None,
+    zip_cache_max_size: int | None = None,
+    catalogue_path: str | None = None,
+    batch_size: int = 10_000,
+    member_filter: collections.abc.Callable[[str], bool] | None = None,
+    row_filter: XBRLRowFilter | None = None,
+    member_timeout: float | None = None,
+    max_member_memory: int | None = None,
+    parse_cache_folder: str | None = None,
+    bad_xml_folder: str | None = None,
+) -> typing.Generator[
+    tuple[
+        tuple[str, ...],
+        typing.Generator[
+            tuple[tuple[datetime.date, datetime.date], typing.Generator[XBRLRow, None, None]],
+            None,
+            None,
+        ],
+    ],
+    None,
+    None,
+]:
+    """Maintains a snapshot of the latest filing of each company in a SQLite database, and yields the changes.
+
+    The companies table of the snapshot has a row per company_id: the row of its latest filing and period, by
+    date, then period_end, then period_start, then run_code. For each ZIP file not yet in the snapshot, the rows
+    yielded are those for companies that are new to the snapshot, or have a later filing or period, and so are
+    the changes to apply to a copy of the snapshot keyed on company_id. The changes from each ZIP file are
+    saved to the snapshot, along with its date range to resume from, once all of its rows have been iterated
+    over. member_filter, row_filter, member_timeout, max_member_memory, parse_cache_folder and bad_xml_folder are
+    as for stream_read_xbrl_zip.
+
+    Yields:
+    A tuple of (columns, date_range_and_changes), as for stream_read_xbrl_sync.
+    The changes yielded for each date range are XBRLRow tuples, in order of company_id.
+    """
+    sqlite_types = {str: "TEXT", bool: "INTEGER", datetime.date: "TEXT", decimal.Decimal: "TEXT"}
+    column_types = dict(zip(_COLUMNS, _COLUMN_TYPES))
+    to_sqlite_converters: dict[type, collections.abc.Callable[[typing.Any], typing.Any]] = {
+        datetime.date: operator.methodcaller("isoformat"),
+        decimal.Decimal: str,
+    }
+    from_sqlite_converters: dict[type, collections.abc.Callable[[typing.Any], typing.Any]] = {
+        bool: bool,
+        datetime.date: datetime.date.fromisoformat,
+        decimal.Decimal: decimal.Decimal,
+    }
+    to_sqlite = tuple(to_sqlite_converters.get(column_types[column]) for column in _COLUMNS)
+    from_sqlite = tuple(from_sqlite_converters.get(column_types[column]) for column in _COLUMNS)
+
+    # Decimals are stored as TEXT rather than NUMERIC, which SQLite would convert to floating point
+    table_columns = ", ".join(
+        f"{column} {sqlite_types[column_types[column]]}{' PRIMARY KEY' if column == 'company_id' else ''}"
+        for column in _COLUMNS
+    )
+    columns = ", ".join(_COLUMNS)
+
+    def rank(table: str) -> str:
+        return f"({table}.date, coalesce({table}.period_end, ''), coalesce({table}.period_start, ''), {table}.run_code)"
+
+    def upsert_latest(table: str, source: str) -> str:
+        return f"""
+            INSERT INTO {table} ({columns}) {source}
+            ON CONFLICT (company_id) DO UPDATE SET {", ".join(f"{column} = excluded.{column}" for column in _COLUMNS)}
+            WHERE {rank("excluded")} > {rank(table)}
+        """
+
+    with closing(sqlite3.connect(snapshot_path)) as connection:
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        with connection:
+            connection.executescript(f"""
+                CREATE TABLE IF NOT EXISTS companies ({table_columns});
+                -- A daily and a monthly ZIP file can end on the same date, so each is keyed on both of its dates
+                CREATE TABLE IF NOT EXISTS zip_files (
+                    start_date TEXT NOT NULL,
+                    end_date TEXT NOT NULL,
+                    loaded_at TEXT NOT NULL,
+                    PRIMARY KEY (start_date, end_date)
+                );
+            """)
+        latest_completed_date = datetime.date.fromisoformat(
+            connection.execute("SELECT max(end_date) FROM zip_files").fetchone()[0] or datetime.date.min.isoformat()
+        )
+
+        def changes(
+            start_date: datetime.date, final_date: datetime.date, rows: typing.Generator[XBRLRow, None, None]
+        ) -> typing.Generator[XBRLRow, None, None]:
+            # The latest row of each company in the ZIP file is found in a staging table, which is then compared
+            # with the snapshot. Only once all changes have been yielded are they saved to the snapshot, so they
+            # are yielded again if iteration stops part way through
+            with connection:
+                connection.execute(f"CREATE TEMP TABLE IF NOT EXISTS staging ({table_columns})")
+                connection.execute("DELETE FROM staging")
+                insert = upsert_latest("staging", f"VALUES ({', '.join('?' * len(_COLUMNS))})")
+                it = iter(rows)
+                while batch := tuple(islice(it, batch_size)):
+                    connection.executemany(
+                        insert,
+                        (
+                            tuple(
+                                value if convert is None or value is None else convert(value)
+                                for convert, value in zip(to_sqlite, row)
+                            )
+                            for row in batch
+                        ),
+                    )
+
+                num_changes = 0
+                for row in connection.execute(f"""
+                    SELECT {", ".join(f"staging.{column}" for column in _COLUMNS)}
+                    FROM staging LEFT JOIN companies ON companies.company_id = staging.company_id
+                    WHERE companies.company_id IS NULL OR {rank("staging")} > {rank("companies")}
+                    ORDER BY staging.company_id
+                """):  # noqa: S608
+                    num_changes += 1
+                    yield tuple(
+                        value if convert is None or value is None else convert(value)
+                        for convert, value in zip(from_sqlite, row)
+                    )
+
+                connection.execute(upsert_latest("companies", "SELECT * FROM staging WHERE true"))
+                connection.execute("DELETE FROM staging")
+                connection.execute(
+                    "INSERT OR REPLACE INTO zip_files (start_date, end_date, loaded_at) VALUES (?, ?, ?)",
+                    (
+                        start_date.isoformat(),
+                        final_date.isoformat(),
+                        datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    ),
+                )
+            logger.info(
+                "Saved %s changes from Companies House accounts data %s--%s to %s",
+                num_changes,
+                start_date,
+                final_date,
+                snapshot_path,
+            )
+
+        with stream_read_xbrl_sync(
+            latest_completed_date,
+            zip_cache_folder=zip_cache_folder,
+            zip_cache_max_size=zip_cache_max_size,
+            catalogue_path=catalogue_path,
+            member_filter=member_filter,
+            row_filter=row_filter,
+            member_timeout=member_timeout,
+            max_member_memory=max_member_memory,
+            parse_cache_folder=parse_cache_folder,
+            bad_xml_folder=bad_xml_folder,
+        ) as (sync_columns, final_date_and_rows):
+            yield (
+                sync_columns,
+                (
+                    ((start_date, final_date), changes(start_date, final_date, rows))
+                    for (start_date, final_date), rows in final_date_and_rows
+                ),
+            )
+
+
+def _indexed_remote_file(zip_cache_folder: str | None, zip_url: str, etag: str | None) -> _RemoteFile:
+    # The cached ZIP is only used if it is the same version of the file as was indexed
+    if zip_cache_folder is not None:
+        zip_path, metadata_path = _zip_cache_paths(zip_cache_folder, zip_url)
+        try:
+            metadata = json.loads(metadata_path.read_bytes())
+        except (OSError, ValueError):
+            metadata = None
+        if metadata is not None and metadata.get("etag") == etag and zip_path.exists():
+            return _RemoteFile(etag, metadata.get("last_modified"), zip_path.stat().st_size, zip_path)
+    return _RemoteFile(etag)
+
+
+@contextmanager
+def stream_read_xbrl_company(
+    company_id: str,
+    catalogue_path: str,
+    zip_cache_folder: str | None = None,
+    get_client: collections.abc.Callable[[], httpx.Client] = _default_client,
+    member_filter: collections.abc.Callable[[str], bool] | None = None,
+    row_filter: XBRLRowFilter | None = None,
+) -> typing.Generator[tuple[tuple[str, ...], typing.Generator[XBRLRow, None, None]], None, None]:
+    """Yields parsed XBRL data of every filing of a company, using the locations of members saved in the catalogue.
+
+    The locations are saved by stream_read_xbrl_sync with index_members=True. Each member file is read from the ZIP
+    in zip_cache_folder if it is the same version as was indexed, and otherwise fetched with range requests. A
+    filing in more than one ZIP is only read once, from a cached ZIP if there is one. Locations in ZIP files no
+    longer in the catalogue are skipped, and if a member can't be read from one ZIP, such as if it has changed since
+    it was indexed, the next ZIP it is in is tried. member_filter and row_filter are as for stream_read_xbrl_zip, and
+    member files excluded by member_filter are not read.
+
+    Yields:
+    A tuple of (_COLUMNS, row_generator).
+    The row_generator yields XBRLRow tuples with the zip_url appended to each row, in order of the date of filing.
+    """
+    conditions = _row_filter_conditions(row_filter)
+    with get_client() as client, _open_catalogue(catalogue_path) as catalogue:
+        locations = catalogue.execute(
+            """
+            SELECT
+                member_locations.run_code, member_locations.date, member_locations.zip_url, member_locations.name,
+                member_locations.local_header_offset, member_locations.compressed_size, member_locations.crc_32,
+                zip_files.etag
+            FROM member_locations INNER JOIN zip_files ON zip_files.url = member_locations.zip_url
+            WHERE member_locations.company_id = ?
+            ORDER BY member_locations.date, member_locations.run_code, member_locations.zip_url
+            """,
+            (company_id,),
+        ).fetchall()
+
+        def rows() -> typing.Generator[XBRLRow, None, None]:
+            for _, filing_locations in groupby(locations, key=operator.itemgetter(0, 1)):
+                candidates = sorted(
+                    (
+                        (_indexed_remote_file(zip_cache_folder, zip_url, etag), zip_url, *location)
+                        for _, _, zip_url, *location, etag in filing_locations
+                        if member_filter is None or member_filter(location[0])
+                    ),
+                    key=lambda location: location[0].path is None,
+                )
+                for i, (remote_file, zip_url, name, local_header_offset, compressed_size, crc_32) in enumerate(
+                    candidates
+                ):
+                    logger.info("Reading %s from %s", name, remote_file.path or zip_url)
+                    try:
+                        content = _get_zip_member(
+                            functools.partial(_get_zip_range, client, zip_url, remote_file),
+                            local_header_offset,
+                            compressed_size,
+                            crc_32,
+                        )
+                    except (httpx.HTTPError, ValueError):
+                        if i == len(candidates) - 1:
+                            raise
+                        logger.warning("Unable to read %s from %s, trying the next ZIP", name, zip_url, exc_info=True)
+                        continue
+                    for row in _filter_rows(_xbrl_to_rows((name, content))[0], conditions):
+                        yield (*row, zip_url)
+                    break
+
+        yield _COLUMNS, rows()
+
+
+def stream_read_xbrl_debug(
+    zip_url: str,
+    run_code: str,
+    company_id: str,
+    date: datetime.date,
+    debug_cache_folder: str = ".debug-cache",
+    debug_cache_max_size: int | None = None,
+    get_client: collections.abc.Callable[[], httpx.Client] = _default_client,
+    chunk_size: int = 100 * 1048576,  # 100 MiB
+    catalogue_path: str | None = None,
+) -> None:
+    """Debug function that extracts a specific XBRL file from a ZIP archive and prints info.
+
+    If catalogue_path is passed and the location of the file has been saved to it by stream_read_xbrl_sync with
+    index_members=True, only the file itself is read, rather than searching through the ZIP.
+    """
+    if catalogue_path is not None:
+        with _open_catalogue(catalogue_path) as catalogue:
+            location = catalogue.execute(
+                """
+                SELECT name, local_header_offset, compressed_size, crc_32, zip_files.etag
+                FROM member_locations INNER JOIN zip_files ON zip_files.url = member_locations.zip_url
+                WHERE company_id = ? AND date = ? AND run_code = ? AND zip_url = ?
+                """,
+                (company_id, date.isoformat(), run_code, zip_url),
+            ).fetchone()
+        if location is not None:
+            name, local_header_offset, compressed_size, crc_32, etag = location
+            remote_file = _indexed_remote_file(debug_cache_folder, zip_url, etag)
+            print("Reading", name, "from", remote_file.path or zip_url, "using its saved location", file=sys.stderr)
+            with get_client() as client:
+                sys.stdout.buffer.write(
+                    _get_zip_member(
+                        functools.partial(_get_zip_range, client, zip_url, remote_file),
+                        local_header_offset,
+                        compressed_size,
+                        crc_32,
+                    )
+                )
+            print("Finished", file=sys.stderr)
+            return
+
+    with (
+        get_client() as client,
+        _get_zip_content_streamed(client, zip_url, chunk_size, debug_cache_folder, debug_cache_max_size) as (
+            _,
+            chunks,
+        ),
+    ):
+        print("Fetching", zip_url, "via local cache in", debug_cache_folder, file=sys.stderr)
+        _print_xbrl_member(chunks, run_code, company_id, date)
+
+        # Finishes the download even if the search stopped early, so the ZIP is still saved to the cache
+        collections.deque(chunks, maxlen=0)
+
+
+def _print_xbrl_member(chunks: typing.Iterable[bytes], run_code: str, company_id: str, date: datetime.date) -> None:
     print("Searching ZIP for member file matching", run_code, company_id, date, file=sys.stderr)
     found = False
-    for name, _, chunks in stream_unzip(local_chunks()):
+    for name, _, member_chunks in stream_unzip(chunks):
         fn = pathlib.Path(name.decode("utf-8")).name
         mo = re.match(r"^(Prod\d+_\d+)_([^_]+)_(\d\d\d\d\d\d\d\d)\.(html|xml)", fn)
         if not mo:
@@ -913,10 +4190,10 @@ def stream_read_xbrl_debug(
         if run_code_ == run_code and company_id_ == company_id and date_ == date.isoformat().replace("-", ""):
             print("Found matching file", name, file=sys.stderr)
             found = True
-            for chunk in chunks:
+            for chunk in member_chunks:
                 sys.stdout.buffer.write(chunk)
         else:
-            collections.deque(chunks, maxlen=0)
+            collections.deque(member_chunks, maxlen=0)
 
     if not found:
         print("No matching member file found", file=sys.stderr)
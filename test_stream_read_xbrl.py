@@ -3,23 +3,59 @@
 from __future__ import annotations
 
 import csv
+import gzip
+import hashlib
+import inspect
+import io
+import itertools
+import json
+import logging
+import os
 import pathlib
+import signal
+import sqlite3
 import tempfile
+import threading
+import time
+import tracemalloc
 import typing
+import zipfile
+from contextlib import closing, contextmanager
 from datetime import MINYEAR, date, datetime
 from decimal import Decimal
 
 import boto3
 import httpx
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import pytest
+import zstandard
 from moto import mock_aws
+from stream_unzip import TruncatedDataError, stream_unzip
 from stream_zip import ZIP_32, stream_zip
 
+import stream_read_xbrl
 from stream_read_xbrl import (
+    filter_members,
+    partition_by_balance_sheet_year,
+    partition_by_company_id_bucket,
+    read_xbrl_zip_pandas,
+    stream_read_xbrl_company,
     stream_read_xbrl_debug,
     stream_read_xbrl_sync,
+    stream_read_xbrl_sync_arrow,
     stream_read_xbrl_sync_s3_csv,
+    stream_read_xbrl_sync_s3_parquet,
+    stream_read_xbrl_sync_snapshot,
+    stream_read_xbrl_sync_sqlite,
     stream_read_xbrl_zip,
+    stream_read_xbrl_zip_arrow,
+    stream_read_xbrl_zip_batches,
+    stream_write_xbrl_csv,
+    stream_write_xbrl_parquet,
+    stream_write_xbrl_pgcopy,
+    stream_xbrl_to_sinks,
 )
 
 if typing.TYPE_CHECKING:
@@ -633,6 +669,32 @@ def mock_companies_house_historic_zip_2009(httpx_mock: pytest_httpx.HTTPXMock) -
         )
 
 
+@pytest.fixture
+def mock_companies_house_daily_zip_ranges(httpx_mock: pytest_httpx.HTTPXMock) -> None:
+    _add_zip_ranges_callback(httpx_mock, "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip")
+
+
+def _add_zip_ranges_callback(
+    httpx_mock: pytest_httpx.HTTPXMock, url: str, validators: dict[str, str] | None = None
+) -> None:
+    validators = {"etag": '"the-tag"'} if validators is None else validators
+    with pathlib.Path.open(BASE_DIR / "fixtures/Accounts_Bulk_Data-2023-03-02.zip", "rb") as f:
+        content = f.read()
+
+    def callback(request: httpx.Request) -> httpx.Response:
+        if "range" not in request.headers:
+            return httpx.Response(200, content=content, headers=validators)
+        start_str, end_str = request.headers["range"].removeprefix("bytes=").split("-")
+        start, end = int(start_str), min(int(end_str), len(content) - 1)
+        return httpx.Response(
+            206,
+            content=content[start : end + 1],
+            headers={**validators, "content-range": f"bytes {start}-{end}/{len(content)}"},
+        )
+
+    httpx_mock.add_callback(callback, is_reusable=True, url=url)
+
+
 @pytest.fixture
 def mock_companies_house_daily_zip_404(httpx_mock: pytest_httpx.HTTPXMock) -> None:
     with pathlib.Path.open(BASE_DIR / "fixtures/Accounts_Bulk_Data-2023-03-02.zip", "rb"):
@@ -696,6 +758,51 @@ def mock_companies_house_invalid_inner_zip(httpx_mock: pytest_httpx.HTTPXMock) -
         )
 
 
+_original_xbrl_to_rows = stream_read_xbrl._xbrl_to_rows  # noqa: SLF001
+
+
+def _xbrl_to_rows_pathological(name_xbrl_xml_str: tuple[str, bytes]) -> tuple[tuple[tuple[typing.Any, ...], ...], bool]:
+    # Patched in to the worker processes, which are forked after patching, to misbehave for certain members
+    name, _ = name_xbrl_xml_str
+    if "_14033910_" in name:
+        time.sleep(60)
+    if "_NI681295_" in name:
+        os.kill(os.getpid(), signal.SIGKILL)
+    if "_OC437536_" in name:
+        bytearray(2**40)
+    return _original_xbrl_to_rows(name_xbrl_xml_str)
+
+
+def _expected_pathological_data(
+    zip_url: str | None, member_timeout: float, max_member_memory: int
+) -> tuple[dict[str, typing.Any], ...]:
+    def error_row(company_id: str, row_date: date, error: str) -> dict[str, typing.Any]:
+        return {
+            **dict.fromkeys(expected_data[0]),
+            "run_code": "Prod223_3384",
+            "company_id": company_id,
+            "date": row_date,
+            "file_type": "html",
+            "error": error,
+            "zip_url": zip_url,
+        }
+
+    errors = {
+        "14033910": error_row("14033910", date(2022, 8, 31), f"Timed out after {member_timeout} seconds"),
+        "NI681295": error_row("NI681295", date(2022, 8, 31), "Worker process stopped"),
+        "OC437536": error_row(
+            "OC437536", date(2022, 5, 31), f"Ran out of memory, limited to {max_member_memory} bytes"
+        ),
+    }
+    expected = []
+    for row in get_expected_data(zip_url):
+        if row["company_id"] not in errors:
+            expected.append(row)
+        elif errors[row["company_id"]] not in expected:
+            expected.append(errors[row["company_id"]])
+    return tuple(expected)
+
+
 @pytest.mark.usefixtures("mock_companies_house_daily_zip")
 @pytest.mark.benchmark(group="TestSteamReadXbrlZip", warmup=True)
 class TestSteamReadXbrlZip:
@@ -707,6 +814,195 @@ class TestSteamReadXbrlZip:
         ):
             assert tuple(dict(zip(columns, row)) for row in rows) == get_expected_data(None)
 
+    @staticmethod
+    def test_stream_read_xbrl_zip_member_filter(caplog: pytest.LogCaptureFixture) -> None:
+        company_ids = {"09355500", "SC720321", "SC722766"}
+        with (
+            caplog.at_level(logging.INFO),
+            httpx.stream("GET", "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip") as r,
+            stream_read_xbrl_zip(
+                r.iter_bytes(chunk_size=65536),
+                member_filter=filter_members(company_ids=company_ids, start_date=date(2023, 1, 1)),
+            ) as (columns, rows),
+        ):
+            assert tuple(dict(zip(columns, row)) for row in rows) == tuple(
+                row
+                for row in get_expected_data(None)
+                if row["company_id"] in company_ids and row["date"] >= date(2023, 1, 1)
+            )
+        assert "Skipped 7 of 9 members of None without parsing them" in caplog.text
+
+    @staticmethod
+    def test_stream_read_xbrl_zip_sampled() -> None:
+        def sampled_company_ids(sample_rate: float) -> set[typing.Any]:
+            with (
+                httpx.stream("GET", "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip") as r,
+                stream_read_xbrl_zip(
+                    r.iter_bytes(chunk_size=65536), member_filter=filter_members(sample_rate=sample_rate)
+                ) as (columns, rows),
+            ):
+                return {dict(zip(columns, row))["company_id"] for row in rows}
+
+        half = sampled_company_ids(0.5)
+        assert half == {"09355500", "14033910", "NI682066", "SC720321", "SC722766"}
+        assert sampled_company_ids(0.5) == half
+        assert sampled_company_ids(0.2) == {"NI682066"}
+        assert sampled_company_ids(0) == set()
+        assert len(sampled_company_ids(1)) == len({row["company_id"] for row in expected_data})
+
+        with pytest.raises(ValueError, match="sample_rate"):
+            filter_members(sample_rate=1.5)
+
+    @staticmethod
+    def test_stream_read_xbrl_zip_pathological_members(monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr(stream_read_xbrl, "_xbrl_to_rows", _xbrl_to_rows_pathological)
+        member_timeout = 2
+        max_member_memory = 2**39
+        with (
+            httpx.stream("GET", "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip") as r,
+            stream_read_xbrl_zip(
+                r.iter_bytes(chunk_size=65536), member_timeout=member_timeout, max_member_memory=max_member_memory
+            ) as (columns, rows),
+        ):
+            parsed = tuple(dict(zip(columns, row)) for row in rows)
+
+        assert parsed == _expected_pathological_data(None, member_timeout, max_member_memory)
+
+    @staticmethod
+    def test_stream_read_xbrl_zip_parse_cache(caplog: pytest.LogCaptureFixture) -> None:
+        def read(
+            parse_cache_folder: str, row_filter: tuple[tuple[str, str, bool], ...] = ()
+        ) -> tuple[dict[str, typing.Any], ...]:
+            with (
+                httpx.stream("GET", "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip") as r,
+                stream_read_xbrl_zip(
+                    r.iter_bytes(chunk_size=65536), parse_cache_folder=parse_cache_folder, row_filter=row_filter
+                ) as (columns, rows),
+            ):
+                return tuple(dict(zip(columns, row)) for row in rows)
+
+        with tempfile.TemporaryDirectory() as directory, caplog.at_level(logging.INFO):
+            first = read(directory)
+            assert "0 of 9 members (0.0%)" in caplog.text
+            caplog.clear()
+            second = read(directory)
+            assert "9 of 9 members (100.0%)" in caplog.text
+            filtered = read(directory, (("company_dormant", "==", True),))
+
+        assert first == get_expected_data(None)
+        assert second == get_expected_data(None)
+        assert filtered == tuple(row for row in get_expected_data(None) if row["company_dormant"] is True)
+
+    @staticmethod
+    def test_stream_read_xbrl_zip_parse_cache_without_source(
+        monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+    ) -> None:
+        def getsource(_: object) -> str:
+            raise OSError
+
+        monkeypatch.setattr(inspect, "getsource", getsource)
+        stream_read_xbrl._parse_cache_version.cache_clear()  # noqa: SLF001
+        try:
+            with (
+                tempfile.TemporaryDirectory() as directory,
+                caplog.at_level(logging.INFO),
+                httpx.stream("GET", "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip") as r,
+                stream_read_xbrl_zip(r.iter_bytes(chunk_size=65536), parse_cache_folder=directory) as (
+                    columns,
+                    rows,
+                ),
+            ):
+                parsed = tuple(dict(zip(columns, row)) for row in rows)
+                cached = list(pathlib.Path(directory).iterdir())
+        finally:
+            stream_read_xbrl._parse_cache_version.cache_clear()  # noqa: SLF001
+
+        assert parsed == get_expected_data(None)
+        assert cached == []
+        assert "Unable to find the source of the parser" in caplog.text
+        assert "Parse cache hits" not in caplog.text
+
+    @staticmethod
+    def test_stream_read_xbrl_zip_row_filter() -> None:
+        row_filter = (
+            ("balance_sheet_date", ">=", date(2022, 8, 31)),
+            ("cash_bank_in_hand", "is not", None),
+            ("company_dormant", "!=", True),
+        )
+        with (
+            httpx.stream("GET", "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip") as r,
+            stream_read_xbrl_zip(r.iter_bytes(chunk_size=65536), row_filter=row_filter) as (columns, rows),
+        ):
+            filtered = tuple(dict(zip(columns, row)) for row in rows)
+
+        expected = tuple(
+            row
+            for row in get_expected_data(None)
+            if row["balance_sheet_date"] is not None
+            and row["balance_sheet_date"] >= date(2022, 8, 31)
+            and row["cash_bank_in_hand"] is not None
+            and row["company_dormant"] is not True
+        )
+        assert expected
+        assert filtered == expected
+
+    @staticmethod
+    @pytest.mark.httpx_mock(assert_all_responses_were_requested=False)
+    @pytest.mark.parametrize(
+        "row_filter",
+        [
+            (("zip_url", "==", "https://example.com/"),),
+            (("company_id", "~", "0"),),
+            (("company_id", "is", "0"),),
+            (("balance_sheet_date", ">", "2022-01-01"),),
+        ],
+    )
+    def test_stream_read_xbrl_zip_invalid_row_filter(row_filter: tuple[tuple[str, str, typing.Any], ...]) -> None:
+        with (
+            pytest.raises(ValueError, match="filtering rows"),
+            stream_read_xbrl_zip((), row_filter=row_filter),
+        ):
+            pass
+
+    @staticmethod
+    def test_stream_read_xbrl_zip_batches() -> None:
+        batch_size = 2
+        with (
+            httpx.stream("GET", "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip") as r,
+            stream_read_xbrl_zip_batches(r.iter_bytes(chunk_size=65536), batch_size=batch_size) as (columns, batches),
+        ):
+            batches_list = tuple(batches)
+
+        assert all(len(batch) == batch_size for _, batch in batches_list[:-1])
+        assert "zip_url" not in columns
+        assert tuple(
+            {**dict(zip(columns, row)), "zip_url": zip_url} for zip_url, batch in batches_list for row in batch
+        ) == get_expected_data(None)
+
+    @staticmethod
+    def test_stream_read_xbrl_zip_batches_zip_url_and_parse_cache() -> None:
+        zip_url = "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip"
+        with tempfile.TemporaryDirectory() as parse_cache_folder:
+            for _ in range(2):
+                with (
+                    httpx.stream("GET", zip_url) as r,
+                    stream_read_xbrl_zip_batches(
+                        r.iter_bytes(chunk_size=65536),
+                        zip_url,
+                        parse_cache_folder=parse_cache_folder,
+                        member_timeout=60,
+                    ) as (columns, batches),
+                ):
+                    batches_list = tuple(batches)
+                num_cached = sum(1 for path in pathlib.Path(parse_cache_folder).rglob("*") if path.is_file())
+
+                assert tuple(
+                    {**dict(zip(columns, row)), "zip_url": batch_zip_url}
+                    for batch_zip_url, batch in batches_list
+                    for row in batch
+                ) == get_expected_data(zip_url)
+                assert num_cached > 0
+
     @staticmethod
     def test_bench_stream_read_xbrl_zip(benchmark: pytest_benchmark.fixture.BenchmarkFixture) -> None:
         with httpx.stream("GET", "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip") as r:
@@ -800,9 +1096,62 @@ class TestStreamReadXbrlSync:
             )
 
     @staticmethod
-    def _exhaust_stream(date: date) -> None:
+    def test_stream_read_xbrl_sync_concurrent_zips() -> None:
+        with stream_read_xbrl_sync() as (_columns, date_range_and_rows):
+            expected = tuple((date_range, tuple(rows)) for (date_range, rows) in date_range_and_rows)
+
+        with stream_read_xbrl_sync(max_concurrent_zips=3) as (_columns, date_range_and_rows):
+            assert tuple((date_range, tuple(rows)) for (date_range, rows) in date_range_and_rows) == expected
+
+        with stream_read_xbrl_sync(max_concurrent_zips=3, in_completion_order=True) as (
+            _columns,
+            date_range_and_rows,
+        ):
+            assert sorted((date_range, tuple(rows)) for (date_range, rows) in date_range_and_rows) == sorted(expected)
+
+    @staticmethod
+    def test_stream_read_xbrl_sync_concurrent_zips_pathological_members(monkeypatch: pytest.MonkeyPatch) -> None:
+        # So the members of both ZIPs are in the pool at once, and a member timing out in one ZIP interrupts the
+        # members of the other
+        monkeypatch.setattr(stream_read_xbrl, "_xbrl_to_rows", _xbrl_to_rows_pathological)
+        monkeypatch.setattr(stream_read_xbrl, "_num_workers", lambda: 4)
+        member_timeout = 2
+        max_member_memory = 2**39
+        with stream_read_xbrl_sync(
+            date(2022, 7, 30),
+            max_concurrent_zips=2,
+            member_timeout=member_timeout,
+            max_member_memory=max_member_memory,
+        ) as (columns, date_range_and_rows):
+            parsed = tuple(tuple(dict(zip(columns, row)) for row in rows) for _, rows in date_range_and_rows)
+
+        assert parsed == tuple(
+            _expected_pathological_data(zip_url, member_timeout, max_member_memory)
+            for zip_url in (
+                "https://download.companieshouse.gov.uk/Accounts_Monthly_Data-July2022.zip",
+                "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip",
+            )
+        )
+
+    @staticmethod
+    def test_stream_read_xbrl_sync_arrow() -> None:
+        with stream_read_xbrl_sync() as (_columns, date_range_and_rows):
+            expected = tuple((date_range, tuple(rows)) for (date_range, rows) in date_range_and_rows)
+
+        with stream_read_xbrl_sync_arrow(batch_size=5) as (schema, date_range_and_batches):
+            assert (
+                tuple(
+                    (date_range, tuple(tuple(row.values()) for batch in batches for row in batch.to_pylist()))
+                    for (date_range, batches) in date_range_and_batches
+                )
+                == expected
+            )
+        assert str(schema.field("date").type) == "date32[day]"
+
+    @staticmethod
+    def _exhaust_stream(date: date, max_concurrent_zips: int = 1) -> None:
         """Helper function to run the full stream generation."""
-        with stream_read_xbrl_sync(date) as (_columns, date_range_and_rows):
+        with stream_read_xbrl_sync(date, max_concurrent_zips=max_concurrent_zips) as (_columns, date_range_and_rows):
             for _date_range, rows in date_range_and_rows:
                 for _row in rows:
                     pass
@@ -819,6 +1168,561 @@ class TestStreamReadXbrlSync:
     def test_bench_stream_read_xbrl_sync_end_of_month(benchmark: pytest_benchmark.fixture.BenchmarkFixture) -> None:
         benchmark(TestStreamReadXbrlSync._exhaust_stream, date(2022, 7, 31))
 
+    @staticmethod
+    @pytest.mark.parametrize("max_concurrent_zips", [1, 3])
+    def test_bench_stream_read_xbrl_sync_concurrent_zips(
+        benchmark: pytest_benchmark.fixture.BenchmarkFixture, max_concurrent_zips: int
+    ) -> None:
+        benchmark(TestStreamReadXbrlSync._exhaust_stream, date(MINYEAR, 1, 1), max_concurrent_zips)
+
+
+@pytest.mark.usefixtures(
+    "mock_companies_house_daily_zip",
+    "mock_companies_house_daily_html",
+    "mock_companies_house_monthly_zip",
+    "mock_companies_house_monthly_html",
+)
+@pytest.mark.httpx_mock(assert_all_responses_were_requested=False)
+class TestZipCache:
+    daily_zip_url = "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip"
+
+    @staticmethod
+    def _sync(
+        zip_cache_folder: str, zip_cache_max_size: int | None = None, *, monthly: bool = False
+    ) -> tuple[tuple[tuple[date, date], tuple[dict[str, typing.Any], ...]], ...]:
+        data_url = (
+            "https://download.companieshouse.gov.uk/en_monthlyaccountsdata.html"
+            if monthly
+            else "https://download.companieshouse.gov.uk/en_accountsdata.html"
+        )
+        with stream_read_xbrl_sync(
+            data_urls=(data_url,), zip_cache_folder=zip_cache_folder, zip_cache_max_size=zip_cache_max_size
+        ) as (columns, date_range_and_rows):
+            return tuple(
+                (date_range, tuple(dict(zip(columns, row)) for row in rows))
+                for (date_range, rows) in date_range_and_rows
+            )
+
+    @staticmethod
+    def test_cached_zip_used_if_not_modified(httpx_mock: pytest_httpx.HTTPXMock) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            first = TestZipCache._sync(directory)
+            httpx_mock.add_response(
+                method="HEAD",
+                url=TestZipCache.daily_zip_url,
+                status_code=304,
+                match_headers={"if-none-match": '"the-tag"'},
+            )
+            second = TestZipCache._sync(directory)
+
+        assert (
+            first == second == (((date(2023, 3, 2), date(2023, 3, 2)), get_expected_data(TestZipCache.daily_zip_url)),)
+        )
+        assert len(httpx_mock.get_requests(method="GET", url=TestZipCache.daily_zip_url)) == 1
+
+    @staticmethod
+    def test_least_recently_used_zip_evicted() -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            TestZipCache._sync(directory, zip_cache_max_size=1)
+            TestZipCache._sync(directory, zip_cache_max_size=1, monthly=True)
+            cached = sorted(path.name for path in pathlib.Path(directory).iterdir())
+
+        monthly_zip_url = "https://download.companieshouse.gov.uk/Accounts_Monthly_Data-July2022.zip"
+        hashed_monthly_zip_url = hashlib.sha256(monthly_zip_url.encode()).hexdigest()
+        assert cached == [hashed_monthly_zip_url, f"{hashed_monthly_zip_url}.json"]
+
+
+@pytest.mark.usefixtures("mock_companies_house_daily_zip")
+class TestCatalogue:
+    index_page_url = "https://download.companieshouse.gov.uk/en_accountsdata.html"
+    daily_zip_url = "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip"
+
+    @staticmethod
+    def _sync(catalogue_path: str) -> tuple[tuple[tuple[date, date], tuple[dict[str, typing.Any], ...]], ...]:
+        with stream_read_xbrl_sync(data_urls=(TestCatalogue.index_page_url,), catalogue_path=catalogue_path) as (
+            columns,
+            date_range_and_rows,
+        ):
+            return tuple(
+                (date_range, tuple(dict(zip(columns, row)) for row in rows))
+                for (date_range, rows) in date_range_and_rows
+            )
+
+    @staticmethod
+    def test_catalogue_used_if_index_page_not_modified(httpx_mock: pytest_httpx.HTTPXMock) -> None:
+        httpx_mock.add_response(
+            url=TestCatalogue.index_page_url,
+            content=b"""
+                <a href="Accounts_Bulk_Data-2023-03-02.zip">Link</a>
+                <a href="does-not-exist.zip">Link</a>
+            """,
+            headers={"etag": '"index-tag"'},
+        )
+        httpx_mock.add_response(
+            url=TestCatalogue.index_page_url, status_code=304, match_headers={"if-none-match": '"index-tag"'}
+        )
+
+        with tempfile.TemporaryDirectory() as directory:
+            catalogue_path = str(pathlib.Path(directory) / "catalogue.sqlite")
+            first = TestCatalogue._sync(catalogue_path)
+            second = TestCatalogue._sync(catalogue_path)
+            with closing(sqlite3.connect(catalogue_path)) as catalogue:
+                zip_files = catalogue.execute(
+                    "SELECT url, start_date, end_date, size, etag, status FROM zip_files ORDER BY url"
+                ).fetchall()
+
+        assert (
+            first == second == (((date(2023, 3, 2), date(2023, 3, 2)), get_expected_data(TestCatalogue.daily_zip_url)),)
+        )
+        assert zip_files == [
+            (
+                TestCatalogue.daily_zip_url,
+                "2023-03-02",
+                "2023-03-02",
+                (BASE_DIR / "fixtures/Accounts_Bulk_Data-2023-03-02.zip").stat().st_size,
+                '"the-tag"',
+                "processed",
+            ),
+            ("https://download.companieshouse.gov.uk/does-not-exist.zip", None, None, None, None, "pending"),
+        ]
+
+    @staticmethod
+    @pytest.mark.usefixtures(
+        "mock_companies_house_daily_html", "mock_companies_house_monthly_zip", "mock_companies_house_monthly_html"
+    )
+    def test_processed_members_skipped() -> None:
+        monthly_zip_url = "https://download.companieshouse.gov.uk/Accounts_Monthly_Data-July2022.zip"
+
+        def sync(catalogue_path: str) -> tuple[tuple[dict[str, typing.Any], ...], ...]:
+            with stream_read_xbrl_sync(
+                date(2022, 7, 30),
+                data_urls=(
+                    "https://download.companieshouse.gov.uk/en_accountsdata.html",
+                    "https://download.companieshouse.gov.uk/en_monthlyaccountsdata.html",
+                ),
+                catalogue_path=catalogue_path,
+                skip_processed_members=True,
+            ) as (columns, date_range_and_rows):
+                return tuple(tuple(dict(zip(columns, row)) for row in rows) for (_, rows) in date_range_and_rows)
+
+        with tempfile.TemporaryDirectory() as directory:
+            catalogue_path = str(pathlib.Path(directory) / "catalogue.sqlite")
+            first = sync(catalogue_path)
+            second = sync(catalogue_path)
+
+        monthly_keys = {(row["run_code"], row["company_id"], row["date"]) for row in get_expected_data(monthly_zip_url)}
+        assert first == (
+            get_expected_data(monthly_zip_url),
+            tuple(
+                row
+                for row in get_expected_data(TestCatalogue.daily_zip_url)
+                if (row["run_code"], row["company_id"], row["date"]) not in monthly_keys
+            ),
+        )
+        assert second == ((), ())
+
+    @staticmethod
+    @pytest.mark.usefixtures("mock_companies_house_daily_html")
+    def test_processed_members_recorded_once_consumer_moves_on() -> None:
+        def sync(catalogue_path: str, num_rows: int | None, *, move_on: bool) -> tuple[dict[str, typing.Any], ...]:
+            with stream_read_xbrl_sync(
+                date(2022, 7, 30),
+                data_urls=("https://download.companieshouse.gov.uk/en_accountsdata.html",),
+                catalogue_path=catalogue_path,
+                skip_processed_members=True,
+            ) as (columns, date_range_and_rows):
+                _, rows = next(date_range_and_rows)
+                taken = tuple(dict(zip(columns, row)) for row in itertools.islice(rows, num_rows))
+                if move_on:
+                    assert next(date_range_and_rows, None) is None
+                return taken
+
+        expected = get_expected_data(TestCatalogue.daily_zip_url)
+        with tempfile.TemporaryDirectory() as directory:
+            catalogue_path = str(pathlib.Path(directory) / "catalogue.sqlite")
+            # Stopped part way through the ZIP, and then after all of its rows but before they could be saved
+            assert sync(catalogue_path, 3, move_on=False) == expected[:3]
+            assert sync(catalogue_path, None, move_on=False) == expected
+            assert sync(catalogue_path, None, move_on=True) == expected
+            assert sync(catalogue_path, None, move_on=True) == ()
+
+    @staticmethod
+    @pytest.mark.usefixtures("mock_companies_house_daily_html")
+    def test_filtered_members_not_recorded_as_processed() -> None:
+        def sync(
+            catalogue_path: str, member_filter: typing.Callable[[str], bool] | None
+        ) -> tuple[dict[str, typing.Any], ...]:
+            with stream_read_xbrl_sync(
+                date(2022, 7, 30),
+                data_urls=("https://download.companieshouse.gov.uk/en_accountsdata.html",),
+                catalogue_path=catalogue_path,
+                skip_processed_members=True,
+                member_filter=member_filter,
+            ) as (columns, date_range_and_rows):
+                return tuple(dict(zip(columns, row)) for (_, rows) in date_range_and_rows for row in rows)
+
+        with tempfile.TemporaryDirectory() as directory:
+            catalogue_path = str(pathlib.Path(directory) / "catalogue.sqlite")
+            first = sync(catalogue_path, filter_members(company_ids={"09355500"}))
+            with closing(sqlite3.connect(catalogue_path)) as catalogue:
+                catalogue.execute("UPDATE zip_files SET status = 'pending'")
+                catalogue.commit()
+            second = sync(catalogue_path, None)
+
+        expected = get_expected_data(TestCatalogue.daily_zip_url)
+        assert first == tuple(row for row in expected if row["company_id"] == "09355500")
+        assert second == tuple(row for row in expected if row["company_id"] != "09355500")
+
+
+@pytest.mark.usefixtures("mock_companies_house_daily_zip_ranges", "mock_companies_house_daily_html")
+class TestCheckpoint:
+    daily_zip_url = "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip"
+
+    @staticmethod
+    def test_resume_from_checkpoint(httpx_mock: pytest_httpx.HTTPXMock) -> None:
+        data_urls = ("https://download.companieshouse.gov.uk/en_accountsdata.html",)
+
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint_path = pathlib.Path(directory) / "checkpoint.json"
+
+            # Interrupted after the first 4 rows, where the last of these is the only row of the third member
+            with stream_read_xbrl_sync(
+                data_urls=data_urls, checkpoint_path=str(checkpoint_path), checkpoint_interval=1
+            ) as (
+                columns,
+                date_range_and_rows,
+            ):
+                for _, rows in date_range_and_rows:
+                    interrupted_rows = tuple(dict(zip(columns, row)) for row in itertools.islice(rows, 4))
+                    break
+            interrupted_checkpoint = json.loads(checkpoint_path.read_bytes())
+
+            with stream_read_xbrl_sync(
+                data_urls=data_urls, checkpoint_path=str(checkpoint_path), checkpoint_interval=1
+            ) as (
+                columns,
+                date_range_and_rows,
+            ):
+                resumed_rows = tuple(dict(zip(columns, row)) for _, rows in date_range_and_rows for row in rows)
+            finished_checkpoint = json.loads(checkpoint_path.read_bytes())
+
+        expected = get_expected_data(TestCheckpoint.daily_zip_url)
+        assert interrupted_rows == expected[:4]
+        assert interrupted_checkpoint == {
+            "zip_url": TestCheckpoint.daily_zip_url,
+            "etag": '"the-tag"',
+            "member_index": 2,
+            "compressed_offset": 12335,
+            "rows_emitted": 3,
+        }
+        assert resumed_rows == expected[3:]
+        assert any(
+            request.headers.get("range", "").startswith("bytes=12335-")
+            for request in httpx_mock.get_requests(method="GET", url=TestCheckpoint.daily_zip_url)
+        )
+        assert finished_checkpoint == {
+            "zip_url": TestCheckpoint.daily_zip_url,
+            "etag": '"the-tag"',
+            "member_index": 9,
+            "compressed_offset": 68541,
+            "rows_emitted": len(expected),
+        }
+
+    @staticmethod
+    def test_final_checkpoint_once_consumer_moves_past_zip() -> None:
+        data_urls = ("https://download.companieshouse.gov.uk/en_accountsdata.html",)
+
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint_path = pathlib.Path(directory) / "checkpoint.json"
+
+            # All the rows are iterated over, but the consumer stops before moving past the ZIP, for example
+            # before it has committed them
+            with stream_read_xbrl_sync(data_urls=data_urls, checkpoint_path=str(checkpoint_path)) as (
+                _,
+                date_range_and_rows,
+            ):
+                for _, rows in date_range_and_rows:
+                    num_rows = sum(1 for _ in rows)
+                    break
+            checkpoint_exists_when_interrupted = checkpoint_path.exists()
+
+            with stream_read_xbrl_sync(data_urls=data_urls, checkpoint_path=str(checkpoint_path)) as (
+                _,
+                date_range_and_rows,
+            ):
+                resumed_num_rows = sum(1 for _, rows in date_range_and_rows for _ in rows)
+            finished_checkpoint = json.loads(checkpoint_path.read_bytes())
+
+        assert num_rows == len(get_expected_data(TestCheckpoint.daily_zip_url))
+        assert not checkpoint_exists_when_interrupted
+        assert resumed_num_rows == num_rows
+        assert finished_checkpoint["member_index"] == 9  # noqa: PLR2004
+
+
+@pytest.mark.usefixtures("mock_companies_house_daily_zip_ranges", "mock_companies_house_daily_html")
+class TestFetchIncludedMembersOnly:
+    daily_zip_url = "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip"
+
+    @staticmethod
+    def test_only_included_members_fetched(httpx_mock: pytest_httpx.HTTPXMock) -> None:
+        company_ids = {"14033910", "NI681295", "SC722766"}
+        with stream_read_xbrl_sync(
+            data_urls=("https://download.companieshouse.gov.uk/en_accountsdata.html",),
+            member_filter=filter_members(company_ids=company_ids),
+            fetch_included_members_only=True,
+        ) as (columns, date_range_and_rows):
+            rows = tuple(dict(zip(columns, row)) for (_, rows) in date_range_and_rows for row in rows)
+
+        assert rows == tuple(
+            row
+            for row in get_expected_data(TestFetchIncludedMembersOnly.daily_zip_url)
+            if row["company_id"] in company_ids
+        )
+        # After the central directory, each run of consecutive included members is fetched, and then the central
+        # directory again so the stream ends as a ZIP does
+        zip_path = BASE_DIR / "fixtures/Accounts_Bulk_Data-2023-03-02.zip"
+        with zipfile.ZipFile(zip_path) as zip_file:
+            infos = zip_file.infolist()
+            central_directory_offset = zip_file.start_dir
+        member_ranges = tuple(
+            f"bytes={info.header_offset}-{next_offset - 1}"
+            for info, next_offset in zip(
+                infos, (*(info.header_offset for info in infos[1:]), central_directory_offset), strict=True
+            )
+            if info.filename.split("_")[2] in company_ids
+        )
+        ranges_fetched = tuple(
+            request.headers["range"]
+            for request in httpx_mock.get_requests(method="GET", url=TestFetchIncludedMembersOnly.daily_zip_url)
+        )
+        assert ranges_fetched[-len(member_ranges) - 1 :] == (
+            *member_ranges,
+            f"bytes={central_directory_offset}-{zip_path.stat().st_size - 1}",
+        )
+
+    @staticmethod
+    @pytest.mark.httpx_mock(assert_all_responses_were_requested=False)
+    def test_whole_zip_fetched_without_content_length(httpx_mock: pytest_httpx.HTTPXMock) -> None:
+        index_page_url = "https://example.com/accounts.html"
+        zip_url = "https://example.com/Accounts_Bulk_Data-2023-03-02.zip"
+        company_ids = {"14033910", "NI681295", "SC722766"}
+        httpx_mock.add_response(
+            is_reusable=True, url=index_page_url, content=b'<a href="Accounts_Bulk_Data-2023-03-02.zip">Link</a>'
+        )
+        # A streamed response has no content-length header
+        httpx_mock.add_response(is_reusable=True, method="HEAD", url=zip_url, stream=httpx.ByteStream(b""))
+        httpx_mock.add_response(
+            is_reusable=True,
+            method="GET",
+            url=zip_url,
+            content=(BASE_DIR / "fixtures/Accounts_Bulk_Data-2023-03-02.zip").read_bytes(),
+        )
+
+        with stream_read_xbrl_sync(
+            data_urls=(index_page_url,),
+            member_filter=filter_members(company_ids=company_ids),
+            fetch_included_members_only=True,
+        ) as (columns, date_range_and_rows):
+            rows = tuple(dict(zip(columns, row)) for _, rows in date_range_and_rows for row in rows)
+
+        assert rows == tuple(row for row in get_expected_data(zip_url) if row["company_id"] in company_ids)
+        assert all("range" not in request.headers for request in httpx_mock.get_requests(method="GET", url=zip_url))
+
+    @staticmethod
+    @pytest.mark.httpx_mock(assert_all_responses_were_requested=False)
+    def test_whole_zip_fetched_if_ranges_ignored(httpx_mock: pytest_httpx.HTTPXMock) -> None:
+        index_page_url = "https://example.com/accounts.html"
+        zip_url = "https://example.com/Accounts_Bulk_Data-2023-03-02.zip"
+        company_ids = {"14033910", "NI681295", "SC722766"}
+        httpx_mock.add_response(
+            is_reusable=True, url=index_page_url, content=b'<a href="Accounts_Bulk_Data-2023-03-02.zip">Link</a>'
+        )
+        # The range header is ignored, so the whole ZIP is returned for every request
+        httpx_mock.add_response(
+            is_reusable=True,
+            url=zip_url,
+            headers={"etag": '"the-tag"'},
+            content=(BASE_DIR / "fixtures/Accounts_Bulk_Data-2023-03-02.zip").read_bytes(),
+        )
+
+        with stream_read_xbrl_sync(
+            data_urls=(index_page_url,),
+            member_filter=filter_members(company_ids=company_ids),
+            fetch_included_members_only=True,
+        ) as (columns, date_range_and_rows):
+            rows = tuple(dict(zip(columns, row)) for _, rows in date_range_and_rows for row in rows)
+
+        assert rows == tuple(row for row in get_expected_data(zip_url) if row["company_id"] in company_ids)
+
+    @staticmethod
+    @pytest.mark.httpx_mock(assert_all_responses_were_requested=False)
+    @pytest.mark.parametrize(
+        ("validators", "fetched_in_ranges"),
+        [
+            ({"last-modified": "Thu, 02 Mar 2023 06:00:00 GMT"}, True),
+            ({}, False),
+        ],
+    )
+    def test_versions_of_ranges_checked_without_etag(
+        httpx_mock: pytest_httpx.HTTPXMock, validators: dict[str, str], *, fetched_in_ranges: bool
+    ) -> None:
+        index_page_url = "https://example.com/accounts.html"
+        zip_url = "https://example.com/Accounts_Bulk_Data-2023-03-02.zip"
+        company_ids = {"14033910", "NI681295", "SC722766"}
+        httpx_mock.add_response(
+            is_reusable=True, url=index_page_url, content=b'<a href="Accounts_Bulk_Data-2023-03-02.zip">Link</a>'
+        )
+        _add_zip_ranges_callback(httpx_mock, zip_url, validators)
+
+        with stream_read_xbrl_sync(
+            data_urls=(index_page_url,),
+            member_filter=filter_members(company_ids=company_ids),
+            fetch_included_members_only=True,
+        ) as (columns, date_range_and_rows):
+            rows = tuple(dict(zip(columns, row)) for _, rows in date_range_and_rows for row in rows)
+
+        assert rows == tuple(row for row in get_expected_data(zip_url) if row["company_id"] in company_ids)
+        assert fetched_in_ranges == all(
+            "range" in request.headers for request in httpx_mock.get_requests(method="GET", url=zip_url)
+        )
+
+    @staticmethod
+    @pytest.mark.httpx_mock(assert_all_responses_were_requested=False)
+    def test_not_supported_with_checkpoint() -> None:
+        with (
+            pytest.raises(ValueError, match="fetch_included_members_only"),
+            stream_read_xbrl_sync(checkpoint_path="checkpoint.json", fetch_included_members_only=True),
+        ):
+            pass
+
+
+@pytest.mark.usefixtures("mock_companies_house_daily_zip_ranges", "mock_companies_house_daily_html")
+class TestMemberLocations:
+    daily_zip_url = "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip"
+
+    @staticmethod
+    def sync(catalogue_path: str, zip_cache_folder: str | None = None) -> None:
+        with stream_read_xbrl_sync(
+            data_urls=("https://download.companieshouse.gov.uk/en_accountsdata.html",),
+            catalogue_path=catalogue_path,
+            zip_cache_folder=zip_cache_folder,
+            index_members=True,
+        ) as (_, date_range_and_rows):
+            for _, rows in date_range_and_rows:
+                for _row in rows:
+                    pass
+
+    @staticmethod
+    def test_stream_read_xbrl_company(httpx_mock: pytest_httpx.HTTPXMock) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            catalogue_path = str(pathlib.Path(directory) / "catalogue.sqlite")
+            TestMemberLocations.sync(catalogue_path)
+            with closing(sqlite3.connect(catalogue_path)) as catalogue:
+                num_locations = catalogue.execute("SELECT count(*) FROM member_locations").fetchone()[0]
+
+            num_requests = len(httpx_mock.get_requests())
+            with stream_read_xbrl_company("SC720321", catalogue_path) as (columns, rows):
+                company_rows = tuple(dict(zip(columns, row)) for row in rows)
+            lookup_requests = httpx_mock.get_requests()[num_requests:]
+
+        with zipfile.ZipFile(BASE_DIR / "fixtures/Accounts_Bulk_Data-2023-03-02.zip") as zip_file:
+            assert num_locations == len(zip_file.infolist())
+        assert company_rows == tuple(
+            row for row in get_expected_data(TestMemberLocations.daily_zip_url) if row["company_id"] == "SC720321"
+        )
+        # The local header, and then the member itself
+        assert [request.headers.get("range") is not None for request in lookup_requests] == [True, True]
+
+    @staticmethod
+    def test_stream_read_xbrl_company_filtered(httpx_mock: pytest_httpx.HTTPXMock) -> None:
+        row_filter = (("period_end", ">=", date(2023, 1, 1)),)
+        with tempfile.TemporaryDirectory() as directory:
+            catalogue_path = str(pathlib.Path(directory) / "catalogue.sqlite")
+            TestMemberLocations.sync(catalogue_path)
+
+            with stream_read_xbrl_company("SC720321", catalogue_path, row_filter=row_filter) as (columns, rows):
+                company_rows = tuple(dict(zip(columns, row)) for row in rows)
+            num_requests = len(httpx_mock.get_requests())
+            with stream_read_xbrl_company("SC720321", catalogue_path, member_filter=lambda _: False) as (_, rows):
+                excluded_rows = tuple(rows)
+            excluded_requests = httpx_mock.get_requests()[num_requests:]
+
+        assert company_rows == tuple(
+            row
+            for row in get_expected_data(TestMemberLocations.daily_zip_url)
+            if row["company_id"] == "SC720321" and row["period_end"] >= date(2023, 1, 1)
+        )
+        assert len(company_rows) == 1
+        assert excluded_rows == ()
+        assert excluded_requests == []
+
+    @staticmethod
+    def test_stream_read_xbrl_company_zip_removed_from_index_page(httpx_mock: pytest_httpx.HTTPXMock) -> None:
+        daily_index_page_url = "https://download.companieshouse.gov.uk/en_accountsdata.html"
+        monthly_index_page_url = "https://download.companieshouse.gov.uk/en_monthlyaccountsdata.html"
+        monthly_zip_url = "https://download.companieshouse.gov.uk/Accounts_Monthly_Data-July2022.zip"
+        httpx_mock.add_response(
+            is_reusable=True,
+            url=monthly_index_page_url,
+            content=b'<a href="Accounts_Monthly_Data-July2022.zip">Link</a>',
+        )
+        _add_zip_ranges_callback(httpx_mock, monthly_zip_url)
+
+        def sync(catalogue_path: str, data_urls: tuple[str, ...]) -> None:
+            with stream_read_xbrl_sync(data_urls=data_urls, catalogue_path=catalogue_path, index_members=True) as (
+                _,
+                date_range_and_rows,
+            ):
+                for _, rows in date_range_and_rows:
+                    for _row in rows:
+                        pass
+
+        with tempfile.TemporaryDirectory() as directory:
+            catalogue_path = str(pathlib.Path(directory) / "catalogue.sqlite")
+            sync(catalogue_path, (daily_index_page_url, monthly_index_page_url))
+            # The daily ZIP, whose saved locations would otherwise be tried first, is removed from its index page
+            httpx_mock.add_response(is_reusable=True, url=daily_index_page_url, content=b"")
+            sync(catalogue_path, (daily_index_page_url,))
+
+            with closing(sqlite3.connect(catalogue_path)) as catalogue:
+                zip_urls = catalogue.execute("SELECT DISTINCT zip_url FROM member_locations").fetchall()
+            with stream_read_xbrl_company("SC720321", catalogue_path) as (columns, rows):
+                company_rows = tuple(dict(zip(columns, row)) for row in rows)
+
+        assert zip_urls == [(monthly_zip_url,)]
+        assert company_rows == tuple(
+            row for row in get_expected_data(monthly_zip_url) if row["company_id"] == "SC720321"
+        )
+
+    @staticmethod
+    def test_stream_read_xbrl_company_and_debug_from_cache(
+        httpx_mock: pytest_httpx.HTTPXMock, capsysbinary: pytest.CaptureFixture[bytes]
+    ) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            catalogue_path = str(pathlib.Path(directory) / "catalogue.sqlite")
+            TestMemberLocations.sync(catalogue_path, zip_cache_folder=directory)
+            num_requests = len(httpx_mock.get_requests())
+
+            with stream_read_xbrl_company("09355500", catalogue_path, zip_cache_folder=directory) as (columns, rows):
+                company_rows = tuple(dict(zip(columns, row)) for row in rows)
+            capsysbinary.readouterr()
+            stream_read_xbrl_debug(
+                TestMemberLocations.daily_zip_url,
+                "Prod223_3384",
+                "09355500",
+                date(2022, 12, 31),
+                debug_cache_folder=directory,
+                catalogue_path=catalogue_path,
+            )
+            debug_output = capsysbinary.readouterr().out
+
+        with zipfile.ZipFile(BASE_DIR / "fixtures/Accounts_Bulk_Data-2023-03-02.zip") as zip_file:
+            assert debug_output == zip_file.read("Prod223_3384_09355500_20221231.html")
+        assert company_rows == tuple(
+            row for row in get_expected_data(TestMemberLocations.daily_zip_url) if row["company_id"] == "09355500"
+        )
+        assert len(httpx_mock.get_requests()) == num_requests
+
 
 @pytest.mark.usefixtures(
     "mock_companies_house_daily_zip",
@@ -921,7 +1825,16 @@ class TestStreamReadXbrlSyncS3Csv:
 
     @staticmethod
     @mock_aws
-    def test_bench_stream_read_xbrl_sync_s3_csv(benchmark: pytest_benchmark.fixture.BenchmarkFixture) -> None:
+    @pytest.mark.parametrize(
+        ("compression", "extension", "decompress"),
+        [
+            ("gzip", ".csv.gz", gzip.decompress),
+            ("zstd", ".csv.zst", lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data)),
+        ],
+    )
+    def test_stream_read_xbrl_sync_s3_csv_compressed(
+        compression: str, extension: str, decompress: typing.Callable[[bytes], bytes]
+    ) -> None:
         region_name: typing.Final = "eu-west-2"
         bucket_name = "my-bucket"
         key_prefix = "my-prefix/"  # Would usually end in a forward slash
@@ -933,36 +1846,1162 @@ class TestStreamReadXbrlSyncS3Csv:
                 "LocationConstraint": region_name,
             },
         )
-        benchmark(stream_read_xbrl_sync_s3_csv, s3_client, bucket_name, key_prefix)
 
+        # Files from before compression was used should not be fetched again
+        s3_client.put_object(
+            Bucket=bucket_name, Key=f"{key_prefix}2022-07-01--2022-07-31.csv", Body="should-not-be-overwritten"
+        )
 
-@pytest.mark.usefixtures("mock_companies_house_historic_zip_2008")
-@pytest.mark.benchmark(group="TestDebug")
-@mock_aws
-class TestDebug:
-    @staticmethod
-    def test_debug() -> None:
-        # Just asserts it doesn't explode
-        with tempfile.TemporaryDirectory() as directory:
-            stream_read_xbrl_debug(
-                "https://download.companieshouse.gov.uk/Accounts_Monthly_Data-JanuaryToDecember2008.zip",
-                "Prod223_3384",
-                "09355500",
-                date.fromisoformat("2022-12-31"),
-                debug_cache_folder=directory,
-            )
+        stream_read_xbrl_sync_s3_csv(s3_client, bucket_name, key_prefix, compression=compression)
+
+        expected_data_str = [
+            {key: str(value) if value is not None else "" for key, value in row.items()}
+            for row in get_expected_data("https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip")
+        ]
+
+        assert [content["Key"] for content in s3_client.list_objects_v2(Bucket=bucket_name)["Contents"]] == [
+            f"{key_prefix}2022-07-01--2022-07-31.csv",
+            f"{key_prefix}2023-03-02--2023-03-02{extension}",
+        ]
+        response = s3_client.get_object(Bucket=bucket_name, Key=f"{key_prefix}2023-03-02--2023-03-02{extension}")
+        assert response["ContentEncoding"] == compression
+        assert expected_data_str == list(csv.DictReader(decompress(response["Body"].read()).decode().splitlines()))
 
     @staticmethod
-    def test_bench_debug(benchmark: pytest_benchmark.fixture.BenchmarkFixture) -> None:
-        with tempfile.TemporaryDirectory() as directory:
-            benchmark(
-                stream_read_xbrl_debug,
-                "https://download.companieshouse.gov.uk/Accounts_Monthly_Data-JanuaryToDecember2008.zip",
-                "Prod223_3384",
-                "09355500",
-                date.fromisoformat("2022-12-31"),
-                debug_cache_folder=directory,
-            )
+    @mock_aws
+    def test_stream_read_xbrl_sync_s3_csv_partitioned() -> None:
+        region_name: typing.Final = "eu-west-2"
+        bucket_name = "my-bucket"
+        key_prefix = "my-prefix/"  # Would usually end in a forward slash
+
+        s3_client = boto3.client("s3", region_name=region_name)
+        s3_client.create_bucket(
+            Bucket=bucket_name,
+            CreateBucketConfiguration={
+                "LocationConstraint": region_name,
+            },
+        )
+        s3_client.put_object(
+            Bucket=bucket_name, Key=f"{key_prefix}2022-07-01--2022-07-31.csv", Body="should-not-be-overwritten"
+        )
+
+        stream_read_xbrl_sync_s3_csv(s3_client, bucket_name, key_prefix, partition_by=partition_by_balance_sheet_year)
+
+        expected_data_str = [
+            {key: str(value) if value is not None else "" for key, value in row.items()}
+            for row in get_expected_data("https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip")
+        ]
+        years = sorted({row["balance_sheet_date"][:4] for row in expected_data_str})
+        partition_keys = [f"{key_prefix}balance_sheet_year={year}/2023-03-02--2023-03-02.csv" for year in years]
+
+        assert [content["Key"] for content in s3_client.list_objects_v2(Bucket=bucket_name)["Contents"]] == [
+            f"{key_prefix}2022-07-01--2022-07-31.csv",
+            *partition_keys,
+        ]
+        assert sorted(expected_data_str, key=lambda row: sorted(row.items())) == sorted(
+            (
+                row
+                for key in partition_keys
+                for row in csv.DictReader(
+                    s3_client.get_object(Bucket=bucket_name, Key=key)["Body"].read().decode().splitlines()
+                )
+            ),
+            key=lambda row: sorted(row.items()),
+        )
+
+    @staticmethod
+    @mock_aws
+    def test_stream_read_xbrl_sync_s3_csv_partitioned_max_buffered_bytes() -> None:
+        region_name: typing.Final = "eu-west-2"
+        bucket_name = "my-bucket"
+        key_prefix = "my-prefix/"  # Would usually end in a forward slash
+        num_buckets = 4
+
+        s3_client = boto3.client("s3", region_name=region_name)
+        s3_client.create_bucket(
+            Bucket=bucket_name,
+            CreateBucketConfiguration={
+                "LocationConstraint": region_name,
+            },
+        )
+
+        s3_client.put_object(Bucket=bucket_name, Key=f"{key_prefix}2022-07-01--2022-07-31.csv", Body="")
+
+        # Far smaller than the minimum size of a part, so files are completed early
+        stream_read_xbrl_sync_s3_csv(
+            s3_client,
+            bucket_name,
+            key_prefix,
+            partition_by=partition_by_company_id_bucket(num_buckets),
+            max_buffered_bytes=1,
+        )
+
+        expected_data_str = [
+            {key: str(value) if value is not None else "" for key, value in row.items()}
+            for row in get_expected_data("https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip")
+        ]
+        keys = [
+            content["Key"]
+            for content in s3_client.list_objects_v2(Bucket=bucket_name)["Contents"]
+            if content["Key"].endswith("2023-03-02--2023-03-02.csv")
+        ]
+
+        assert len(keys) > num_buckets
+        assert sorted(expected_data_str, key=lambda row: sorted(row.items())) == sorted(
+            (
+                row
+                for key in keys
+                for row in csv.DictReader(
+                    s3_client.get_object(Bucket=bucket_name, Key=key)["Body"].read().decode().splitlines()
+                )
+            ),
+            key=lambda row: sorted(row.items()),
+        )
+
+    @staticmethod
+    @mock_aws
+    def test_stream_read_xbrl_sync_s3_csv_partitioned_max_open_partitions(monkeypatch: pytest.MonkeyPatch) -> None:
+        region_name: typing.Final = "eu-west-2"
+        bucket_name = "my-bucket"
+        key_prefix = "my-prefix/"  # Would usually end in a forward slash
+        num_buckets = 4
+        max_open_partitions = 2
+        num_open = 0
+        max_num_open = 0
+
+        class CountedMultipartUpload(stream_read_xbrl._MultipartUpload):  # noqa: SLF001
+            def __init__(self, *args: typing.Any, **kwargs: typing.Any) -> None:  # noqa: ANN401
+                nonlocal num_open, max_num_open
+                super().__init__(*args, **kwargs)
+                num_open += 1
+                max_num_open = max(max_num_open, num_open)
+
+            def complete(self) -> None:
+                nonlocal num_open
+                super().complete()
+                num_open -= 1
+
+        monkeypatch.setattr(stream_read_xbrl, "_MultipartUpload", CountedMultipartUpload)
+        s3_client = boto3.client("s3", region_name=region_name)
+        s3_client.create_bucket(
+            Bucket=bucket_name,
+            CreateBucketConfiguration={
+                "LocationConstraint": region_name,
+            },
+        )
+        s3_client.put_object(Bucket=bucket_name, Key=f"{key_prefix}2022-07-01--2022-07-31.csv", Body="")
+
+        stream_read_xbrl_sync_s3_csv(
+            s3_client,
+            bucket_name,
+            key_prefix,
+            partition_by=partition_by_company_id_bucket(num_buckets),
+            max_open_partitions=max_open_partitions,
+        )
+
+        expected_data_str = [
+            {key: str(value) if value is not None else "" for key, value in row.items()}
+            for row in get_expected_data("https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip")
+        ]
+        keys = [
+            content["Key"]
+            for content in s3_client.list_objects_v2(Bucket=bucket_name)["Contents"]
+            if content["Key"].endswith("2023-03-02--2023-03-02.csv")
+        ]
+
+        assert max_num_open == max_open_partitions
+        assert len(keys) > num_buckets
+        assert sorted(expected_data_str, key=lambda row: sorted(row.items())) == sorted(
+            (
+                row
+                for key in keys
+                for row in csv.DictReader(
+                    s3_client.get_object(Bucket=bucket_name, Key=key)["Body"].read().decode().splitlines()
+                )
+            ),
+            key=lambda row: sorted(row.items()),
+        )
+
+    @staticmethod
+    @mock_aws
+    def test_stream_read_xbrl_sync_s3_csv_manifest() -> None:
+        region_name: typing.Final = "eu-west-2"
+        bucket_name = "my-bucket"
+        key_prefix = "my-prefix/"  # Would usually end in a forward slash
+        manifest_key = "my-manifest.json"
+
+        s3_client = boto3.client("s3", region_name=region_name)
+        s3_client.create_bucket(
+            Bucket=bucket_name,
+            CreateBucketConfiguration={
+                "LocationConstraint": region_name,
+            },
+        )
+
+        # A file from a sync that did not complete, and so is not in the manifest
+        s3_client.put_object(Bucket=bucket_name, Key=f"{key_prefix}2023-03-02--2023-03-02.csv", Body="incomplete")
+        s3_client.put_object(
+            Bucket=bucket_name,
+            Key=manifest_key,
+            Body=json.dumps({"zip_files": [{"start_date": "2022-07-01", "end_date": "2022-07-31", "files": []}]}),
+        )
+
+        stream_read_xbrl_sync_s3_csv(s3_client, bucket_name, key_prefix, manifest_key=manifest_key)
+
+        manifest = json.loads(s3_client.get_object(Bucket=bucket_name, Key=manifest_key)["Body"].read())
+        key = f"{key_prefix}2023-03-02--2023-03-02.csv"
+        expected_data_str = [
+            {key: str(value) if value is not None else "" for key, value in row.items()}
+            for row in get_expected_data("https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip")
+        ]
+
+        assert [(zip_file["start_date"], zip_file["end_date"]) for zip_file in manifest["zip_files"]] == [
+            ("2022-07-01", "2022-07-31"),
+            ("2023-03-02", "2023-03-02"),
+        ]
+        zip_file_manifest_key = "my-manifest/2023-03-02--2023-03-02.json"
+        assert manifest["zip_files"][1]["manifest_key"] == zip_file_manifest_key
+        zip_file_manifest = json.loads(
+            s3_client.get_object(Bucket=bucket_name, Key=zip_file_manifest_key)["Body"].read()
+        )
+        assert zip_file_manifest["completed_at"] == manifest["zip_files"][1]["completed_at"]
+        (file,) = zip_file_manifest["files"]
+        assert file["key"] == key
+        assert file["size"] == s3_client.head_object(Bucket=bucket_name, Key=key)["ContentLength"]
+        assert file["num_rows"] == len(expected_data_str)
+        assert file["columns"]["balance_sheet_date"] == {
+            "null_count": 0,
+            "min": min(row["balance_sheet_date"] for row in expected_data_str),
+            "max": max(row["balance_sheet_date"] for row in expected_data_str),
+        }
+        assert expected_data_str == list(
+            csv.DictReader(s3_client.get_object(Bucket=bucket_name, Key=key)["Body"].read().decode().splitlines())
+        )
+
+        # Only the manifest is used to find where the previous sync finished
+        s3_client.delete_object(Bucket=bucket_name, Key=key)
+        stream_read_xbrl_sync_s3_csv(s3_client, bucket_name, key_prefix, manifest_key=manifest_key)
+        assert [content["Key"] for content in s3_client.list_objects_v2(Bucket=bucket_name)["Contents"]] == [
+            manifest_key,
+            zip_file_manifest_key,
+        ]
+
+    @staticmethod
+    @mock_aws
+    @pytest.mark.parametrize("sync", [stream_read_xbrl_sync_s3_csv, stream_read_xbrl_sync_s3_parquet])
+    def test_part_size_too_small(httpx_mock: pytest_httpx.HTTPXMock, sync: typing.Callable[..., None]) -> None:
+        s3_client = boto3.client("s3", region_name="eu-west-2")
+
+        with pytest.raises(ValueError, match="part_size"):
+            sync(s3_client, "my-bucket", "my-prefix/", part_size=5 * 1048576 - 1)
+
+        assert httpx_mock.get_requests() == []
+
+    @staticmethod
+    def test_partition_by_company_id_bucket() -> None:
+        partition = partition_by_company_id_bucket(16)
+        rows = [tuple(row.values()) for row in expected_data]
+        assert {partition(row) for row in rows} <= {f"company_id_bucket={bucket:02}" for bucket in range(16)}
+        assert partition(rows[0]) == partition(rows[0][:2] + (None,) * (len(rows[0]) - 2))
+
+    @staticmethod
+    @mock_aws
+    def test_bench_stream_read_xbrl_sync_s3_csv(benchmark: pytest_benchmark.fixture.BenchmarkFixture) -> None:
+        region_name: typing.Final = "eu-west-2"
+        bucket_name = "my-bucket"
+        key_prefix = "my-prefix/"  # Would usually end in a forward slash
+
+        s3_client = boto3.client("s3", region_name=region_name)
+        s3_client.create_bucket(
+            Bucket=bucket_name,
+            CreateBucketConfiguration={
+                "LocationConstraint": region_name,
+            },
+        )
+        benchmark(stream_read_xbrl_sync_s3_csv, s3_client, bucket_name, key_prefix)
+
+    @staticmethod
+    @mock_aws
+    @pytest.mark.parametrize("max_upload_concurrency", [1, 4])
+    def test_bench_stream_read_xbrl_sync_s3_csv_upload_concurrency(
+        benchmark: pytest_benchmark.fixture.BenchmarkFixture, max_upload_concurrency: int
+    ) -> None:
+        region_name: typing.Final = "eu-west-2"
+        bucket_name = "my-bucket"
+        key_prefix = "my-prefix/"  # Would usually end in a forward slash
+
+        s3_client = boto3.client("s3", region_name=region_name)
+        s3_client.create_bucket(
+            Bucket=bucket_name,
+            CreateBucketConfiguration={
+                "LocationConstraint": region_name,
+            },
+        )
+        benchmark(
+            stream_read_xbrl_sync_s3_csv,
+            s3_client,
+            bucket_name,
+            key_prefix,
+            max_upload_concurrency=max_upload_concurrency,
+        )
+
+
+@pytest.mark.usefixtures(
+    "mock_companies_house_daily_zip",
+    "mock_companies_house_daily_html",
+    "mock_companies_house_monthly_html",
+    "mock_companies_house_monthly_zip",
+    "mock_companies_house_historic_html",
+    "mock_companies_house_historic_zip_2008",
+    "mock_companies_house_historic_zip_2009",
+)
+@pytest.mark.httpx_mock(assert_all_responses_were_requested=False)
+@pytest.mark.benchmark(group="TestStreamReadXbrlSyncSqlite", warmup=False)
+class TestStreamReadXbrlSyncSqlite:
+    @staticmethod
+    def test_stream_read_xbrl_sync_sqlite() -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            database_path = str(pathlib.Path(tmpdir) / "accounts.sqlite")
+            stream_read_xbrl_sync_sqlite(database_path)
+
+            with closing(sqlite3.connect(database_path)) as connection:
+                connection.row_factory = sqlite3.Row
+                rows = connection.execute("SELECT * FROM accounts").fetchall()
+                zip_files = connection.execute("SELECT start_date, end_date FROM zip_files").fetchall()
+                indexes = {
+                    row["name"] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+                }
+
+            # Every ZIP file has the same rows, so they are upserted over each other, and only those from the
+            # latest ZIP file remain
+            keys = {(row["company_id"], row["date"], row["period_start"], row["period_end"]) for row in expected_data}
+            assert len(rows) == len(keys)
+            assert {row["zip_url"] for row in rows} == {
+                "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip"
+            }
+            assert {(row["company_id"], row["date"], row["period_start"], row["period_end"]) for row in rows} == {
+                (
+                    company_id,
+                    str(row_date),
+                    str(period_start) if period_start else None,
+                    str(period_end) if period_end else None,
+                )
+                for company_id, row_date, period_start, period_end in keys
+            }
+            assert ("2023-03-02", "2023-03-02") in [tuple(zip_file) for zip_file in zip_files]
+            assert "accounts_balance_sheet_date" in indexes
+
+            stream_read_xbrl_sync_sqlite(database_path)
+            with closing(sqlite3.connect(database_path)) as connection:
+                assert connection.execute("SELECT count(*) FROM accounts").fetchone()[0] == len(keys)
+                assert connection.execute("SELECT count(*) FROM zip_files").fetchone()[0] == len(zip_files)
+
+    @staticmethod
+    def test_stream_read_xbrl_sync_sqlite_exact_decimals() -> None:
+        decimal_columns = tuple(
+            column for column in expected_data[0] if any(isinstance(row[column], Decimal) for row in expected_data)
+        )
+        zip_url = "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip"
+        expected = {
+            (row["company_id"], str(row["date"]), str(row["period_start"]), str(row["period_end"])): tuple(
+                row[column] for column in decimal_columns
+            )
+            for row in get_expected_data(zip_url)
+        }
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            database_path = str(pathlib.Path(tmpdir) / "accounts.sqlite")
+            stream_read_xbrl_sync_sqlite(database_path)
+
+            with closing(sqlite3.connect(database_path)) as connection:
+                types = {
+                    name: column_type for _, name, column_type, *_ in connection.execute("PRAGMA table_info(accounts)")
+                }
+                zip_files_primary_key = [
+                    name for _, name, _, _, _, pk in connection.execute("PRAGMA table_info(zip_files)") if pk
+                ]
+                rows = connection.execute(
+                    f"SELECT company_id, date, period_start, period_end, {', '.join(decimal_columns)} FROM accounts"  # noqa: S608
+                ).fetchall()
+
+        assert {types[column] for column in decimal_columns} == {"TEXT"}
+        assert zip_files_primary_key == ["start_date", "end_date"]
+        assert all(isinstance(value, str) for row in rows for value in row[4:] if value is not None)
+        for company_id, row_date, period_start, period_end, *values in rows:
+            key = (company_id, row_date, str(period_start), str(period_end))
+            assert tuple(None if value is None else Decimal(value) for value in values) == expected[key]
+
+    @staticmethod
+    def test_stream_read_xbrl_sync_sqlite_parse_cache() -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            parse_cache_folder = pathlib.Path(tmpdir) / "parse-cache"
+            database_paths = (str(pathlib.Path(tmpdir) / "first.sqlite"), str(pathlib.Path(tmpdir) / "second.sqlite"))
+            for database_path in database_paths:
+                stream_read_xbrl_sync_sqlite(database_path, parse_cache_folder=str(parse_cache_folder))
+            databases_rows = []
+            for database_path in database_paths:
+                with closing(sqlite3.connect(database_path)) as connection:
+                    databases_rows.append(connection.execute("SELECT * FROM accounts ORDER BY 1, 2, 3, 4").fetchall())
+
+            assert any(path.suffix == ".json" for path in parse_cache_folder.rglob("*"))
+            assert databases_rows[0] == databases_rows[1]
+
+    @staticmethod
+    def test_bench_stream_read_xbrl_sync_sqlite(benchmark: pytest_benchmark.fixture.BenchmarkFixture) -> None:
+        with stream_read_xbrl_sync() as (_columns, date_range_and_rows):
+            num_rows = sum(1 for _date_range, rows in date_range_and_rows for _row in rows)
+
+        def load() -> None:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                stream_read_xbrl_sync_sqlite(str(pathlib.Path(tmpdir) / "accounts.sqlite"))
+
+        benchmark(load)
+        if benchmark.stats is not None:
+            benchmark.extra_info["rows/s"] = num_rows / benchmark.stats.stats.mean
+
+
+@pytest.mark.usefixtures(
+    "mock_companies_house_daily_zip",
+    "mock_companies_house_daily_html",
+    "mock_companies_house_monthly_html",
+    "mock_companies_house_monthly_zip",
+    "mock_companies_house_historic_html",
+    "mock_companies_house_historic_zip_2008",
+    "mock_companies_house_historic_zip_2009",
+)
+@pytest.mark.httpx_mock(assert_all_responses_were_requested=False)
+class TestStreamReadXbrlSyncSnapshot:
+    # Every ZIP file has the same rows, so all the changes are from the earliest
+    earliest_zip_url = "https://download.companieshouse.gov.uk/Accounts_Monthly_Data-JanuaryToDecember2008.zip"
+
+    @staticmethod
+    def test_stream_read_xbrl_sync_snapshot() -> None:
+        def sync(snapshot_path: str) -> tuple[dict[str, typing.Any], ...]:
+            with stream_read_xbrl_sync_snapshot(snapshot_path) as (columns, date_range_and_changes):
+                return tuple(dict(zip(columns, row)) for _, changes in date_range_and_changes for row in changes)
+
+        def rank(row: dict[str, typing.Any]) -> tuple[str, ...]:
+            return (
+                *(row[column].isoformat() if row[column] else "" for column in ("date", "period_end", "period_start")),
+                row["run_code"],
+            )
+
+        latest: dict[str, dict[str, typing.Any]] = {}
+        for row in get_expected_data(TestStreamReadXbrlSyncSnapshot.earliest_zip_url):
+            if row["company_id"] not in latest or rank(row) > rank(latest[row["company_id"]]):
+                latest[row["company_id"]] = row
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            snapshot_path = str(pathlib.Path(tmpdir) / "snapshot.sqlite")
+            first = sync(snapshot_path)
+            second = sync(snapshot_path)
+
+            # As if the snapshot had an older filing of one company, and the ZIP file had not been processed
+            with closing(sqlite3.connect(snapshot_path)) as connection:
+                connection.execute("UPDATE companies SET date = '2020-01-01' WHERE company_id = 'SC720321'")
+                connection.execute("DELETE FROM zip_files")
+                connection.commit()
+            third = sync(snapshot_path)
+
+        assert first == tuple(latest[company_id] for company_id in sorted(latest))
+        assert second == ()
+        assert third == (latest["SC720321"],)
+
+
+@pytest.mark.benchmark(group="TestCsv", warmup=True)
+class TestCsv:
+    rows = tuple((*(row[column] for column in expected_data[0]), None) for row in expected_data * 10_000)
+
+    @staticmethod
+    def test_stream_write_xbrl_csv_same_as_row_by_row() -> None:
+        columns = (*expected_data[0].keys(), "zip_url")
+        row_by_row = io.StringIO()
+        csv_writer = csv.writer(row_by_row, quoting=csv.QUOTE_NONNUMERIC)
+        csv_writer.writerow(columns)
+        for row in TestCsv.rows[:1000]:
+            csv_writer.writerow(row)
+
+        block_size = 10_000
+        blocks = tuple(stream_write_xbrl_csv(columns, TestCsv.rows[:1000], block_size=block_size, batch_size=7))
+
+        assert b"".join(blocks) == row_by_row.getvalue().encode("utf-8")
+        assert all(len(block) >= block_size for block in blocks[:-1])
+
+    @staticmethod
+    def test_bench_stream_write_xbrl_csv(benchmark: pytest_benchmark.fixture.BenchmarkFixture) -> None:
+        columns = (*expected_data[0].keys(), "zip_url")
+        num_bytes = benchmark(lambda: sum(len(block) for block in stream_write_xbrl_csv(columns, TestCsv.rows)))
+        if benchmark.stats is not None:
+            benchmark.extra_info["MB/s"] = num_bytes / benchmark.stats.stats.mean / 1_000_000
+
+
+@pytest.mark.benchmark(group="TestPgcopy", warmup=True)
+class TestPgcopy:
+    @staticmethod
+    def test_stream_write_xbrl_pgcopy() -> None:
+        columns = ("company_id", "date", "company_dormant", "cash_bank_in_hand", "error")
+        rows = (
+            ("0123", date(2000, 1, 2), True, Decimal("-1234.5"), None),
+            ("é", date(1999, 12, 31), False, Decimal("0.00"), None),
+        )
+
+        assert b"".join(stream_write_xbrl_pgcopy(columns, rows)) == bytes.fromhex(
+            # Signature, flags, and header extension length
+            "5047434f50590aff0d0a00 00000000 00000000 "
+            # First row: 5 fields, "0123", 2000-01-02, true, -1234.5, NULL
+            "0005 "
+            "00000004 30313233 "
+            "00000004 00000001 "
+            "00000001 01 "
+            "0000000c 0002 0000 4000 0001 04d2 1388 "
+            "ffffffff "
+            # Second row: 5 fields, "é", 1999-12-31, false, 0.00, NULL
+            "0005 "
+            "00000002 c3a9 "
+            "00000004 ffffffff "
+            "00000001 00 "
+            "00000008 0000 0000 0000 0002 "
+            "ffffffff "
+            # Trailer
+            "ffff"
+        )
+
+    @staticmethod
+    def test_stream_write_xbrl_pgcopy_numeric() -> None:
+        columns = ("cash_bank_in_hand",)
+        header_and_num_fields = 19 + 2
+        numerics = {
+            "100000000": "0000000a 0001 0002 0000 0000 0001",
+            "0.0001": "0000000a 0001 ffff 0000 0004 0001",
+            "12345.678": "0000000e 0003 0001 0000 0003 0001 0929 1a7c",
+            "1E-10": "0000000a 0001 fffd 0000 000a 0064",
+            "NaN": "00000008 0000 0000 c000 0000",
+        }
+        for value, expected in numerics.items():
+            pgcopy = b"".join(stream_write_xbrl_pgcopy(columns, ((Decimal(value),),)))
+            assert pgcopy[header_and_num_fields:-2] == bytes.fromhex(expected)
+
+    @staticmethod
+    def test_stream_write_xbrl_pgcopy_numeric_out_of_range(caplog: pytest.LogCaptureFixture) -> None:
+        columns = ("run_code", "company_id", "cash_bank_in_hand", "zip_url")
+        rows = (
+            ("Prod223_3383", "00001346", Decimal("1E+200000"), "https://example.com/a.zip"),
+            ("Prod223_3383", "00001347", Decimal("1E-20000"), "https://example.com/a.zip"),
+        )
+        with caplog.at_level(logging.WARNING):
+            pgcopy = b"".join(stream_write_xbrl_pgcopy(columns, rows))
+
+        assert pgcopy == b"".join(stream_write_xbrl_pgcopy(columns, tuple((*row[:2], None, row[3]) for row in rows)))
+        warnings = [record.getMessage() for record in caplog.records if "NUMERIC" in record.getMessage()]
+        assert len(warnings) == len(rows)
+        assert all("cash_bank_in_hand" in warning for warning in warnings)
+        assert "company_id: 00001346" in warnings[0]
+        assert "zip_url: https://example.com/a.zip" in warnings[0]
+
+    @staticmethod
+    def test_stream_write_xbrl_pgcopy_blocks() -> None:
+        columns = (*expected_data[0].keys(), "zip_url")
+        block_size = 10_000
+        blocks = tuple(stream_write_xbrl_pgcopy(columns, TestCsv.rows[:1000], block_size=block_size))
+
+        assert len(blocks) > 1
+        assert all(len(block) >= block_size for block in blocks[:-1])
+        assert b"".join(blocks).endswith(b"\xff\xff")
+
+    @staticmethod
+    def test_bench_stream_write_xbrl_pgcopy(benchmark: pytest_benchmark.fixture.BenchmarkFixture) -> None:
+        columns = (*expected_data[0].keys(), "zip_url")
+        num_bytes = benchmark(lambda: sum(len(block) for block in stream_write_xbrl_pgcopy(columns, TestCsv.rows)))
+        if benchmark.stats is not None:
+            benchmark.extra_info["MB/s"] = num_bytes / benchmark.stats.stats.mean / 1_000_000
+
+
+@pytest.mark.usefixtures("mock_companies_house_daily_zip")
+class TestParquet:
+    @staticmethod
+    def test_stream_write_xbrl_parquet() -> None:
+        with (
+            httpx.stream("GET", "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip") as r,
+            stream_read_xbrl_zip(r.iter_bytes(chunk_size=65536)) as (columns, rows),
+        ):
+            parquet_file = pq.ParquetFile(io.BytesIO(b"".join(stream_write_xbrl_parquet(columns, rows, 5))))
+
+        assert parquet_file.metadata.num_row_groups == len(range(0, len(expected_data), 5))
+        assert str(parquet_file.schema_arrow.field("date").type) == "date32[day]"
+        assert str(parquet_file.schema_arrow.field("company_dormant").type) == "bool"
+        assert str(parquet_file.schema_arrow.field("turnover_gross_operating_revenue").type) == "decimal128(38, 6)"
+        statistics = parquet_file.metadata.row_group(0).column(columns.index("date")).statistics
+        assert statistics is not None
+        assert statistics.has_min_max
+        assert tuple(parquet_file.read().to_pylist()) == get_expected_data(None)
+
+    @staticmethod
+    def test_stream_read_xbrl_zip_arrow() -> None:
+        batch_size = 5
+        with (
+            httpx.stream("GET", "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip") as r,
+            stream_read_xbrl_zip_arrow(r.iter_bytes(chunk_size=65536), batch_size=batch_size) as (schema, batches),
+        ):
+            table = pa.Table.from_batches(tuple(batches), schema)
+
+        assert all(batch.num_rows <= batch_size for batch in table.to_batches())
+        assert str(schema.field("turnover_gross_operating_revenue").type) == "decimal128(38, 6)"
+        assert tuple(table.to_pylist()) == get_expected_data(None)
+
+    @staticmethod
+    def test_stream_read_xbrl_zip_arrow_parse_cache() -> None:
+        with (
+            tempfile.TemporaryDirectory() as directory,
+            httpx.stream("GET", "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip") as r,
+            stream_read_xbrl_zip_arrow(r.iter_bytes(chunk_size=65536), parse_cache_folder=directory) as (
+                schema,
+                batches,
+            ),
+        ):
+            table = pa.Table.from_batches(tuple(batches), schema)
+            cached = list(pathlib.Path(directory).rglob("*.json"))
+
+        assert tuple(table.to_pylist()) == get_expected_data(None)
+        assert cached
+
+    @staticmethod
+    @pytest.mark.httpx_mock(assert_all_responses_were_requested=False)
+    def test_stream_write_xbrl_parquet_decimal_out_of_range(caplog: pytest.LogCaptureFixture) -> None:
+        columns = ("company_id", "cash_bank_in_hand")
+        rows = (("00001346", Decimal("1E+40")), ("00001347", Decimal("1.5")))
+        with caplog.at_level(logging.WARNING):
+            table = pq.read_table(io.BytesIO(b"".join(stream_write_xbrl_parquet(columns, rows))))
+
+        assert table.to_pylist() == [
+            {"company_id": "00001346", "cash_bank_in_hand": None},
+            {"company_id": "00001347", "cash_bank_in_hand": Decimal("1.500000")},
+        ]
+        warnings = [record.getMessage() for record in caplog.records if "DECIMAL" in record.getMessage()]
+        assert len(warnings) == 1
+        assert "cash_bank_in_hand" in warnings[0]
+        assert "company_id: 00001346" in warnings[0]
+
+    @staticmethod
+    @mock_aws
+    @pytest.mark.usefixtures("mock_companies_house_daily_html")
+    @pytest.mark.httpx_mock(assert_all_responses_were_requested=False)
+    def test_stream_read_xbrl_sync_s3_parquet(httpx_mock: pytest_httpx.HTTPXMock) -> None:
+        region_name: typing.Final = "eu-west-2"
+        bucket_name = "my-bucket"
+        key_prefix = "my-prefix/"  # Would usually end in a forward slash
+
+        for url in (
+            "https://download.companieshouse.gov.uk/en_monthlyaccountsdata.html",
+            "https://download.companieshouse.gov.uk/historicmonthlyaccountsdata.html",
+        ):
+            httpx_mock.add_response(is_reusable=True, url=url, content=b"")
+
+        s3_client = boto3.client("s3", region_name=region_name)
+        s3_client.create_bucket(
+            Bucket=bucket_name,
+            CreateBucketConfiguration={
+                "LocationConstraint": region_name,
+            },
+        )
+        s3_client.put_object(Bucket=bucket_name, Key=f"{key_prefix}2023-03-02--2023-03-02.csv", Body=b"")
+
+        stream_read_xbrl_sync_s3_parquet(s3_client, bucket_name, key_prefix)
+
+        parquet_file = pq.ParquetFile(
+            io.BytesIO(
+                s3_client.get_object(Bucket=bucket_name, Key=f"{key_prefix}2023-03-02--2023-03-02.parquet")[
+                    "Body"
+                ].read()
+            )
+        )
+        assert tuple(parquet_file.read().to_pylist()) == get_expected_data(
+            "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip"
+        )
+
+
+@pytest.mark.usefixtures("mock_companies_house_daily_zip")
+@pytest.mark.httpx_mock(assert_all_responses_were_requested=False)
+@pytest.mark.benchmark(group="TestPandas", warmup=False)
+class TestPandas:
+    @staticmethod
+    def test_read_xbrl_zip_pandas() -> None:
+        chunksize = 5
+        with (
+            httpx.stream("GET", "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip") as r,
+            read_xbrl_zip_pandas(r.iter_bytes(chunk_size=65536), chunksize=chunksize) as data_frames,
+        ):
+            chunks = tuple(data_frames)
+        df = pd.concat(chunks)
+
+        assert all(len(chunk) <= chunksize for chunk in chunks)
+        assert tuple(df.index) == tuple(range(len(expected_data)))
+        assert str(df["run_code"].dtype) == "category"
+        assert str(df["company_dormant"].dtype) == "boolean"
+        assert str(df["date"].dtype).startswith("datetime64")
+        assert str(df["turnover_gross_operating_revenue"].dtype) == "float64"
+        assert tuple(df["company_id"]) == tuple(row["company_id"] for row in expected_data)
+        assert tuple(df["date"].dt.date) == tuple(row["date"] for row in expected_data)
+        assert tuple(df["company_dormant"].astype(object).where(df["company_dormant"].notna(), None)) == tuple(
+            row["company_dormant"] for row in expected_data
+        )
+
+    @staticmethod
+    def test_read_xbrl_zip_pandas_decimal_scale() -> None:
+        with (
+            httpx.stream("GET", "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip") as r,
+            read_xbrl_zip_pandas(r.iter_bytes(chunk_size=65536), decimal_scale=2) as data_frames,
+        ):
+            df = pd.concat(tuple(data_frames))
+
+        assert str(df["cash_bank_in_hand"].dtype) == "Int64"
+        assert tuple(None if pd.isna(value) else value for value in df["cash_bank_in_hand"]) == tuple(
+            None if row["cash_bank_in_hand"] is None else int(typing.cast("Decimal", row["cash_bank_in_hand"]) * 100)
+            for row in expected_data
+        )
+
+    @staticmethod
+    def test_read_xbrl_zip_pandas_parse_cache() -> None:
+        with (
+            tempfile.TemporaryDirectory() as directory,
+            httpx.stream("GET", "https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip") as r,
+            read_xbrl_zip_pandas(r.iter_bytes(chunk_size=65536), parse_cache_folder=directory) as data_frames,
+        ):
+            df = pd.concat(tuple(data_frames))
+            cached = list(pathlib.Path(directory).rglob("*.json"))
+
+        assert tuple(df["company_id"]) == tuple(row["company_id"] for row in expected_data)
+        assert cached
+
+    @staticmethod
+    def test_read_xbrl_zip_pandas_decimal_scale_out_of_range(caplog: pytest.LogCaptureFixture) -> None:
+        columns = ("run_code", "company_id", "cash_bank_in_hand", "zip_url")
+        rows = (
+            ("Prod223_3383", "00001346", Decimal("1E+20"), "https://example.com/a.zip"),
+            ("Prod223_3383", "00001347", Decimal("1.5"), "https://example.com/a.zip"),
+        )
+        with caplog.at_level(logging.WARNING):
+            df = pd.concat(tuple(stream_read_xbrl._pandas_data_frames(columns, rows, 100, 2)))  # noqa: SLF001
+
+        assert tuple(None if pd.isna(value) else value for value in df["cash_bank_in_hand"]) == (None, 150)
+        warnings = [record.getMessage() for record in caplog.records if "Int64" in record.getMessage()]
+        assert len(warnings) == 1
+        assert "cash_bank_in_hand" in warnings[0]
+        assert "company_id: 00001346" in warnings[0]
+        assert "zip_url: https://example.com/a.zip" in warnings[0]
+
+    @staticmethod
+    def _zip_file() -> bytes:
+        # The members of the fixture ZIP repeated, to make a ZIP large enough for memory use to be measurable
+        with pathlib.Path.open(BASE_DIR / "fixtures/Accounts_Bulk_Data-2023-03-02.zip", "rb") as f:
+            members = tuple((name, b"".join(chunks)) for name, _, chunks in stream_unzip((f.read(),)))
+        modified_at = datetime.now().astimezone()
+        return b"".join(
+            stream_zip(
+                (name.decode(), modified_at, 0o600, ZIP_32, (content,)) for _ in range(10) for name, content in members
+            )
+        )
+
+    @staticmethod
+    def _peak_memory(func: typing.Callable[[], None]) -> int:
+        tracemalloc.start()
+        try:
+            func()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    @staticmethod
+    def test_bench_pandas_data_frame(benchmark: pytest_benchmark.fixture.BenchmarkFixture) -> None:
+        zip_file = TestPandas._zip_file()
+
+        def read() -> None:
+            with stream_read_xbrl_zip((zip_file,)) as (columns, rows):
+                pd.DataFrame(rows, columns=columns)
+
+        benchmark(read)
+        benchmark.extra_info["peak_memory"] = TestPandas._peak_memory(read)
+
+    @staticmethod
+    def test_bench_read_xbrl_zip_pandas(benchmark: pytest_benchmark.fixture.BenchmarkFixture) -> None:
+        zip_file = TestPandas._zip_file()
+
+        def read() -> None:
+            with read_xbrl_zip_pandas((zip_file,), chunksize=1000) as data_frames:
+                for _df in data_frames:
+                    pass
+
+        benchmark(read)
+        benchmark.extra_info["peak_memory"] = TestPandas._peak_memory(read)
+
+
+@pytest.mark.usefixtures("mock_companies_house_daily_html")
+@pytest.mark.httpx_mock(assert_all_responses_were_requested=False)
+class TestS3MultipartUpload:
+    @staticmethod
+    @mock_aws
+    def test_upload_aborted_if_zip_truncated(httpx_mock: pytest_httpx.HTTPXMock) -> None:
+        region_name: typing.Final = "eu-west-2"
+        bucket_name = "my-bucket"
+        key_prefix = "my-prefix/"  # Would usually end in a forward slash
+
+        content = (BASE_DIR / "fixtures/Accounts_Bulk_Data-2023-03-02.zip").read_bytes()
+        content = content[: len(content) // 2]
+        httpx_mock.add_response(
+            is_reusable=True,
+            url="https://download.companieshouse.gov.uk/Accounts_Bulk_Data-2023-03-02.zip",
+            content=content,
+            headers={
+                "etag": '"the-tag"',
+                "content-range": f"0-{len(content) - 1}/{len(content)}",
+                "content-length": str(len(content)),
+            },
+        )
+        for url in (
+            "https://download.companieshouse.gov.uk/en_monthlyaccountsdata.html",
+            "https://download.companieshouse.gov.uk/historicmonthlyaccountsdata.html",
+        ):
+            httpx_mock.add_response(is_reusable=True, url=url, content=b"")
+
+        s3_client = boto3.client("s3", region_name=region_name)
+        s3_client.create_bucket(
+            Bucket=bucket_name,
+            CreateBucketConfiguration={
+                "LocationConstraint": region_name,
+            },
+        )
+
+        with pytest.raises(TruncatedDataError):
+            stream_read_xbrl_sync_s3_csv(s3_client, bucket_name, key_prefix)
+
+        assert "Uploads" not in s3_client.list_multipart_uploads(Bucket=bucket_name)
+        assert "Contents" not in s3_client.list_objects_v2(Bucket=bucket_name)
+
+        # Including the files of partitions that were completed early
+        with pytest.raises(TruncatedDataError):
+            stream_read_xbrl_sync_s3_csv(
+                s3_client,
+                bucket_name,
+                key_prefix,
+                partition_by=partition_by_company_id_bucket(4),
+                max_buffered_bytes=1,
+            )
+
+        assert "Uploads" not in s3_client.list_multipart_uploads(Bucket=bucket_name)
+        assert "Contents" not in s3_client.list_objects_v2(Bucket=bucket_name)
+
+
+class TestSinks:
+    columns = (*expected_data[0].keys(), "zip_url")
+    date_range_and_rows = (
+        ((date(2023, 1, 1), date(2023, 1, 1)), TestCsv.rows[:2500]),
+        ((date(2023, 1, 2), date(2023, 1, 2)), TestCsv.rows[:10]),
+    )
+
+    @staticmethod
+    def test_stream_xbrl_to_sinks() -> None:
+        collected: list[tuple[tuple[date, date], list[tuple[typing.Any, ...]]]] = []
+        csv_files: list[bytes] = []
+        first_rows: list[tuple[typing.Any, ...]] = []
+
+        def collect(date_range: tuple[date, date], _: tuple[str, ...], rows: typing.Iterable[typing.Any]) -> None:
+            collected.append((date_range, list(rows)))
+
+        def write_csv(_: tuple[date, date], columns: tuple[str, ...], rows: typing.Iterable[typing.Any]) -> None:
+            csv_files.append(b"".join(stream_write_xbrl_csv(columns, rows)))
+
+        def first_row_only(_: tuple[date, date], __: tuple[str, ...], rows: typing.Iterable[typing.Any]) -> None:
+            first_rows.append(next(iter(rows)))
+
+        stream_xbrl_to_sinks(
+            TestSinks.columns,
+            TestSinks.date_range_and_rows,
+            (collect, write_csv, first_row_only),
+            max_buffered_bytes=100_000,
+            batch_size=7,
+        )
+
+        assert collected == [(date_range, list(rows)) for date_range, rows in TestSinks.date_range_and_rows]
+        assert csv_files == [
+            b"".join(stream_write_xbrl_csv(TestSinks.columns, rows)) for _, rows in TestSinks.date_range_and_rows
+        ]
+        assert first_rows == [rows[0] for _, rows in TestSinks.date_range_and_rows]
+
+    @staticmethod
+    def test_stream_xbrl_to_sinks_inside_except_block() -> None:
+        collected: list[tuple[typing.Any, ...]] = []
+
+        def collect(_: tuple[date, date], __: tuple[str, ...], rows: typing.Iterable[typing.Any]) -> None:
+            collected.extend(rows)
+
+        try:
+            error_msg = "Unrelated error"
+            raise ValueError(error_msg)  # noqa: TRY301
+        except ValueError:
+            stream_xbrl_to_sinks(TestSinks.columns, TestSinks.date_range_and_rows, (collect,), batch_size=7)
+
+        assert collected == [row for _, rows in TestSinks.date_range_and_rows for row in rows]
+
+    @staticmethod
+    def test_stream_xbrl_to_sinks_next_zip_after_all_sinks_done() -> None:
+        events: list[tuple[str, date]] = []
+
+        def date_range_and_rows() -> typing.Generator[tuple[tuple[date, date], typing.Any], None, None]:
+            for date_range, rows in TestSinks.date_range_and_rows:
+                yield date_range, rows
+                # Where stream_read_xbrl_sync marks the ZIP as processed
+                events.append(("processed", date_range[0]))
+
+        def slow(date_range: tuple[date, date], __: tuple[str, ...], rows: typing.Iterable[typing.Any]) -> None:
+            for _row in rows:
+                pass
+            time.sleep(0.2)
+            events.append(("slow", date_range[0]))
+
+        def fast(date_range: tuple[date, date], __: tuple[str, ...], rows: typing.Iterable[typing.Any]) -> None:
+            next(iter(rows))
+            events.append(("fast", date_range[0]))
+
+        stream_xbrl_to_sinks(TestSinks.columns, date_range_and_rows(), (slow, fast), batch_size=7)
+
+        for date_range, _ in TestSinks.date_range_and_rows:
+            processed_index = events.index(("processed", date_range[0]))
+            assert events.index(("slow", date_range[0])) < processed_index
+            assert events.index(("fast", date_range[0])) < processed_index
+
+    @staticmethod
+    def test_stream_xbrl_to_sinks_max_buffered_bytes() -> None:
+        num_rows = 100
+        num_rows_requested = 0
+        release = threading.Event()
+
+        def rows() -> typing.Generator[tuple[typing.Any, ...], None, None]:
+            nonlocal num_rows_requested
+            for row in TestCsv.rows[:num_rows]:
+                num_rows_requested += 1
+                yield row
+
+        def blocked(_: tuple[date, date], __: tuple[str, ...], rows: typing.Iterable[typing.Any]) -> None:
+            release.wait()
+            for _row in rows:
+                pass
+
+        thread = threading.Thread(
+            target=stream_xbrl_to_sinks,
+            args=(TestSinks.columns, (((date(2023, 1, 1), date(2023, 1, 1)), rows()),), (blocked,)),
+            kwargs={"max_buffered_bytes": 1, "batch_size": 1},
+        )
+        thread.start()
+        time.sleep(0.5)
+        num_rows_requested_while_blocked = num_rows_requested
+        release.set()
+        thread.join()
+
+        # A batch is always buffered when there's nothing else buffered, and the next is then waiting to be
+        assert num_rows_requested_while_blocked == 2  # noqa: PLR2004
+        assert num_rows_requested == num_rows
+
+    @staticmethod
+    def test_stream_xbrl_to_sinks_raises_sink_exception() -> None:
+        def collect(_: tuple[date, date], __: tuple[str, ...], rows: typing.Iterable[typing.Any]) -> None:
+            for _row in rows:
+                pass
+
+        def fail(_: tuple[date, date], __: tuple[str, ...], rows: typing.Iterable[typing.Any]) -> None:
+            next(iter(rows))
+            error_msg = "Sink failed"
+            raise ValueError(error_msg)
+
+        with pytest.raises(ValueError, match="Sink failed"):
+            stream_xbrl_to_sinks(
+                TestSinks.columns,
+                TestSinks.date_range_and_rows,
+                (collect, fail),
+                max_buffered_bytes=1,
+                batch_size=1,
+            )
+
+
+@pytest.mark.usefixtures("mock_companies_house_historic_zip_2008")
+@pytest.mark.benchmark(group="TestDebug")
+@mock_aws
+class TestDebug:
+    @staticmethod
+    def test_debug() -> None:
+        # Just asserts it doesn't explode
+        with tempfile.TemporaryDirectory() as directory:
+            stream_read_xbrl_debug(
+                "https://download.companieshouse.gov.uk/Accounts_Monthly_Data-JanuaryToDecember2008.zip",
+                "Prod223_3384",
+                "09355500",
+                date.fromisoformat("2022-12-31"),
+                debug_cache_folder=directory,
+            )
+
+    @staticmethod
+    @pytest.mark.httpx_mock(assert_all_responses_were_requested=False)
+    def test_debug_without_etag(httpx_mock: pytest_httpx.HTTPXMock, capsysbinary: pytest.CaptureFixture[bytes]) -> None:
+        zip_url = "https://example.com/Accounts_Bulk_Data-2023-03-02.zip"
+        with zipfile.ZipFile(BASE_DIR / "fixtures/Accounts_Bulk_Data-2023-03-02.zip") as f:
+            member = f.read("Prod223_3384_09355500_20221231.html")
+        # A server that doesn't support HEAD or range requests, and doesn't send an ETag
+        httpx_mock.add_response(is_reusable=True, method="HEAD", url=zip_url, status_code=405)
+        httpx_mock.add_response(
+            is_reusable=True,
+            method="GET",
+            url=zip_url,
+            content=(BASE_DIR / "fixtures/Accounts_Bulk_Data-2023-03-02.zip").read_bytes(),
+        )
+
+        with tempfile.TemporaryDirectory() as directory:
+            for _ in range(2):
+                stream_read_xbrl_debug(
+                    zip_url, "Prod223_3384", "09355500", date.fromisoformat("2022-12-31"), debug_cache_folder=directory
+                )
+                assert capsysbinary.readouterr().out == member
+            cached = list(pathlib.Path(directory).iterdir())
+
+        assert cached == []
+        assert all("range" not in request.headers for request in httpx_mock.get_requests(method="GET"))
+
+    @staticmethod
+    @pytest.mark.httpx_mock(assert_all_responses_were_requested=False)
+    def test_debug_without_etag_cached_by_last_modified_and_size(
+        httpx_mock: pytest_httpx.HTTPXMock, capsysbinary: pytest.CaptureFixture[bytes]
+    ) -> None:
+        zip_url = "https://example.com/Accounts_Bulk_Data-2023-03-02.zip"
+        content = (BASE_DIR / "fixtures/Accounts_Bulk_Data-2023-03-02.zip").read_bytes()
+        with zipfile.ZipFile(BASE_DIR / "fixtures/Accounts_Bulk_Data-2023-03-02.zip") as f:
+            member = f.read("Prod223_3384_09355500_20221231.html")
+        validators = {"last-modified": "Thu, 02 Mar 2023 00:00:00 GMT", "content-length": str(len(content))}
+        # A server that doesn't send an ETag, but does send a Last-Modified and Content-Length
+        httpx_mock.add_response(is_reusable=True, method="HEAD", url=zip_url, headers=validators)
+        httpx_mock.add_response(method="GET", url=zip_url, headers=validators, content=content)
+
+        with tempfile.TemporaryDirectory() as directory:
+            for _ in range(2):
+                stream_read_xbrl_debug(
+                    zip_url, "Prod223_3384", "09355500", date.fromisoformat("2022-12-31"), debug_cache_folder=directory
+                )
+                assert capsysbinary.readouterr().out == member
+
+            # A new version of the file is downloaded again
+            httpx_mock.add_response(
+                is_reusable=True,
+                method="HEAD",
+                url=zip_url,
+                headers={**validators, "last-modified": "Fri, 03 Mar 2023 00:00:00 GMT"},
+            )
+            httpx_mock.add_response(method="GET", url=zip_url, headers=validators, content=content)
+            stream_read_xbrl_debug(
+                zip_url, "Prod223_3384", "09355500", date.fromisoformat("2022-12-31"), debug_cache_folder=directory
+            )
+            assert capsysbinary.readouterr().out == member
+            cached = sorted(path.suffix for path in pathlib.Path(directory).iterdir())
+            (metadata_path,) = pathlib.Path(directory).glob("*.json")
+            metadata = json.loads(metadata_path.read_bytes())
+
+        assert len(httpx_mock.get_requests(method="GET")) == 2  # noqa: PLR2004
+        assert all("range" not in request.headers for request in httpx_mock.get_requests(method="GET"))
+        # The GET's Last-Modified didn't match the HEAD's, so the second download wasn't cached over the first
+        assert cached == ["", ".json"]
+        assert metadata == {
+            "url": zip_url,
+            "etag": None,
+            "last_modified": "Thu, 02 Mar 2023 00:00:00 GMT",
+            "size": len(content),
+        }
+
+    @staticmethod
+    def test_bench_debug(benchmark: pytest_benchmark.fixture.BenchmarkFixture) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            benchmark(
+                stream_read_xbrl_debug,
+                "https://download.companieshouse.gov.uk/Accounts_Monthly_Data-JanuaryToDecember2008.zip",
+                "Prod223_3384",
+                "09355500",
+                date.fromisoformat("2022-12-31"),
+                debug_cache_folder=directory,
+            )
+
+
+def test_bad_xml(caplog: pytest.LogCaptureFixture) -> None:
+    bad_xml = b"Not XML " * 100_000
+    name = "Prod223_3383_00001346_20220930.html"
+    member_files = (
+        (name, datetime.now().astimezone(), 0o600, ZIP_32, (bad_xml,)),
+        ("Prod223_3383_00001347_20220930.html", datetime.now().astimezone(), 0o600, ZIP_32, (bad_xml,)),
+    )
+
+    with tempfile.TemporaryDirectory() as directory, caplog.at_level(logging.INFO):
+        bad_xml_folder = pathlib.Path(directory) / "bad-xml"
+        with stream_read_xbrl_zip(stream_zip(member_files), bad_xml_folder=str(bad_xml_folder)) as (columns, rows):
+            errors = [dict(zip(columns, row))["error"] for row in rows]
+        saved = {path.name: path.read_bytes() for path in bad_xml_folder.iterdir()}
+
+        # The workers' warnings are not captured, so the warning is checked by parsing in this process
+        stream_read_xbrl._xbrl_to_rows((name, bad_xml))  # noqa: SLF001
+
+    assert errors == [None, None]
+    assert saved == {f"{hashlib.sha256(bad_xml).hexdigest()}.html": bad_xml}
+    assert "2 of 2 members of None parsed had bad XML" in caplog.text
+    assert f"Size: {len(bad_xml)}" in caplog.text
+    assert len(caplog.text) < len(bad_xml) // 100
+
+
+@pytest.mark.parametrize("use_parse_cache", [False, True])
+def test_bad_xml_counted_when_rows_filtered_out(caplog: pytest.LogCaptureFixture, *, use_parse_cache: bool) -> None:
+    bad_xml = b"Not XML " * 100
+    member_files = (
+        ("Prod223_3383_00001346_20220930.html", datetime.now().astimezone(), 0o600, ZIP_32, (bad_xml,)),
+        ("Prod223_3383_00001347_20220930.html", datetime.now().astimezone(), 0o600, ZIP_32, (bad_xml,)),
+    )
+
+    with tempfile.TemporaryDirectory() as directory, caplog.at_level(logging.INFO):
+        # The second time, the rows and whether the XML was bad come from the parse cache
+        for _ in range(2 if use_parse_cache else 1):
+            caplog.clear()
+            with stream_read_xbrl_zip(
+                stream_zip(member_files),
+                row_filter=(("company_id", "==", "not-a-company"),),
+                parse_cache_folder=directory if use_parse_cache else None,
+            ) as (_, rows):
+                assert list(rows) == []
+
+    assert "2 of 2 members of None parsed had bad XML" in caplog.text
+
+
+@mock_aws
+@pytest.mark.parametrize("sync", ["s3_csv", "s3_parquet", "sqlite", "snapshot"])
+def test_syncs_pass_bad_xml_folder(monkeypatch: pytest.MonkeyPatch, sync: str) -> None:
+    region_name: typing.Final = "eu-west-2"
+    bucket_name = "my-bucket"
+    sync_kwargs: dict[str, typing.Any] = {}
+
+    @contextmanager
+    def stream_read_xbrl_sync(
+        *_: typing.Any,  # noqa: ANN401
+        **kwargs: typing.Any,  # noqa: ANN401
+    ) -> typing.Generator[tuple[tuple[str, ...], typing.Iterator[typing.Any]], None, None]:
+        sync_kwargs.update(kwargs)
+        yield (), iter(())
+
+    monkeypatch.setattr(stream_read_xbrl, "stream_read_xbrl_sync", stream_read_xbrl_sync)
+    s3_client = boto3.client("s3", region_name=region_name)
+    s3_client.create_bucket(Bucket=bucket_name, CreateBucketConfiguration={"LocationConstraint": region_name})
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = str(pathlib.Path(directory) / "accounts.sqlite")
+        if sync == "s3_csv":
+            stream_read_xbrl_sync_s3_csv(s3_client, bucket_name, "my-prefix/", bad_xml_folder="bad-xml")
+        elif sync == "s3_parquet":
+            stream_read_xbrl_sync_s3_parquet(s3_client, bucket_name, "my-prefix/", bad_xml_folder="bad-xml")
+        elif sync == "sqlite":
+            stream_read_xbrl_sync_sqlite(database_path, bad_xml_folder="bad-xml")
+        else:
+            with stream_read_xbrl_sync_snapshot(database_path, bad_xml_folder="bad-xml") as (_, changes):
+                tuple(changes)
+
+    assert sync_kwargs["bad_xml_folder"] == "bad-xml"
 
 
 def test_entity_current_legal_name_in_span() -> None: